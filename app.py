@@ -1,6 +1,8 @@
+import time
+_import_started = time.perf_counter()
+
 import os
 import math
-import time
 import shutil
 import threading
 import logging
@@ -9,18 +11,30 @@ import uuid
 import glob
 from pathlib import Path
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from flask import Flask, request, render_template, jsonify, send_file, session
+from urllib.parse import quote, unquote, urljoin, urlsplit
+from flask import Flask, request, render_template, jsonify, send_file, send_from_directory, session, url_for, g
 from werkzeug.utils import secure_filename
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_STORED
 import io
+import json
 import subprocess
-from telethon import TelegramClient, functions, types
-from telethon.errors import RPCError
 from dotenv import load_dotenv
-from flask_session import Session
+from flask.sessions import SessionInterface
 import secrets
-import psutil
+import sqlite3
+import hashlib
+import struct
+import tempfile
+import itertools
+import queue
+import heapq
+import re
+import socket
+import ipaddress
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
 
 # Load environment variables
 load_dotenv()
@@ -30,60 +44,1250 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 # Constants
-MAX_SIZE_MB = 2048
+MAX_SIZE_MB = 2000  # Telegram's per-file limit: 4000 chunks of 512 KB
+PREMIUM_MAX_SIZE_MB = 4000  # Premium accounts may send 8000 chunks
+MIN_PART_SIZE_MB = 50
+PREMIUM_CHECK_BACKOFF = 60  # Seconds before retrying a failed Premium check, doubling per failure
+PREMIUM_CHECK_MAX_BACKOFF = 3600
+INGEST_MAX_REDIRECTS = 5
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+                'medium', 'slow', 'slower', 'veryslow']
+TRANSCODE_SIZE_MARGIN = 0.97  # Headroom for container overhead and rate control overshoot
+MP4_EXTENSIONS = {'.mp4', '.mov'}
+STREAMABLE_UPLOAD_EXTENSIONS = {'.mp4'}  # Telegram clients only stream MP4 in-app
+UPLOAD_PART_SIZE_KB = 512  # Largest chunk Telegram accepts per upload request
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024  # Above this Telegram wants SaveBigFilePart uploads
+THUMBNAIL_DIR = '.thumbs'  # Hidden so it is never mistaken for a part
+THUMBNAIL_MAX_SIDE = 320  # Telegram ignores thumbnails larger than 320px
+TRASH_DIR = '.trash'  # Deleted paths wait here, on the same filesystem, for the deletion worker
+RESTORE_DIR = '.restore'  # Under the split folder, so offloaded restores can be served like parts
+MANIFEST_SUFFIX = '.manifest.json'  # Hidden per-job manifest with part sizes and hashes
+HASH_ALGORITHM = 'sha256'
+HASH_BLOCK_SIZE = 1024 * 1024  # hashlib drops the GIL for large blocks, so pool threads use every core
+PART_CAPTION_RE = re.compile(r'^(?P<filename>.+) - Part (?P<index>\d+)/(?P<total>\d+)$')  # background_upload captions
+STATIC_MAX_AGE = 365 * 24 * 3600  # Static assets are versioned by mtime
+PIPE_FRIENDLY_EXTENSIONS = {'.mkv', '.webm', '.ts'}  # Containers ffmpeg can demux from a pipe
+SEGMENT_LIST_NAME = '.segments.csv'  # Written by the segment muxer as each part completes
+STREAM_SEGMENT_MARGIN = 0.9  # Segments cut at the next keyframe, so aim below the part size
 
 # Telegram credentials
 api_id = int(os.getenv("API_ID", 0))
 api_hash = os.getenv("API_HASH", "")
 if not api_id or not api_hash:
     logger.error("Telegram API credentials not found in environment variables")
+# Upload accounts: user sessions in telegram_session/<name> and/or bot tokens
+telegram_session_names = [s.strip() for s in os.getenv("TELEGRAM_SESSIONS", "session").split(',') if s.strip()]
+telegram_bot_tokens = [t.strip() for t in os.getenv("TELEGRAM_BOT_TOKENS", "").split(',') if t.strip()]
+telegram_destination = os.getenv("TELEGRAM_DESTINATION", "me")  # Chat/channel id or username
+# Chats visitors may pick for uploads and restores; anything else is refused
+telegram_allowed_destinations = [
+    d.strip() for d in os.getenv("TELEGRAM_ALLOWED_DESTINATIONS", telegram_destination).split(',') if d.strip()
+]
 
 # Flask setup
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET", secrets.token_hex(32))
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024 * 1024  # 100 GB limit
-app.config['UPLOAD_FOLDER'] = os.path.abspath('uploads')
-app.config['BASE_SPLIT_FOLDER'] = os.path.abspath(os.path.expanduser('~/Downloads/video_splitter'))
+# Point both at shared storage when split and upload jobs run on worker.py nodes
+app.config['UPLOAD_FOLDER'] = os.path.abspath(os.getenv('UPLOAD_FOLDER', 'uploads'))
+app.config['BASE_SPLIT_FOLDER'] = os.path.abspath(os.path.expanduser(
+    os.getenv('BASE_SPLIT_FOLDER', '~/Downloads/video_splitter')
+))
 app.config['ALLOWED_EXTENSIONS'] = ALLOWED_EXTENSIONS
+# 'cookie' keeps only the session id in a signed cookie; 'filesystem' uses Flask-Session
+app.config['SESSION_BACKEND'] = os.getenv('SESSION_BACKEND', 'cookie').lower()
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['SESSION_FILE_DIR'] = './flask_session'
+app.config['SESSION_STORE_PATH'] = os.path.abspath(os.getenv('SESSION_STORE_PATH', 'session_files.db'))
+app.config['SESSION_FILES_TTL'] = int(os.getenv('SESSION_FILES_TTL', 7200))  # Forget idle sessions' files
+app.config['UPLOAD_LEDGER_PATH'] = os.path.abspath(os.getenv('UPLOAD_LEDGER_PATH', 'upload_ledger.db'))
+app.config['UPLOAD_LEDGER_TTL'] = int(os.getenv('UPLOAD_LEDGER_TTL', 86400))  # Telegram drops unfinished uploads
+# SQLite file on shared storage; when set, /process and /upload_to_telegram queue jobs for worker.py
+app.config['JOB_STORE'] = os.getenv('JOB_STORE', '')
+app.config['JOB_LEASE_SECONDS'] = int(os.getenv('JOB_LEASE_SECONDS', 60))  # Requeue jobs of workers silent this long
+app.config['JOB_HEARTBEAT_SECONDS'] = float(os.getenv('JOB_HEARTBEAT_SECONDS', 2))  # Lease renewal and progress sync
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))  # Claims before a job is marked failed
+app.config['JOB_CLAIM_TIMEOUT'] = int(os.getenv('JOB_CLAIM_TIMEOUT', 300))  # Fail jobs no worker takes this long
 app.config['CLEANUP_INTERVAL'] = 300  # Cleanup every 5 minutes
+app.config['PARALLEL_SPLIT'] = os.getenv('PARALLEL_SPLIT', '0') == '1'  # Extract parts concurrently
+app.config['SPLIT_MAX_WORKERS'] = int(os.getenv('SPLIT_MAX_WORKERS', 4))  # Cap for disk bandwidth
+# Re-encode mode for /process (mode=transcode)
+app.config['TRANSCODE_PRESET'] = os.getenv('TRANSCODE_PRESET', 'medium')
+app.config['TRANSCODE_RATE_CONTROL'] = os.getenv('TRANSCODE_RATE_CONTROL', '2pass')  # '2pass' or 'crf'
+app.config['TRANSCODE_CRF'] = int(os.getenv('TRANSCODE_CRF', 23))
+app.config['TRANSCODE_MAX_VIDEO_KBPS'] = int(os.getenv('TRANSCODE_MAX_VIDEO_KBPS', 0))  # 0 for no cap
+# Share of the source video bitrate that re-encoded parts aim for, which sets how many parts there are
+app.config['TRANSCODE_TARGET_RATIO'] = float(os.getenv('TRANSCODE_TARGET_RATIO', 0.6))
+app.config['TRANSCODE_AUDIO_KBPS'] = int(os.getenv('TRANSCODE_AUDIO_KBPS', 128))
+# '+faststart' moves the moov atom to the front; '+frag_keyframe+empty_moov' writes fragmented MP4
+app.config['MP4_MOVFLAGS'] = os.getenv('MP4_MOVFLAGS', '+faststart')
+app.config['GENERATE_THUMBNAILS'] = os.getenv('GENERATE_THUMBNAILS', '1') == '1'
+# Remote URL ingest
+app.config['INGEST_CONNECTIONS'] = int(os.getenv('INGEST_CONNECTIONS', 4))  # Parallel range requests
+app.config['INGEST_RANGE_MB'] = int(os.getenv('INGEST_RANGE_MB', 16))  # Bytes per range request
+app.config['INGEST_BUFFER_KB'] = int(os.getenv('INGEST_BUFFER_KB', 1024))  # Read/write buffer
+app.config['INGEST_PROBE_MB'] = int(os.getenv('INGEST_PROBE_MB', 8))  # Head bytes used to detect the container
+# Loopback, private and link-local hosts are refused unless this is set (e.g. for a local test server)
+app.config['INGEST_ALLOW_LOCAL'] = os.getenv('INGEST_ALLOW_LOCAL', '0') == '1'
+app.config['MAX_UPLOAD_DESTINATIONS'] = int(os.getenv('MAX_UPLOAD_DESTINATIONS', 20))
+app.config['UPLOAD_CONNECTIONS'] = int(os.getenv('UPLOAD_CONNECTIONS', 4))  # Sender connections per upload
+app.config['UPLOAD_WINDOW'] = int(os.getenv('UPLOAD_WINDOW', 8))  # Chunks of one part in flight at once
+# Chunks held in memory between the browser and Telegram in a passthrough upload
+app.config['PASSTHROUGH_BUFFER_CHUNKS'] = int(os.getenv('PASSTHROUGH_BUFFER_CHUNKS', 16))
+app.config['RESTORE_CONNECTIONS'] = int(os.getenv('RESTORE_CONNECTIONS', 4))  # Parallel downloads when restoring
+app.config['RESTORE_RANGE_MB'] = int(os.getenv('RESTORE_RANGE_MB', 64))  # Bytes per ranged download request
+# Fair sharing between users; rates in KB/s, 0 means unlimited
+app.config['UPLOAD_RATE_LIMIT'] = int(os.getenv('UPLOAD_RATE_LIMIT', 0))  # All Telegram uploads together
+app.config['SESSION_UPLOAD_RATE_LIMIT'] = int(os.getenv('SESSION_UPLOAD_RATE_LIMIT', 0))  # Each browser session
+app.config['SPLIT_CONCURRENCY'] = int(os.getenv('SPLIT_CONCURRENCY', 2))  # Splits running at once; the rest queue
+# Admission control: past these limits new work is answered with 503 + Retry-After and a queue ticket
+app.config['ADMISSION_MAX_CPU'] = float(os.getenv('ADMISSION_MAX_CPU', 90))  # System CPU percent
+app.config['ADMISSION_MAX_FFMPEG'] = int(os.getenv('ADMISSION_MAX_FFMPEG', 2 * (os.cpu_count() or 1)))
+app.config['ADMISSION_MAX_DISK_BUSY'] = float(os.getenv('ADMISSION_MAX_DISK_BUSY', 90))  # Percent of time busy
+app.config['ADMISSION_MAX_UPLOADS'] = int(os.getenv('ADMISSION_MAX_UPLOADS', 8))  # Telegram uploads in flight
+app.config['ADMISSION_RETRY_AFTER'] = int(os.getenv('ADMISSION_RETRY_AFTER', 10))  # Seconds
+app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN', '')  # Enables /admin endpoints via the X-Admin-Token header
+app.config['PROFILE_DIR'] = os.path.abspath(os.getenv('PROFILE_DIR', 'profiles'))  # cProfile output for admins
+app.config['PROFILE_MAX_FILES'] = int(os.getenv('PROFILE_MAX_FILES', 50))  # Oldest profiles are removed beyond this
+# Download offload: '' streams from Python, 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd)
+app.config['DOWNLOAD_OFFLOAD'] = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+app.config['OFFLOAD_INTERNAL_PREFIX'] = os.getenv('OFFLOAD_INTERNAL_PREFIX', '/protected_splits')
+app.config['OFFLOAD_EXPIRY'] = int(os.getenv('OFFLOAD_EXPIRY', 1800))  # Seconds before offloaded files are removed
+app.config['DELETE_RATE_MB'] = int(os.getenv('DELETE_RATE_MB', 256))  # Background unlink budget per second, 0 = unlimited
 
 # Create directories if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['BASE_SPLIT_FOLDER'], exist_ok=True)
-os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
 logger.info(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
 logger.info(f"Split folder: {app.config['BASE_SPLIT_FOLDER']}")
 
+# Endpoints polled by the page that never touch the session
+SESSIONLESS_PATH_PREFIXES = ('/progress/', '/upload_status/', '/ingest_status/', '/static/', '/thumbnail/',
+                             '/accounts', '/admin/', '/restore_status/', '/job_status/')
+
+class SelectiveSessionInterface(SessionInterface):
+    """Skip session loading and saving entirely for polling and asset requests"""
+    def __init__(self, inner):
+        self.inner = inner
+    
+    def open_session(self, app, request):
+        if request.path.startswith(SESSIONLESS_PATH_PREFIXES):
+            return self.make_null_session(app)
+        return self.inner.open_session(app, request)
+    
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return
+        return self.inner.save_session(app, session, response)
+
 # Initialize session
-Session(app)
+if app.config['SESSION_BACKEND'] == 'filesystem':
+    from flask_session import Session
+    os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
+    Session(app)
+app.session_interface = SelectiveSessionInterface(app.session_interface)
+
+class SQLiteStore:
+    """Base for small SQLite-backed stores shared by all worker processes"""
+    journal_mode = 'WAL'
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+    
+    def _connect(self):
+        # One connection per thread; WAL lets several workers share the file
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+class SessionFileStore(SQLiteStore):
+    """Uploads and split folders per session, kept in SQLite and expired after a TTL"""
+    def __init__(self, db_path, ttl):
+        super().__init__(db_path)
+        self.ttl = ttl
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_files (
+                session_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (session_id, kind, path)
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS session_files_expiry ON session_files (expires_at)')
+    
+    def add(self, session_id, kind, path):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO session_files VALUES (?, ?, ?, ?)',
+            (session_id, kind, path, time.time() + self.ttl)
+        )
+    
+    def remove(self, session_id, kind, path):
+        self._connect().execute(
+            'DELETE FROM session_files WHERE session_id = ? AND kind = ? AND path = ?',
+            (session_id, kind, path)
+        )
+    
+    def paths(self, session_id, kind):
+        rows = self._connect().execute(
+            'SELECT path FROM session_files WHERE session_id = ? AND kind = ?',
+            (session_id, kind)
+        )
+        return [path for path, in rows]
+    
+    def purge_expired(self):
+        """Forget entries past their TTL, returning how many were dropped"""
+        cursor = self._connect().execute(
+            'DELETE FROM session_files WHERE expires_at < ?', (time.time(),)
+        )
+        return cursor.rowcount
+
+class UploadLedger(SQLiteStore):
+    """Telegram file ids and acknowledged chunks per part, plus where each part was sent
+
+    Survives restarts, so a retried upload only sends the chunks and parts
+    Telegram doesn't have yet.
+    """
+    def __init__(self, db_path, ttl):
+        super().__init__(db_path)
+        self.ttl = ttl
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS upload_files (
+                upload_key TEXT PRIMARY KEY,
+                file_id INTEGER NOT NULL,
+                total_chunks INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                upload_key TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                PRIMARY KEY (upload_key, chunk)
+            );
+            CREATE TABLE IF NOT EXISTS part_sends (
+                part_key TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                sent_at REAL NOT NULL,
+                caption TEXT,
+                PRIMARY KEY (part_key, destination)
+            );
+        """)
+        conn = self._connect()
+        # Ledgers written before captions were recorded
+        if 'caption' not in {row[1] for row in conn.execute('PRAGMA table_info(part_sends)')}:
+            conn.execute('ALTER TABLE part_sends ADD COLUMN caption TEXT')
+    
+    def begin(self, upload_key, total_chunks, chunk_size):
+        """File id and acknowledged chunks for an upload, starting over if it is stale or changed"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT file_id, total_chunks, chunk_size, updated_at FROM upload_files WHERE upload_key = ?',
+            (upload_key,)
+        ).fetchone()
+        if row and row[1] == total_chunks and row[2] == chunk_size and row[3] > time.time() - self.ttl:
+            chunks = conn.execute('SELECT chunk FROM upload_chunks WHERE upload_key = ?', (upload_key,))
+            return row[0], {chunk for chunk, in chunks}
+        
+        self.forget(upload_key)
+        file_id = secrets.randbits(63)
+        conn.execute(
+            'INSERT INTO upload_files VALUES (?, ?, ?, ?, ?)',
+            (upload_key, file_id, total_chunks, chunk_size, time.time())
+        )
+        return file_id, set()
+    
+    def ack(self, upload_key, chunk):
+        conn = self._connect()
+        conn.execute('INSERT OR IGNORE INTO upload_chunks VALUES (?, ?)', (upload_key, chunk))
+        conn.execute('UPDATE upload_files SET updated_at = ? WHERE upload_key = ?', (time.time(), upload_key))
+    
+    def forget(self, upload_key):
+        conn = self._connect()
+        conn.execute('DELETE FROM upload_chunks WHERE upload_key = ?', (upload_key,))
+        conn.execute('DELETE FROM upload_files WHERE upload_key = ?', (upload_key,))
+    
+    def sends(self, part_key):
+        """destination -> message id for every chat this part already reached"""
+        rows = self._connect().execute(
+            'SELECT destination, message_id FROM part_sends WHERE part_key = ?', (part_key,)
+        )
+        return dict(rows.fetchall())
+    
+    def mark_sent(self, part_key, destination, message_id, caption=None):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO part_sends (part_key, destination, message_id, sent_at, caption) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (part_key, destination, message_id, time.time(), caption)
+        )
+    
+    def find_messages(self, filename):
+        """destination -> message ids of every part of filename sent there, newest first"""
+        prefix = f"{filename} - Part "
+        rows = self._connect().execute(
+            'SELECT destination, message_id FROM part_sends WHERE substr(caption, 1, ?) = ? '
+            'ORDER BY sent_at DESC',
+            (len(prefix), prefix)
+        )
+        found = {}
+        for destination, message_id in rows:
+            found.setdefault(destination, []).append(message_id)
+        return found
+    
+    def purge_expired(self):
+        """Drop chunk records of uploads Telegram will have discarded by now"""
+        conn = self._connect()
+        cutoff = time.time() - self.ttl
+        conn.execute(
+            'DELETE FROM upload_chunks WHERE upload_key IN '
+            '(SELECT upload_key FROM upload_files WHERE updated_at < ?)', (cutoff,)
+        )
+        conn.execute('DELETE FROM upload_files WHERE updated_at < ?', (cutoff,))
+
+class JobStore(SQLiteStore):
+    """Split and upload jobs handed from the web tier to worker.py nodes
+
+    A worker claims a job under a lease and renews it while the job runs; if the
+    worker dies, the lease runs out and another worker picks the job up. Workers
+    also write progress here so any web process can report it under the job's
+    progress key (the filename for splits, the task id for uploads).
+    """
+    journal_mode = 'DELETE'  # WAL needs shared memory, which network filesystems can't provide
+    
+    def __init__(self, db_path, lease_seconds, max_attempts, claim_timeout):
+        super().__init__(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.claim_timeout = claim_timeout
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                progress_key TEXT NOT NULL,
+                params TEXT NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                status TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_progress_key ON jobs (progress_key, created_at)')
+    
+    def enqueue(self, kind, progress_key, params, job_id=None):
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, kind, progress_key, params, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, kind, progress_key, json.dumps(params), now, now)
+        )
+        return job_id
+    
+    def claim(self, worker_id, kinds):
+        """(job id, kind, progress key, params) of the oldest claimable job, or None
+
+        Jobs whose lease ran out are claimable again until they've used up
+        max_attempts, after which they're failed.
+        """
+        conn = self._connect()
+        now = time.time()
+        kinds = list(kinds)
+        placeholders = ','.join('?' * len(kinds))
+        # IMMEDIATE takes the write lock up front, so two workers can't claim the same row
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                (f"Worker lost {self.max_attempts} times", now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                f"SELECT job_id, kind, progress_key, params FROM jobs WHERE kind IN ({placeholders}) "
+                "AND (state = 'queued' OR (state = 'running' AND lease_until < ?)) "
+                "ORDER BY created_at LIMIT 1",
+                (*kinds, now)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (worker_id, now + self.lease_seconds, now, row[0])
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if not row:
+            return None
+        job_id, kind, progress_key, params = row
+        return job_id, kind, progress_key, json.loads(params)
+    
+    def heartbeat(self, job_id, worker_id, status=None):
+        """Renew the lease and record progress; False if the job is no longer this worker's"""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ?, status = COALESCE(?, status), updated_at = ? "
+            "WHERE job_id = ? AND worker = ? AND state = 'running'",
+            (now + self.lease_seconds, json.dumps(status) if status else None, now, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+    
+    def finish(self, job_id, worker_id, result=None, error=None, status=None):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, result = ?, error = ?, status = COALESCE(?, status), lease_until = NULL, "
+            "updated_at = ? WHERE job_id = ? AND worker = ? AND state = 'running'",
+            ('failed' if error else 'done', json.dumps(result), error, json.dumps(status) if status else None,
+             time.time(), job_id, worker_id)
+        )
+    
+    def get(self, job_id):
+        conn = self._connect()
+        now = time.time()
+        # Without a worker for its kind a job would wait forever; fail it so the client hears about it
+        conn.execute(
+            "UPDATE jobs SET state = 'failed', error = 'No worker claimed the job', updated_at = ? "
+            "WHERE job_id = ? AND state = 'queued' AND created_at < ?",
+            (now, job_id, now - self.claim_timeout)
+        )
+        row = conn.execute(
+            'SELECT state, status, result, error FROM jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        state, status, result, error = row
+        return {
+            'state': state,
+            'status': json.loads(status) if status else None,
+            'result': json.loads(result) if result else None,
+            'error': error
+        }
+    
+    def status(self, progress_key):
+        """Latest progress of the newest job with this key, or None if there is none"""
+        row = self._connect().execute(
+            'SELECT job_id FROM jobs WHERE progress_key = ? ORDER BY created_at DESC LIMIT 1', (progress_key,)
+        ).fetchone()
+        if not row:
+            return None
+        job = self.get(row[0])
+        status = job['status'] or {"stage": "Queued", "progress": 0, "speed": 0, "done": False, "error": None}
+        if job['state'] == 'failed':
+            # A job that lost its worker never got to write its own error
+            return {**status, "stage": "Error", "done": False, "error": job['error']}
+        return status
+    
+    def stats(self):
+        rows = self._connect().execute('SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state')
+        counts = {}
+        for kind, state, count in rows:
+            counts.setdefault(kind, {})[state] = count
+        workers = self._connect().execute(
+            "SELECT COUNT(DISTINCT worker) FROM jobs WHERE state = 'running' AND lease_until >= ?", (time.time(),)
+        ).fetchone()[0]
+        return {'jobs': counts, 'busy_workers': workers}
+    
+    def purge_finished(self, age):
+        """Drop done and failed jobs older than age seconds, returning how many were dropped"""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated_at < ?", (time.time() - age,)
+        )
+        return cursor.rowcount
+
+class ProcessedIndex:
+    """JSON record of source files already handled, so batch runs can skip them"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def _key(self, file_path):
+        return os.path.abspath(file_path)
+    
+    def is_processed(self, file_path):
+        """True if this exact version (size and mtime) of the file was processed"""
+        entry = self.entries.get(self._key(file_path))
+        if not entry:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # Deleted or moved away since it was listed
+            return False
+        return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+    
+    def mark(self, file_path, **info):
+        stat = os.stat(file_path)
+        with self.lock:
+            self.entries[self._key(file_path)] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'processed_at': datetime.now().isoformat(timespec='seconds'),
+                **info
+            }
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+class TelegramAccount:
+    """One upload identity (user session or bot) and its load and throughput counters"""
+    def __init__(self, name, session_path, bot_token=None):
+        self.name = name
+        self.session_path = session_path
+        self.bot_token = bot_token
+        self.active_jobs = 0
+        self.cooldown_until = 0
+        self.flood_waits = 0
+        self.bytes_sent = 0
+        self.busy_seconds = 0.0
+        self.premium = False if bot_token else None  # Bots can't have Premium; users are checked on connect
+        self.premium_failures = 0
+        self.premium_retry_at = 0  # Failed checks back off instead of reconnecting on every request
+    
+    @property
+    def max_file_size_mb(self):
+        return PREMIUM_MAX_SIZE_MB if self.premium else MAX_SIZE_MB
+    
+    def premium_check_due(self):
+        # Accounts busy uploading are skipped so the check doesn't open their session file mid-upload
+        return self.premium is None and self.active_jobs == 0 and time.time() >= self.premium_retry_at
+    
+    def record_premium_failure(self):
+        self.premium_failures += 1
+        delay = min(PREMIUM_CHECK_MAX_BACKOFF, PREMIUM_CHECK_BACKOFF * 2 ** (self.premium_failures - 1))
+        self.premium_retry_at = time.time() + delay
+        return delay
+    
+    def stats(self):
+        return {
+            'name': self.name,
+            'type': 'bot' if self.bot_token else 'user',
+            'premium': self.premium,
+            'active_jobs': self.active_jobs,
+            'cooldown_remaining': max(0, round(self.cooldown_until - time.time())),
+            'flood_waits': self.flood_waits,
+            'mb_sent': round(self.bytes_sent / (1024 * 1024), 1),
+            'throughput_kbps': round(self.bytes_sent / self.busy_seconds / 1024, 1) if self.busy_seconds else 0
+        }
+
+class AccountPool:
+    """Hands each upload job to the least-loaded account that isn't in a FLOOD_WAIT cooldown"""
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.lock = threading.Lock()
+        self.detecting = False
+    
+    def acquire(self, name=None):
+        with self.lock:
+            now = time.time()
+            ready = [a for a in self.accounts if a.cooldown_until <= now]
+            named = [a for a in self.accounts if a.name == name]
+            if named:
+                # The job needs this account's chats, e.g. its Saved Messages
+                account = named[0]
+            elif ready:
+                account = min(ready, key=lambda a: (a.active_jobs, a.bytes_sent))
+            else:
+                # Everyone is rate limited; take whoever is free first
+                account = min(self.accounts, key=lambda a: a.cooldown_until)
+            account.active_jobs += 1
+            return account
+    
+    def release(self, account, busy_seconds):
+        with self.lock:
+            account.active_jobs -= 1
+            account.busy_seconds += busy_seconds
+    
+    def record_bytes(self, account, sent_bytes):
+        with self.lock:
+            account.bytes_sent += sent_bytes
+    
+    def record_flood_wait(self, account, seconds):
+        with self.lock:
+            account.flood_waits += 1
+            account.cooldown_until = max(account.cooldown_until, time.time() + seconds)
+        logger.warning(f"Account {account.name} hit FLOOD_WAIT for {seconds}s")
+    
+    def stats(self):
+        with self.lock:
+            return [account.stats() for account in self.accounts]
+    
+    def max_file_size_mb(self):
+        """Largest part every account can send, since any of them may get the job"""
+        if any(account.premium_check_due() for account in self.accounts):
+            self.detect_premium()
+        return min((account.max_file_size_mb for account in self.accounts), default=MAX_SIZE_MB)
+    
+    def detect_premium(self):
+        """Look up Premium status of accounts not connected yet, in the background"""
+        with self.lock:
+            if self.detecting:
+                return
+            self.detecting = True
+        
+        def detect():
+            try:
+                for account in [a for a in self.accounts if a.premium_check_due()]:
+                    try:
+                        asyncio.run(check_premium(account))
+                    except Exception as e:
+                        logger.warning(f"Could not check Premium status of {account.name}: {e}")
+                    if account.premium is None:
+                        # Unauthorized or failed: stay at MAX_SIZE_MB and try again later
+                        delay = account.record_premium_failure()
+                        logger.info(f"Next Premium check of {account.name} in {delay}s")
+            finally:
+                with self.lock:
+                    self.detecting = False
+        try:
+            Thread(target=detect, daemon=True).start()
+        except Exception:
+            # No thread, no finally: don't leave detection switched off for good
+            with self.lock:
+                self.detecting = False
+            raise
+
+def build_account_pool():
+    """Create the upload account pool from TELEGRAM_SESSIONS and TELEGRAM_BOT_TOKENS"""
+    session_dir = Path("telegram_session")
+    accounts = [TelegramAccount(name, str(session_dir / name)) for name in telegram_session_names]
+    for i, token in enumerate(telegram_bot_tokens, 1):
+        accounts.append(TelegramAccount(f"bot{i}", str(session_dir / f"bot{i}"), bot_token=token))
+    return AccountPool(accounts)
+
+class TokenBucket:
+    """Byte budget refilled at `rate` bytes/s, allowed to go into debt; a rate of 0 means unlimited"""
+    def __init__(self, rate):
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+        self.last_used = time.monotonic()
+    
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = rate  # Up to one second of burst
+            self.updated = time.monotonic()
+    
+    def reserve(self, amount):
+        """Take amount bytes and return how long to wait before sending them"""
+        with self.lock:
+            now = time.monotonic()
+            self.last_used = now
+            if self.rate <= 0:
+                return 0
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+class DeletionQueue:
+    """Deletes files off the request thread
+
+    discard() renames a path into the trash directory of its storage root,
+    which is instant and atomic. A worker thread unlinks what is in the trash
+    at DELETE_RATE_MB per second, so big deletes don't starve active splits
+    of disk I/O.
+    """
+    def __init__(self, rate_mb):
+        self.bucket = TokenBucket(rate_mb * 1024 * 1024)
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker_pid = None
+        self.deleted_bytes = 0
+        self.deleted_files = 0
+    
+    def trash_dir_for(self, path):
+        path = os.path.abspath(path)
+        for root in (app.config['BASE_SPLIT_FOLDER'], app.config['UPLOAD_FOLDER']):
+            root = os.path.abspath(root)
+            if path.startswith(root + os.sep):
+                return os.path.join(root, TRASH_DIR)
+        return None
+    
+    def discard(self, path):
+        """Move path out of the way now and delete it later; returns False if it is not there"""
+        if not os.path.lexists(path):
+            return False
+        trash_dir = self.trash_dir_for(path)
+        if trash_dir and not os.path.abspath(path).startswith(trash_dir + os.sep):
+            os.makedirs(trash_dir, exist_ok=True)
+            target = os.path.join(trash_dir, f"{uuid.uuid4().hex}-{os.path.basename(path)}")
+            try:
+                os.rename(path, target)
+                path = target
+            except OSError as e:
+                # Different filesystem or locked file: the worker deletes it where it is
+                logger.warning(f"Could not move {path} to trash: {e}")
+        self.ensure_worker()
+        self.pending.put(path)
+        return True
+    
+    def ensure_worker(self):
+        with self.lock:
+            # Forked workers don't inherit the parent's thread, so track the pid rather than the thread
+            if self.worker_pid == os.getpid():
+                return
+            self.worker_pid = os.getpid()
+            # Whatever the parent had queued is its own to delete
+            self.pending = queue.Queue()
+            threading.Thread(target=self.run, daemon=True).start()
+        # Anything left in the trash by a previous process is still due
+        for root in (app.config['BASE_SPLIT_FOLDER'], app.config['UPLOAD_FOLDER']):
+            trash_dir = os.path.join(root, TRASH_DIR)
+            if os.path.isdir(trash_dir):
+                for name in os.listdir(trash_dir):
+                    self.pending.put(os.path.join(trash_dir, name))
+    
+    def unlink(self, path):
+        try:
+            size = os.lstat(path).st_size
+            wait = self.bucket.reserve(size)
+            if wait:
+                time.sleep(wait)
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.deleted_bytes += size
+            self.deleted_files += 1
+    
+    def delete(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+                for name in filenames:
+                    self.unlink(os.path.join(dirpath, name))
+                for name in dirnames:
+                    os.rmdir(os.path.join(dirpath, name))
+            os.rmdir(path)
+        else:
+            self.unlink(path)
+    
+    def run(self):
+        while True:
+            path = self.pending.get()
+            try:
+                self.delete(path)
+            except Exception as e:
+                logger.error(f"Error deleting {path}: {e}")
+            finally:
+                self.pending.task_done()
+    
+    def drain(self):
+        """Wait until everything discarded so far is deleted; command-line tools call this before exiting"""
+        if self.worker_pid != os.getpid():
+            return
+        if self.pending.unfinished_tasks:
+            logger.info(f"Waiting for {self.pending.unfinished_tasks} pending deletions")
+        self.pending.join()
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'deleted_bytes': self.deleted_bytes,
+                'deleted_files': self.deleted_files,
+                'pending': self.pending.qsize()
+            }
+
+class UploadThrottle:
+    """Global and per-session limits on Telegram upload bytes/s
+
+    Every session gets the default session rate unless an admin gave it its own.
+    """
+    def __init__(self, global_kbps, session_kbps):
+        self.global_bucket = TokenBucket(global_kbps * 1024)
+        self.session_rate = session_kbps * 1024
+        self.overrides = {}  # session id -> bytes/s for sessions with their own limit
+        self.sessions = {}
+        self.lock = threading.Lock()
+    
+    def session_bucket(self, session_id):
+        with self.lock:
+            bucket = self.sessions.get(session_id)
+            if bucket is None:
+                rate = self.overrides.get(session_id, self.session_rate)
+                bucket = self.sessions[session_id] = TokenBucket(rate)
+            return bucket
+    
+    async def consume(self, session_id, amount):
+        """Wait until both the global and the session budget allow sending amount bytes"""
+        wait = self.global_bucket.reserve(amount)
+        if session_id:
+            wait = max(wait, self.session_bucket(session_id).reserve(amount))
+        if wait:
+            await asyncio.sleep(wait)
+    
+    def set_limits(self, global_kbps=None, session_kbps=None):
+        if global_kbps is not None:
+            self.global_bucket.set_rate(global_kbps * 1024)
+        if session_kbps is not None:
+            with self.lock:
+                self.session_rate = session_kbps * 1024
+                buckets = [b for s, b in self.sessions.items() if s not in self.overrides]
+            for bucket in buckets:
+                bucket.set_rate(self.session_rate)
+    
+    def set_session_limit(self, session_id, kbps=None):
+        """Give one session its own rate; None puts it back on the default"""
+        with self.lock:
+            if kbps is None:
+                self.overrides.pop(session_id, None)
+            else:
+                self.overrides[session_id] = kbps * 1024
+            rate = self.overrides.get(session_id, self.session_rate)
+            bucket = self.sessions.get(session_id)
+        if bucket is not None:
+            bucket.set_rate(rate)
+    
+    def purge_idle(self, max_idle):
+        cutoff = time.monotonic() - max_idle
+        with self.lock:
+            for session_id in [s for s, b in self.sessions.items() if b.last_used < cutoff]:
+                del self.sessions[session_id]
+    
+    def limits(self):
+        return {
+            'upload_rate_limit': self.global_bucket.rate // 1024,
+            'session_upload_rate_limit': self.session_rate // 1024,
+            'session_overrides': {s: rate // 1024 for s, rate in self.overrides.items()},
+            'throttled_sessions': len(self.sessions)
+        }
+
+class SplitScheduler:
+    """Weighted fair queuing of splits across sessions
+
+    Each job is tagged with a virtual finish time of its session's previous
+    finish plus its size, and free slots go to the smallest tag. Small jobs
+    therefore overtake big ones, and one session's backlog cannot starve others.
+    """
+    def __init__(self, slots):
+        self.slots = slots
+        self.running = 0
+        self.virtual_time = 0.0
+        self.session_finish = {}
+        self.waiting = []  # heap of (finish tag, sequence)
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+    
+    @contextmanager
+    def slot(self, session_id, size_bytes, wait=True):
+        """Hold a split slot, yielding True; with wait=False, yields False at once if it would have to queue"""
+        with self.cond:
+            if not wait and (self.running >= self.slots or self.waiting):
+                acquired = False
+            else:
+                start = max(self.virtual_time, self.session_finish.get(session_id, 0.0))
+                finish = start + size_bytes / (1024 * 1024)
+                self.session_finish[session_id] = finish
+                ticket = (finish, next(self.sequence))
+                heapq.heappush(self.waiting, ticket)
+                if self.running >= self.slots:
+                    logger.info(f"Split queued behind {self.running} running and {len(self.waiting) - 1} waiting")
+                with timed('queue'):
+                    while self.running >= self.slots or self.waiting[0] != ticket:
+                        self.cond.wait()
+                heapq.heappop(self.waiting)
+                self.running += 1
+                self.virtual_time = max(self.virtual_time, start)
+                self.cond.notify_all()
+                acquired = True
+        if not acquired:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with self.cond:
+                self.running -= 1
+                # Sessions with nothing left ahead of the clock have no backlog to remember
+                for sid in [s for s, f in self.session_finish.items() if f <= self.virtual_time]:
+                    del self.session_finish[sid]
+                self.cond.notify_all()
+    
+    def set_slots(self, slots):
+        with self.cond:
+            self.slots = max(1, slots)
+            self.cond.notify_all()
+    
+    def stats(self):
+        with self.cond:
+            return {'split_concurrency': self.slots, 'splits_running': self.running,
+                    'splits_waiting': len(self.waiting)}
+
+class AdmissionController:
+    """Turns new split and upload jobs away while the machine is overloaded
+
+    Rejected clients get a ticket and a queue position; once load drops,
+    tickets are admitted in the order they were handed out. An admitted
+    upload holds its slot from admit() until release_upload().
+    """
+    SAMPLE_INTERVAL = 1.0
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uploads_in_flight = 0
+        self.queues = {'split': {}, 'upload': {}}  # ticket -> last retry, in issue order
+        self.sample = {}
+        self.sampled_at = 0.0
+        self.last_disk = None
+        self.psutil_missing = False
+    
+    def release_upload(self):
+        with self.lock:
+            self.uploads_in_flight -= 1
+    
+    def run_upload(self, target, *args):
+        """Thread target for an upload admitted by admit('upload'); gives its slot back when done"""
+        try:
+            target(*args)
+        finally:
+            self.release_upload()
+    
+    def load(self):
+        """CPU, ffmpeg and disk figures, sampled at most once a second"""
+        now = time.monotonic()
+        if now - self.sampled_at < self.SAMPLE_INTERVAL:
+            return self.sample
+        self.sampled_at = now
+        sample = {'uploads_in_flight': self.uploads_in_flight}
+        try:
+            import psutil
+        except ImportError:
+            if not self.psutil_missing:
+                logger.warning("psutil is not installed; admission control only counts uploads")
+                self.psutil_missing = True
+            self.sample = sample
+            return sample
+        
+        sample['cpu_percent'] = psutil.cpu_percent(interval=None)
+        sample['ffmpeg_processes'] = sum(
+            1 for proc in psutil.process_iter(['name']) if (proc.info['name'] or '').startswith('ffmpeg')
+        )
+        disk = psutil.disk_io_counters()
+        busy_time = getattr(disk, 'busy_time', None) if disk else None  # Only reported on Linux
+        if busy_time is not None:
+            if self.last_disk:
+                last_time, last_busy = self.last_disk
+                sample['disk_busy_percent'] = min(100.0, (busy_time - last_busy) / ((now - last_time) * 1000) * 100)
+            self.last_disk = (now, busy_time)
+        self.sample = sample
+        return sample
+    
+    def overload_reason(self, kind):
+        load = self.load()
+        if kind == 'split':
+            if load.get('cpu_percent', 0) > app.config['ADMISSION_MAX_CPU']:
+                return 'CPU'
+            if load.get('ffmpeg_processes', 0) >= app.config['ADMISSION_MAX_FFMPEG']:
+                return 'ffmpeg'
+        if load.get('disk_busy_percent', 0) > app.config['ADMISSION_MAX_DISK_BUSY']:
+            return 'disk'
+        return None
+    
+    def can_start_split(self):
+        """Whether a split that could also run later may start now; unlike admit() it never hands out a ticket"""
+        reason = self.overload_reason('split')
+        with self.lock:
+            return reason is None and not self.queues['split']
+    
+    def admit(self, kind, ticket=None):
+        """(admitted, ticket, queue position) for a new job of kind 'split' or 'upload'"""
+        retry_after = app.config['ADMISSION_RETRY_AFTER']
+        reason = self.overload_reason(kind)
+        with self.lock:
+            queue = self.queues[kind]
+            # Clients that stopped retrying give up their place
+            now = time.time()
+            for stale in [t for t, seen in queue.items() if seen < now - 3 * retry_after]:
+                del queue[stale]
+            
+            if ticket not in queue:
+                ticket = None
+            tickets = list(queue)
+            # Checked under the lock so a burst of requests cannot all take the last slot
+            if kind == 'upload' and reason is None and \
+                    self.uploads_in_flight >= app.config['ADMISSION_MAX_UPLOADS']:
+                reason = 'uploads'
+            if reason is None and (not tickets or tickets[0] == ticket):
+                queue.pop(ticket, None)
+                if kind == 'upload':
+                    self.uploads_in_flight += 1
+                return True, None, 0
+            
+            if ticket is None:
+                ticket = secrets.token_hex(8)
+                logger.info(f"Deferring {kind} job, server busy ({reason or 'queue ahead'})")
+                tickets.append(ticket)
+            queue[ticket] = now
+            return False, ticket, tickets.index(ticket) + 1
+    
+    def stats(self):
+        with self.lock:
+            queued = {kind: len(queue) for kind, queue in self.queues.items()}
+        return {**self.load(), 'queued': queued}
+
+class JobTimer:
+    """Wall, CPU and ffmpeg child CPU time per pipeline stage of one job"""
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}
+        self.lock = threading.Lock()
+    
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        # run_ffmpeg charges child CPU time to whatever stage is open in its thread
+        previous = getattr(stage_context, 'stage', None)
+        stage_context.stage = (self, name)
+        try:
+            yield
+        finally:
+            stage_context.stage = previous
+            self.add(name, wall=time.perf_counter() - wall, cpu=time.thread_time() - cpu, count=1)
+    
+    def add(self, name, **times):
+        with self.lock:
+            entry = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'count': 0})
+            for key, value in times.items():
+                entry[key] += value
+    
+    def report(self):
+        with self.lock:
+            stages = {name: {key: round(value, 3) for key, value in entry.items()}
+                      for name, entry in self.stages.items()}
+        return {
+            'job_id': self.job_id,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'elapsed': round((self.finished or time.time()) - self.started, 3),
+            'done': self.finished is not None,
+            'stages': stages
+        }
+
+@contextmanager
+def job_timer(job_id):
+    """Time the stages of a job run in this thread; the last MAX_JOB_TIMERS jobs can be inspected"""
+    timer = JobTimer(job_id)
+    with job_timers_lock:
+        job_timers[job_id] = timer
+        job_timers.move_to_end(job_id)
+        while len(job_timers) > MAX_JOB_TIMERS:
+            job_timers.popitem(last=False)
+    previous = getattr(stage_context, 'job', None)
+    stage_context.job = timer
+    try:
+        yield timer
+    finally:
+        stage_context.job = previous
+        timer.finished = time.time()
+        summary = ', '.join(f"{name} {entry['wall']:.1f}s" for name, entry in timer.report()['stages'].items())
+        logger.info(f"Job {job_id} finished in {timer.finished - timer.started:.1f}s ({summary})")
+
+def timed(stage, timer=None):
+    """Stage of the given job, or of the job running in this thread; a no-op outside jobs"""
+    timer = timer or getattr(stage_context, 'job', None)
+    return timer.stage(stage) if timer else nullcontext()
+
+def current_job_timer():
+    return getattr(stage_context, 'job', None)
+
+# cProfile only hooks the thread that enables it
+PROFILE_SCOPE_NOTE = (
+    "Only the job's own thread is profiled. Work in the split, thumbnail and hash pools and in "
+    "asyncio executor threads shows up here as time spent waiting on them; see the per-stage "
+    "CPU times in /admin/profile/<job id> for that work."
+)
+
+class ProfileStore:
+    """cProfile runs for jobs an admin asked about, kept in a bounded directory"""
+    def __init__(self, directory, max_files):
+        self.directory = directory
+        self.max_files = max_files
+        self.armed = set()
+        self.lock = threading.Lock()
+    
+    def arm(self, job_id):
+        with self.lock:
+            self.armed.add(job_id)
+    
+    def take(self, *job_ids):
+        """Whether any of job_ids was armed, disarming it"""
+        with self.lock:
+            hits = self.armed.intersection(job_ids)
+            self.armed -= hits
+            return bool(hits)
+    
+    def start(self):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active at a time, e.g. a profiled request starting a profiled job
+            logger.warning("Another profiler is already running; skipping this one")
+            return None
+        return profiler
+    
+    def save(self, job_id, profiler):
+        """Write the raw stats (for snakeviz/pstats) and a text summary"""
+        import pstats
+        profiler.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        stem = f"{datetime.now():%Y%m%d-%H%M%S}-{secure_filename(str(job_id)) or 'job'}"
+        prof_path = os.path.join(self.directory, f"{stem}.prof")
+        profiler.dump_stats(prof_path)
+        with open(os.path.join(self.directory, f"{stem}.txt"), 'w') as f:
+            f.write(PROFILE_SCOPE_NOTE + "\n\n")
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(60)
+        self.prune()
+        logger.info(f"Saved profile of {job_id} to {prof_path}")
+        return prof_path
+    
+    def prune(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.prof')), key=os.path.getmtime)
+        for prof_path in paths[:max(0, len(paths) - self.max_files)]:
+            for path in (prof_path, prof_path[:-len('.prof')] + '.txt'):
+                remove_path(path)
+    
+    def files(self, job_id):
+        suffix = f"-{secure_filename(str(job_id))}"
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.splitext(name)[0].endswith(suffix))
+    
+    @contextmanager
+    def profile(self, *job_ids):
+        """Profile the enclosed code in this thread if an admin armed one of job_ids"""
+        if not self.take(*job_ids):
+            yield
+            return
+        profiler = self.start()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                self.save(job_ids[0], profiler)
+
+def busy_response(ticket, position):
+    """503 telling the client when to retry and where it stands in the queue"""
+    retry_after = app.config['ADMISSION_RETRY_AFTER']
+    response = jsonify({
+        'success': False,
+        'busy': True,
+        'error': 'Server busy',
+        'ticket': ticket,
+        'position': position,
+        'retry_after': retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def parse_destination_list(value):
+    """Chats from a comma- or newline-separated form field or header"""
+    return [d.strip() for d in (value or '').replace('\n', ',').split(',') if d.strip()]
+
+def normalize_destination(value):
+    """Comparable form of a chat: ids as ints, usernames without '@' and case"""
+    value = parse_destination(str(value))
+    return value if isinstance(value, int) else value.lstrip('@').lower()
+
+def disallowed_destinations(destinations):
+    """The requested chats that aren't in TELEGRAM_ALLOWED_DESTINATIONS"""
+    allowed = {normalize_destination(d) for d in telegram_allowed_destinations}
+    return [d for d in destinations if normalize_destination(d) not in allowed]
+
+def parse_destination(value):
+    """Numeric chat ids arrive as strings; usernames and 'me' are passed through"""
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
 
 # Global dictionaries
 progress_dict = {}
-session_files = {}  # Track files by session
+session_store = SessionFileStore(app.config['SESSION_STORE_PATH'], app.config['SESSION_FILES_TTL'])
+account_pool = build_account_pool()
+upload_ledger = UploadLedger(app.config['UPLOAD_LEDGER_PATH'], app.config['UPLOAD_LEDGER_TTL'])
+job_store = JobStore(
+    os.path.abspath(app.config['JOB_STORE']), app.config['JOB_LEASE_SECONDS'], app.config['JOB_MAX_ATTEMPTS'],
+    app.config['JOB_CLAIM_TIMEOUT']
+) if app.config['JOB_STORE'] else None
+upload_throttle = UploadThrottle(app.config['UPLOAD_RATE_LIMIT'], app.config['SESSION_UPLOAD_RATE_LIMIT'])
+split_scheduler = SplitScheduler(app.config['SPLIT_CONCURRENCY'])
+admission = AdmissionController()
+deletion_queue = DeletionQueue(app.config['DELETE_RATE_MB'])
+stage_context = threading.local()  # Job and stage being timed in the current thread
+job_timers = OrderedDict()  # job id -> JobTimer, most recent last
+job_timers_lock = threading.Lock()
+MAX_JOB_TIMERS = 200
+profiles = ProfileStore(app.config['PROFILE_DIR'], app.config['PROFILE_MAX_FILES'])
 upload_status = {}  # For Telegram uploads
+ingest_status = {}  # For URL ingests
+restore_status = {}  # For downloads back out of Telegram
+active_stream_splits = {}  # output folder -> expected part count and state of an in-progress stream split
+stream_uploads = {}  # progress key -> folder name of a browser upload being split as it arrives
+probe_cache = {}  # (path, size, mtime) -> ffprobe stream info
+part_metadata = {}  # part path -> duration/width/height taken from the source probe
+static_versions = {}  # static filename -> mtime used for cache busting
+scheduled_cleanups = {}  # path -> unix time after which it gets removed
+scheduled_cleanups_lock = threading.Lock()
+cleanup_thread_pid = None  # Process that owns the running cleanup thread
+cleanup_thread_lock = threading.Lock()
+zip_build_lock = threading.Lock()  # Serializes on-disk ZIP builds where fcntl is missing
 
-def ensure_session_files(session_id):
-    """Ensure session files storage exists for the given session ID"""
-    if session_id not in session_files:
-        session_files[session_id] = {
-            'uploads': [],
-            'splits': []
-        }
-        logger.info(f"Initialized session files storage for session: {session_id}")
-    return session_files[session_id]
+def untrack_split_folder(folder_path, session_id=None):
+    """Stop tracking a split folder for the given (or current) session"""
+    if session_id is None:
+        session_id = session.get('session_id')
+    if session_id:
+        session_store.remove(session_id, 'splits', folder_path)
 
 def start_cleanup_thread():
-    """Start background cleanup thread"""
+    """Start the background cleanup thread, once per process"""
+    global cleanup_thread_pid
+    with cleanup_thread_lock:
+        # Forked workers don't inherit the parent's thread, so track the pid rather than a flag
+        if cleanup_thread_pid == os.getpid():
+            return
+        cleanup_thread_pid = os.getpid()
+    
     def cleanup_task():
+        last_full_cleanup = 0
         while True:
             try:
-                cleanup_old_files()
+                run_scheduled_cleanups()
+                session_store.purge_expired()
+                upload_ledger.purge_expired()
+                upload_throttle.purge_idle(app.config['SESSION_FILES_TTL'])
+                if job_store:
+                    job_store.purge_finished(app.config['SESSION_FILES_TTL'])
+                if time.time() - last_full_cleanup >= app.config['CLEANUP_INTERVAL']:
+                    cleanup_old_files()
+                    last_full_cleanup = time.time()
             except Exception as e:
                 logger.error(f"Cleanup task error: {e}")
-            time.sleep(app.config['CLEANUP_INTERVAL'])
+            time.sleep(min(60, app.config['CLEANUP_INTERVAL']))
     
     thread = threading.Thread(target=cleanup_task, daemon=True)
     thread.start()
@@ -94,15 +1298,50 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 def cleanup_folder(folder_path):
-    """Remove folder and its contents"""
+    """Remove folder and its contents, handing the actual deletion to the background worker"""
     try:
-        shutil.rmtree(folder_path)
+        deletion_queue.discard(folder_path)
+        for part_path in list(part_metadata):
+            if part_path.startswith(folder_path + os.sep):
+                part_metadata.pop(part_path, None)
         logger.info(f"Cleaned up folder: {folder_path}")
         return True
     except Exception as e:
         logger.error(f"Error cleaning up folder {folder_path}: {e}")
         return False
 
+def remove_path(path):
+    """Remove a file or folder"""
+    if os.path.isdir(path):
+        return cleanup_folder(path)
+    try:
+        if deletion_queue.discard(path):
+            logger.info(f"Removed file: {path}")
+        return True
+    except Exception as e:
+        logger.error(f"Error removing file {path}: {e}")
+        return False
+
+def schedule_cleanup(path, delay=None):
+    """Remove path once the reverse proxy has had time to serve it"""
+    if delay is None:
+        delay = app.config['OFFLOAD_EXPIRY']
+    deadline = time.time() + delay
+    with scheduled_cleanups_lock:
+        # Keep the latest deadline so a second download doesn't cut the first short
+        scheduled_cleanups[path] = max(deadline, scheduled_cleanups.get(path, 0))
+    logger.info(f"Scheduled cleanup of {path} in {delay}s")
+
+def run_scheduled_cleanups():
+    """Remove paths whose offload expiry has passed"""
+    now = time.time()
+    with scheduled_cleanups_lock:
+        due = [path for path, deadline in scheduled_cleanups.items() if deadline <= now]
+        for path in due:
+            del scheduled_cleanups[path]
+    for path in due:
+        remove_path(path)
+
 def cleanup_old_files():
     """Clean up files older than 1 hour"""
     now = time.time()
@@ -112,103 +1351,924 @@ def cleanup_old_files():
     for filename in os.listdir(app.config['UPLOAD_FOLDER']):
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if os.path.isfile(file_path) and os.path.getmtime(file_path) < cutoff:
-            try:
-                os.remove(file_path)
-                logger.info(f"Cleaned up old upload: {file_path}")
-            except Exception as e:
-                logger.error(f"Error cleaning up old upload {file_path}: {e}")
+            remove_path(file_path)
     
-    # Clean split folders
+    # Clean split folders (and pre-built ZIPs left for the reverse proxy)
     for folder in os.listdir(app.config['BASE_SPLIT_FOLDER']):
+        if folder == TRASH_DIR:
+            continue  # Already queued for the deletion worker
         folder_path = os.path.join(app.config['BASE_SPLIT_FOLDER'], folder)
-        if os.path.isdir(folder_path) and os.path.getmtime(folder_path) < cutoff:
+        if os.path.getmtime(folder_path) < cutoff:
             try:
-                cleanup_folder(folder_path)
+                remove_path(folder_path)
             except Exception as e:
                 logger.error(f"Error cleaning up old split folder {folder_path}: {e}")
 
+def list_part_files(folder_path):
+    """Sorted paths of the parts in a split folder, skipping hidden helper files"""
+    return sorted(
+        os.path.join(folder_path, name) for name in os.listdir(folder_path)
+        if not name.startswith('.') and os.path.isfile(os.path.join(folder_path, name))
+    )
+
+def hash_file(path, offset=0, length=None):
+    """Size and digest of a file, or of length bytes of it starting at offset"""
+    digest = hashlib.new(HASH_ALGORITHM)
+    if length is None:
+        length = os.path.getsize(path) - offset
+    size = 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while size < length:
+            block = f.read(min(HASH_BLOCK_SIZE, length - size))
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return {'size': size, HASH_ALGORITHM: digest.hexdigest()}
+
+def save_stream(chunks, dest_path):
+    """Write chunks to dest_path, hashing them on the way instead of reading the file back"""
+    digest = hashlib.new(HASH_ALGORITHM)
+    size = 0
+    with open(dest_path, 'wb') as f:
+        for chunk in chunks:
+            digest.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    return {'size': size, HASH_ALGORITHM: digest.hexdigest()}
+
+def get_digest_path(upload_path):
+    """Sidecar holding the digest of an upload until /process writes the manifest"""
+    return upload_path + '.digest.json'
+
+def save_source_digest(upload_path, digest):
+    with open(get_digest_path(upload_path), 'w') as f:
+        json.dump(digest, f)
+
+def load_source_digest(upload_path):
+    """Digest recorded while the upload arrived, if it is still for the same file"""
+    try:
+        with open(get_digest_path(upload_path)) as f:
+            digest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return digest if digest.get('size') == os.path.getsize(upload_path) else None
+
+class PartHasher:
+    """Hashes parts on a thread pool as soon as they are finished, while their pages are still cached"""
+    def __init__(self, output_folder, workers):
+        self.output_folder = output_folder
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}
+        self.timer = current_job_timer()
+    
+    def hash_part(self, part_filename):
+        with timed('hash', self.timer):
+            return hash_file(os.path.join(self.output_folder, part_filename))
+    
+    def add(self, part_filename):
+        if part_filename not in self.futures:
+            self.futures[part_filename] = self.executor.submit(self.hash_part, part_filename)
+    
+    def results(self, part_files):
+        """(filename, digest) for every part, in order"""
+        for part_filename in part_files:
+            self.add(part_filename)
+        return [(part_filename, self.futures[part_filename].result()) for part_filename in part_files]
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def get_manifest_path(output_folder, name):
+    return os.path.join(output_folder, f".{name}{MANIFEST_SUFFIX}")
+
+def find_manifest(folder_path):
+    """Manifest of a split folder, if one was written"""
+    found = glob.glob(os.path.join(glob.escape(folder_path), f".*{MANIFEST_SUFFIX}"))
+    return found[0] if found else None
+
+def build_manifest(filename, mode, source_digest, part_digests):
+    return {
+        'filename': filename,
+        'mode': mode,
+        'algorithm': HASH_ALGORITHM,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'source': source_digest,
+        'parts': [
+            {'index': i, 'filename': part_filename, **digest}
+            for i, (part_filename, digest) in enumerate(part_digests, 1)
+        ]
+    }
+
+def write_manifest(output_folder, filename, mode, source_digest, part_digests):
+    """Record sizes and hashes of the source and every part next to the parts
+
+    mode is 'concat' for parts cut by ffmpeg and 'raw' for byte ranges of the
+    source, which tells a restore how to join them again.
+    """
+    manifest = build_manifest(filename, mode, source_digest, part_digests)
+    manifest_path = get_manifest_path(output_folder, os.path.splitext(filename)[0])
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+def write_manifest_to_zip(zf, folder_path):
+    """Ship the manifest with the parts, unhidden, so the download can be checked too"""
+    manifest_path = find_manifest(folder_path)
+    if manifest_path:
+        zf.write(manifest_path, os.path.basename(manifest_path).lstrip('.'))
+
 def create_zip(folder_path):
     """Create a zip file from folder contents"""
     memory_file = io.BytesIO()
     with ZipFile(memory_file, 'w') as zf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zf.write(file_path, arcname)
+        for file_path in list_part_files(folder_path):
+            zf.write(file_path, os.path.basename(file_path))
+        write_manifest_to_zip(zf, folder_path)
     memory_file.seek(0)
     return memory_file
 
-def get_video_duration(filename):
-    """Get video duration in seconds using ffprobe"""
+def create_zip_on_disk(folder_path, zip_path):
+    """Write the folder contents to a ZIP file on disk for the reverse proxy to serve"""
+    # A unique temp name, so a concurrent build can never write into the same file
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(zip_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(zip_path))
+    try:
+        # Video is already compressed, so store the parts as-is
+        with os.fdopen(fd, 'wb') as f, ZipFile(f, 'w', compression=ZIP_STORED, allowZip64=True) as zf:
+            for file_path in list_part_files(folder_path):
+                zf.write(file_path, os.path.basename(file_path))
+            write_manifest_to_zip(zf, folder_path)
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return zip_path
+
+@contextmanager
+def exclusive_build(path):
+    """Hold an exclusive lock for building path, shared by threads and, where fcntl exists, processes"""
+    try:
+        import fcntl
+    except ImportError:
+        with zip_build_lock:
+            yield
+        return
+    # flock is per open file, so threads of one process exclude each other too
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def offload_response(file_path, download_name, mimetype='application/octet-stream'):
+    """Let the reverse proxy send the file via X-Accel-Redirect / X-Sendfile"""
+    response = app.response_class(mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    if app.config['DOWNLOAD_OFFLOAD'] == 'x-accel':
+        relative = os.path.relpath(file_path, app.config['BASE_SPLIT_FOLDER']).replace(os.sep, '/')
+        prefix = app.config['OFFLOAD_INTERNAL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(relative)}"
+    else:
+        response.headers['X-Sendfile'] = file_path
+    return response
+
+def probe_video(filename):
+    """Get duration, width and height with a single ffprobe call, cached per file version"""
     try:
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+        if key in probe_cache:
+            return probe_cache[key]
+        
         result = subprocess.run([
-            'ffprobe', '-v', 'error', '-show_entries',
-            'format=duration', '-of',
-            'default=noprint_wrappers=1:nokey=1', filename
+            'ffprobe', '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'format=duration:stream=width,height',
+            '-of', 'json', filename
         ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return float(result.stdout)
+        data = json.loads(result.stdout)
+        stream = (data.get('streams') or [{}])[0]
+        info = {
+            'duration': float(data['format']['duration']),
+            'width': int(stream.get('width') or 0),
+            'height': int(stream.get('height') or 0)
+        }
+        probe_cache[key] = info
+        return info
     except Exception as e:
-        logger.error(f"Error getting video duration: {e}")
+        logger.error(f"Error probing video: {e}")
         return None
 
-def split_video_with_ffmpeg(input_path, output_folder, part_size_mb=2000):
-    """Split video properly using ffmpeg"""
+def get_video_duration(filename):
+    """Get video duration in seconds using ffprobe"""
+    info = probe_video(filename)
+    return info['duration'] if info else None
+
+def get_movflags(part_path):
+    """Muxer flags that make MP4/MOV parts playable before they are fully downloaded"""
+    if os.path.splitext(part_path)[1].lower() in MP4_EXTENSIONS and app.config['MP4_MOVFLAGS']:
+        return ['-movflags', app.config['MP4_MOVFLAGS']]
+    return []
+
+def run_ffmpeg(cmd):
+    """Run an ffmpeg command, raising CalledProcessError on failure
+
+    Inside a timed stage, the child's CPU time is sampled with psutil and
+    charged to that stage.
+    """
+    current = getattr(stage_context, 'stage', None)
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if current is None or psutil is None:
+        return subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    child_cpu = 0.0
+    try:
+        child = psutil.Process(proc.pid)
+        while True:
+            try:
+                times = child.cpu_times()
+                child_cpu = times.user + times.system
+            except psutil.Error:
+                pass  # Exited between polls; keep the last sample
+            try:
+                stdout, stderr = proc.communicate(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        timer, stage = current
+        timer.add(stage, child_cpu=child_cpu)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+def build_part_command(input_path, part_path, start_time, part_duration):
+    """Build the ffmpeg command that extracts a single part"""
+    # -ss before -i seeks in the demuxer, so ffmpeg only reads this part's byte range
+    cmd = ['ffmpeg', '-y', '-ss', f"{start_time:.3f}", '-i', input_path]
+    if part_duration is not None:
+        cmd.extend(['-t', f"{part_duration:.3f}"])
+    cmd.extend([
+        '-c', 'copy',  # Use stream copy for no re-encoding
+        '-avoid_negative_ts', 'make_zero'
+    ])
+    cmd.extend(get_movflags(part_path))
+    cmd.append(part_path)
+    return cmd
+
+def plan_transcode(duration, file_size, part_size_mb):
+    """Work out part count and video bitrate so every encoded part fits part_size_mb
+
+    Parts are counted for TRANSCODE_TARGET_RATIO of the source's video bitrate,
+    or TRANSCODE_MAX_VIDEO_KBPS if that is lower. Each part then gets the bitrate
+    that fills it, but never more than the source or the cap.
+    """
+    audio_kbps = app.config['TRANSCODE_AUDIO_KBPS']
+    source_video_kbps = max(1, file_size * 8 / duration / 1000 - audio_kbps)
+    ceiling_kbps = source_video_kbps
+    if app.config['TRANSCODE_MAX_VIDEO_KBPS']:
+        ceiling_kbps = min(ceiling_kbps, app.config['TRANSCODE_MAX_VIDEO_KBPS'])
+    target_kbps = min(source_video_kbps * app.config['TRANSCODE_TARGET_RATIO'], ceiling_kbps)
+    
+    part_budget_bytes = part_size_mb * 1024 * 1024 * TRANSCODE_SIZE_MARGIN
+    estimated_bytes = (target_kbps + audio_kbps) * 1000 / 8 * duration
+    total_parts = max(1, math.ceil(estimated_bytes / part_budget_bytes))
+    part_duration = duration / total_parts
+    
+    # Rounding up leaves room in every part; spend it, up to the ceiling, rather than leaving parts half empty
+    video_kbps = int(min(part_budget_bytes * 8 / part_duration / 1000 - audio_kbps, ceiling_kbps))
+    if video_kbps <= 0:
+        raise ValueError("Part size too small for the audio bitrate")
+    return total_parts, video_kbps
+
+def build_transcode_commands(input_path, part_path, start_time, part_duration,
+                             video_kbps, preset, threads):
+    """Build the ffmpeg command(s) that encode a single part to a size target"""
+    seek = ['-ss', f"{start_time:.3f}", '-i', input_path]
+    if part_duration is not None:
+        seek.extend(['-t', f"{part_duration:.3f}"])
+    video = [
+        '-c:v', 'libx264', '-preset', preset, '-threads', str(threads),
+        '-maxrate', f"{video_kbps}k", '-bufsize', f"{video_kbps * 2}k"
+    ]
+    audio = ['-c:a', 'aac', '-b:a', f"{app.config['TRANSCODE_AUDIO_KBPS']}k"]
+    
+    if app.config['TRANSCODE_RATE_CONTROL'] == 'crf':
+        # CRF keeps quality constant and maxrate caps the size
+        return [['ffmpeg', '-y'] + seek + video + ['-crf', str(app.config['TRANSCODE_CRF'])]
+                + audio + get_movflags(part_path) + [part_path]]
+    
+    passlog = os.path.join(os.path.dirname(part_path), f".{os.path.basename(part_path)}.passlog")
+    video += ['-b:v', f"{video_kbps}k", '-passlogfile', passlog]
+    return [
+        ['ffmpeg', '-y'] + seek + video + ['-pass', '1', '-an', '-f', 'null', os.devnull],
+        ['ffmpeg', '-y'] + seek + video + ['-pass', '2'] + audio + get_movflags(part_path) + [part_path],
+    ]
+
+def cleanup_passlogs(output_folder):
+    """Remove two-pass statistics left next to the parts"""
+    for passlog in glob.glob(os.path.join(glob.escape(output_folder), '.*.passlog*')):
+        try:
+            os.remove(passlog)
+        except OSError as e:
+            logger.error(f"Error removing pass log {passlog}: {e}")
+
+def get_split_workers(total_parts):
+    """Number of parts to extract at once, bounded by CPU count and disk bandwidth"""
+    cpu_count = os.cpu_count() or 1
+    return max(1, min(total_parts, cpu_count, app.config['SPLIT_MAX_WORKERS']))
+
+def split_video_with_ffmpeg(input_path, output_folder, part_size_mb=None, parallel=None,
+                            transcode_preset=None, source_digest=None, consume_source=False):
+    """Split video properly using ffmpeg
+
+    With transcode_preset set, parts are re-encoded to H.264/AAC with a bitrate
+    targeted at part_size_mb instead of being stream copied. Parts are hashed
+    as they finish and recorded, with source_digest, in the folder's manifest.
+    part_size_mb defaults to the largest file the upload accounts can send.
+    With consume_source, a file that fits in one part may be moved instead of linked.
+    """
     filename = os.path.basename(input_path)
     name, ext = os.path.splitext(filename)
+    if parallel is None:
+        parallel = app.config['PARALLEL_SPLIT']
+    if part_size_mb is None:
+        part_size_mb = get_part_size_mb()
     
     # Get video duration
-    duration = get_video_duration(input_path)
-    if duration is None:
+    with timed('probe'):
+        source_info = probe_video(input_path)
+    if source_info is None:
         logger.error(f"Could not determine duration for {input_path}")
         return None
+    duration = source_info['duration']
     
     # Calculate split points (in seconds)
     file_size = os.path.getsize(input_path)
     part_size_bytes = part_size_mb * 1024 * 1024  # Convert MB to bytes
-    total_parts = math.ceil(file_size / part_size_bytes)
+    if not transcode_preset and file_size <= part_size_bytes:
+        return place_single_part(input_path, output_folder, source_info, source_digest, consume_source)
+    if transcode_preset:
+        total_parts, video_kbps = plan_transcode(duration, file_size, part_size_mb)
+        ext = '.mp4'
+        logger.info(f"Transcoding {filename} into {total_parts} parts at {video_kbps} kbps video")
+    else:
+        total_parts = math.ceil(file_size / part_size_bytes)
     part_duration = duration / total_parts
     
-    part_files = []
+    workers = get_split_workers(total_parts) if parallel else 1
+    # Share the cores between concurrent encoders; 0 lets x264 pick for a single one
+    encoder_threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0
     
+    parts = []
     for i in range(total_parts):
         part_filename = f"{name}_part{i+1}{ext}"
-        part_path = os.path.join(output_folder, part_filename)
-        
         start_time = i * part_duration
-        end_time = (i + 1) * part_duration if i < total_parts - 1 else None
-        
-        cmd = [
-            'ffmpeg', '-i', input_path,
-            '-ss', str(start_time),
-            '-c', 'copy'  # Use stream copy for no re-encoding
-        ]
-        
-        if end_time is not None:
-            cmd.extend(['-to', str(end_time)])
-        
-        cmd.append(part_path)
+        # The last part runs to the end of the input
+        length = part_duration if i < total_parts - 1 else None
+        parts.append((i, part_filename, start_time, length))
+    
+    completed = 0
+    progress_lock = threading.Lock()
+    hasher = PartHasher(output_folder, get_split_workers(total_parts))
+    timer = current_job_timer()
+    
+    def extract(part):
+        nonlocal completed
+        i, part_filename, start_time, length = part
+        part_path = os.path.join(output_folder, part_filename)
+        if transcode_preset:
+            cmds = build_transcode_commands(input_path, part_path, start_time, length,
+                                            video_kbps, transcode_preset, encoder_threads)
+        else:
+            cmds = [build_part_command(input_path, part_path, start_time, length)]
+        with timed('transcode' if transcode_preset else 'split', timer):
+            for cmd in cmds:
+                logger.info(f"Splitting part {i+1}/{total_parts}: {' '.join(cmd)}")
+                run_ffmpeg(cmd)
+        hasher.add(part_filename)
+        
+        # Update progress by completed parts so the reported value never goes backwards
+        # Remember the part's attributes so the uploader doesn't have to probe it again
+        part_metadata[part_path] = {
+            'duration': length if length is not None else duration - start_time,
+            'width': source_info['width'],
+            'height': source_info['height']
+        }
         
-        try:
-            logger.info(f"Splitting part {i+1}/{total_parts}: {' '.join(cmd)}")
-            result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            part_files.append(part_filename)
-            
-            # Update progress
-            progress = ((i + 1) / total_parts) * 100
+        with progress_lock:
+            completed += 1
+            progress = (completed / total_parts) * 100
             progress_dict[filename] = progress
-            logger.info(f"Created part {part_filename}, progress: {progress:.2f}%")
-        except subprocess.CalledProcessError as e:
-            error_msg = f"Error splitting video: {e.stderr.decode('utf-8') if e.stderr else str(e)}"
-            logger.error(error_msg)
-            return None
+        logger.info(f"Created part {part_filename}, progress: {progress:.2f}%")
+    
+    try:
+        if workers > 1:
+            logger.info(f"Splitting {filename} into {total_parts} parts with {workers} workers")
+            # Each ffmpeg runs as its own child process, so threads are enough to use every core
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(extract, part) for part in parts]
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            for part in parts:
+                extract(part)
+        
+        part_files = [part_filename for _, part_filename, _, _ in parts]
+        write_manifest(output_folder, filename, 'concat', source_digest, hasher.results(part_files))
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Error splitting video: {e.stderr.decode('utf-8') if e.stderr else str(e)}"
+        logger.error(error_msg)
+        return None
+    finally:
+        hasher.close()
+        if transcode_preset:
+            cleanup_passlogs(output_folder)
     
     return part_files
 
-class ProgressCallback:
-    """Callback class for Telegram upload progress"""
-    def __init__(self, task_id, part_index, total_parts):
-        self.task_id = task_id
+def is_faststart_file(path):
+    """Whether an MP4/MOV on disk has its moov box before the media data"""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, box = struct.unpack('>I4s', header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header_size = 16
+            if box in (b'moov', b'moof'):
+                return True
+            if box == b'mdat' or size < header_size:
+                return False
+            f.seek(size - header_size, os.SEEK_CUR)
+
+def place_file(src, dst, move=False):
+    """Put src's data at dst without copying it where the filesystem allows
+
+    Tries a rename (when move is set) or a hardlink, then a reflink, and only
+    copies the bytes when src and dst are on different devices. Returns the
+    method that worked.
+    """
+    if move:
+        try:
+            os.rename(src, dst)
+            return 'rename'
+        except OSError:
+            pass
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        import fcntl
+        FICLONE = 0x40049409  # Linux ioctl: share extents on btrfs/XFS
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        remove_path(dst)
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+def place_single_part(input_path, output_folder, source_info, source_digest=None, consume_source=False):
+    """A file that already fits becomes the only part, remuxed only if MP4 playback needs it"""
+    filename = os.path.basename(input_path)
+    name, ext = os.path.splitext(filename)
+    part_filename = f"{name}_part1{ext}"
+    part_path = os.path.join(output_folder, part_filename)
+    needs_faststart = (ext.lower() in MP4_EXTENSIONS and app.config['MP4_MOVFLAGS']
+                       and not is_faststart_file(input_path))
+    # A part left by an earlier run may be a hardlink of the source; writing through it would corrupt the source
+    if os.path.lexists(part_path):
+        os.remove(part_path)
+    try:
+        with timed('single part'):
+            if needs_faststart:
+                logger.info(f"{filename} fits in one part; moving its moov atom to the front")
+                run_ffmpeg(build_part_command(input_path, part_path, 0, None))
+            else:
+                method = place_file(input_path, part_path, move=consume_source)
+                logger.info(f"{filename} fits in one part; placed it by {method}")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error remuxing video: {e.stderr.decode('utf-8') if e.stderr else str(e)}")
+        return None
+    
+    part_metadata[part_path] = {
+        'duration': source_info['duration'],
+        'width': source_info['width'],
+        'height': source_info['height']
+    }
+    # An untouched copy has the source's digest, so it needn't be read again
+    digest = source_digest if source_digest and not needs_faststart else hash_file(part_path)
+    if source_digest is None and not needs_faststart:
+        # batch.py and watcher.py jobs weren't received through us; the part's bytes are the source's
+        source_digest = digest
+    write_manifest(output_folder, filename, 'concat', source_digest, [(part_filename, digest)])
+    progress_dict[filename] = 100
+    return [part_filename]
+
+def get_thumbnail_path(part_path):
+    """Where the cached thumbnail for a part lives"""
+    folder, part_filename = os.path.split(part_path)
+    return os.path.join(folder, THUMBNAIL_DIR, f"{part_filename}.jpg")
+
+def generate_thumbnail(part_path):
+    """Grab one keyframe from a part as a small JPEG, reusing the cached one"""
+    thumb_path = get_thumbnail_path(part_path)
+    if os.path.exists(thumb_path) and os.path.getmtime(thumb_path) >= os.path.getmtime(part_path):
+        return thumb_path
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    
+    # A little way in avoids black lead-in frames
+    info = part_metadata.get(part_path)
+    offset = min(info['duration'] * 0.1, 30) if info else 0
+    side = THUMBNAIL_MAX_SIDE
+    cmd = [
+        'ffmpeg', '-y',
+        '-skip_frame', 'nokey',  # Only decode keyframes
+        '-ss', f"{offset:.3f}", '-i', part_path,
+        '-frames:v', '1', '-an',
+        '-vf', f"scale='min({side},iw)':'min({side},ih)':force_original_aspect_ratio=decrease",
+        '-q:v', '5',
+        thumb_path
+    ]
+    try:
+        run_ffmpeg(cmd)
+        return thumb_path
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error creating thumbnail for {part_path}: "
+                     f"{e.stderr.decode('utf-8') if e.stderr else str(e)}")
+        return None
+
+def generate_thumbnails(output_folder, part_files):
+    """Create thumbnails for all parts in a worker pool, returning part -> thumbnail name"""
+    part_paths = [os.path.join(output_folder, part_filename) for part_filename in part_files]
+    timer = current_job_timer()
+    
+    def generate(part_path):
+        with timed('thumbnails', timer):
+            return generate_thumbnail(part_path)
+    
+    with ThreadPoolExecutor(max_workers=get_split_workers(len(part_paths))) as executor:
+        thumb_paths = list(executor.map(generate, part_paths))
+    return {
+        part_filename: os.path.basename(thumb_path) if thumb_path else None
+        for part_filename, thumb_path in zip(part_files, thumb_paths)
+    }
+
+def build_thumbnail_urls(output_folder, folder_name, part_files):
+    """Generate thumbnails when enabled and map each part to its thumbnail URL"""
+    if not app.config['GENERATE_THUMBNAILS']:
+        return {}
+    # Thumbnails are best-effort; parts without one still upload fine
+    return {
+        part_filename: f"/thumbnail/{folder_name}/{thumb}" if thumb else None
+        for part_filename, thumb in generate_thumbnails(output_folder, part_files).items()
+    }
+
+def is_streamable_head(head, ext):
+    """Whether ffmpeg can demux this container from a pipe, judged from its first bytes"""
+    ext = ext.lower()
+    if ext in PIPE_FRIENDLY_EXTENSIONS:
+        return True
+    if ext not in MP4_EXTENSIONS:
+        return False
+    
+    # MP4 only works from a pipe when moov (or fragments) come before the media data
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box = struct.unpack('>I4s', head[offset:offset + 8])
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if box in (b'moov', b'moof'):
+            return True
+        if box == b'mdat' or size < 8:
+            return False
+        offset += size
+    return False
+
+def probe_head_duration(head):
+    """Get the duration from the first bytes of a stream, or None if they don't say"""
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1', '-i', 'pipe:0'
+        ], input=head, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return float(result.stdout)
+    except Exception as e:
+        logger.error(f"Error probing stream head: {e}")
+        return None
+
+def read_head(chunks, size):
+    """Buffer at least size bytes from an iterator of chunks, returning head and the full stream"""
+    buffered = []
+    buffered_bytes = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        buffered_bytes += len(chunk)
+        if buffered_bytes >= size:
+            break
+    head = b''.join(buffered)
+    return head, itertools.chain([head], chunks)
+
+def get_segment_time(duration, total_bytes, part_size_mb):
+    """Segment length in seconds that keeps stream-split parts under part_size_mb"""
+    part_size_bytes = part_size_mb * 1024 * 1024 * STREAM_SEGMENT_MARGIN
+    return max(1.0, duration * part_size_bytes / total_bytes)
+
+def build_segment_command(source, output_folder, name, ext, segment_time):
+    """Build a single-pass ffmpeg segment muxer command, using part names that match split_video_with_ffmpeg"""
+    pattern = os.path.join(output_folder, f"{name.replace('%', '%%')}_part%d{ext}")
+    cmd = [
+        'ffmpeg', '-y', '-i', source,
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', f"{segment_time:.3f}",
+        '-segment_start_number', '1',
+        '-reset_timestamps', '1',
+        '-segment_list', os.path.join(output_folder, SEGMENT_LIST_NAME),
+        '-segment_list_type', 'csv'
+    ]
+    movflags = get_movflags(pattern)
+    if movflags:
+        cmd.extend(['-segment_format_options', f"movflags={movflags[1]}"])
+    cmd.append(pattern)
+    return cmd
+
+def read_segment_list(output_folder):
+    """Parts the segment muxer has finished so far, in order"""
+    list_path = os.path.join(output_folder, SEGMENT_LIST_NAME)
+    if not os.path.exists(list_path):
+        return []
+    with open(list_path) as f:
+        return [line.split(',', 1)[0] for line in f if line.strip()]
+
+def segment_stream_with_ffmpeg(chunks, output_folder, name, ext, segment_time):
+    """Pipe a byte stream into ffmpeg's segment muxer and return the part filenames
+
+    The stream is hashed as it passes through, and parts are hashed as the
+    segmenter finishes them, so the manifest needs no extra read of the source.
+    """
+    cmd = build_segment_command('pipe:0', output_folder, name, ext, segment_time)
+    logger.info(f"Segmenting stream: {' '.join(cmd)}")
+    source = hashlib.new(HASH_ALGORITHM)
+    source_size = 0
+    hasher = PartHasher(output_folder, get_split_workers(os.cpu_count() or 1))
+    
+    def hashed(chunks):
+        nonlocal source_size
+        last_check = time.monotonic()
+        for chunk in chunks:
+            source.update(chunk)
+            source_size += len(chunk)
+            yield chunk
+            if time.monotonic() - last_check > 1:
+                last_check = time.monotonic()
+                for part_filename in read_segment_list(output_folder):
+                    hasher.add(part_filename)
+    
+    try:
+        # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+        with tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+            try:
+                for chunk in hashed(chunks):
+                    proc.stdin.write(chunk)
+            except BrokenPipeError:
+                pass  # ffmpeg exited early; its return code says why
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            returncode = proc.wait()
+            if returncode != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+        
+        part_files = read_segment_list(output_folder)
+        source_digest = {'size': source_size, HASH_ALGORITHM: source.hexdigest()}
+        write_manifest(output_folder, f"{name}{ext}", 'concat', source_digest, hasher.results(part_files))
+    finally:
+        hasher.close()
+    return part_files
+
+def load_ingest_state(state_path):
+    """Read the completed-range record of an interrupted ingest"""
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_ingest_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def check_ingest_url(url):
+    """Refuse URLs that aren't http(s) or whose host resolves to a non-public address"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError("Only http(s) URLs are supported")
+    if app.config['INGEST_ALLOW_LOCAL']:
+        return
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or None, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise ValueError(f"Cannot resolve {parts.hostname}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%', 1)[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise ValueError(f"Refusing to fetch from non-public address {address}")
+
+def ingest_request(method, url, **kwargs):
+    """A requests call that follows redirects itself, so every host it reaches is checked first"""
+    import requests
+    
+    for _ in range(INGEST_MAX_REDIRECTS + 1):
+        check_ingest_url(url)
+        response = requests.request(method, url, allow_redirects=False, **kwargs)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    raise ValueError("Too many redirects")
+
+def fetch_url_to_file(url, dest_path, on_progress=None):
+    """Download url into dest_path with parallel range requests, resuming an earlier attempt"""
+    head = ingest_request('HEAD', url, timeout=30)
+    head.raise_for_status()
+    # Range requests go straight to where the redirects ended
+    url = head.url
+    size = int(head.headers.get('Content-Length') or 0)
+    buffer_bytes = app.config['INGEST_BUFFER_KB'] * 1024
+    
+    if head.headers.get('Accept-Ranges', '').lower() != 'bytes' or not size:
+        # No range support: one buffered stream
+        received = 0
+        with ingest_request('GET', url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(dest_path, 'wb') as f:
+                for block in response.iter_content(buffer_bytes):
+                    f.write(block)
+                    received += len(block)
+                    if on_progress:
+                        on_progress(received, size)
+        return received
+    
+    range_bytes = app.config['INGEST_RANGE_MB'] * 1024 * 1024
+    total_ranges = math.ceil(size / range_bytes)
+    state_path = dest_path + '.ranges.json'
+    validator = head.headers.get('ETag') or head.headers.get('Last-Modified') or ''
+    
+    state = load_ingest_state(state_path)
+    if (not state or not os.path.exists(dest_path) or state.get('url') != url
+            or state.get('size') != size or state.get('validator') != validator):
+        state = {'url': url, 'size': size, 'validator': validator, 'done': []}
+        with open(dest_path, 'wb') as f:
+            f.truncate(size)
+    done = set(state['done'])
+    if done:
+        logger.info(f"Resuming {url}: {len(done)}/{total_ranges} ranges already fetched")
+    
+    received = sum(min(range_bytes, size - index * range_bytes) for index in done)
+    lock = threading.Lock()
+    
+    def fetch_range(index):
+        nonlocal received
+        start = index * range_bytes
+        end = min(size, start + range_bytes) - 1
+        headers = {'Range': f'bytes={start}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+        written = 0
+        with ingest_request('GET', url, headers=headers, stream=True, timeout=60) as response:
+            if response.status_code != 206:
+                raise IOError(f"Server ignored range request (HTTP {response.status_code})")
+            # Each range writes through its own handle at its own offset
+            with open(dest_path, 'r+b') as f:
+                f.seek(start)
+                for block in response.iter_content(buffer_bytes):
+                    f.write(block)
+                    written += len(block)
+                    with lock:
+                        received += len(block)
+                        if on_progress:
+                            on_progress(received, size)
+        if written != end - start + 1:
+            raise IOError(f"Range {start}-{end} came back short ({written} bytes)")
+        with lock:
+            done.add(index)
+            state['done'] = sorted(done)
+            save_ingest_state(state_path, state)
+    
+    pending = [index for index in range(total_ranges) if index not in done]
+    with ThreadPoolExecutor(max_workers=app.config['INGEST_CONNECTIONS']) as executor:
+        list(executor.map(fetch_range, pending))
+    os.remove(state_path)
+    return size
+
+def ingest_url(task_id, url, session_id, stream_split=False, part_size_mb=None):
+    """Fetch a remote video into the upload folder, or straight into the segmenter"""
+    def update(**fields):
+        ingest_status[task_id] = {**ingest_status[task_id], **fields}
+    
+    def on_progress(received, total):
+        if total:
+            update(progress=round(received / total * 100, 1))
+    
+    try:
+        filename = secure_filename(os.path.basename(url.split('?', 1)[0]))
+        if not allowed_file(filename):
+            raise ValueError("URL does not point to an allowed video file")
+        name, ext = os.path.splitext(filename)
+        update(filename=filename)
+        
+        if stream_split:
+            response = ingest_request('GET', url, stream=True, timeout=60)
+            response.raise_for_status()
+            total = int(response.headers.get('Content-Length') or 0)
+            chunks = response.iter_content(app.config['INGEST_BUFFER_KB'] * 1024)
+            head, chunks = read_head(chunks, app.config['INGEST_PROBE_MB'] * 1024 * 1024)
+            duration = probe_head_duration(head) if is_streamable_head(head, ext) else None
+            
+            if duration and total and not admission.can_start_split():
+                logger.info(f"Server busy, downloading {filename} to split it once /process admits it")
+                duration = None
+            # A stream can't wait in the split queue, so it only goes straight in when a slot is free now
+            with split_scheduler.slot(session_id, total, wait=False) if duration and total \
+                    else nullcontext(False) as started:
+                if started:
+                    output_folder = os.path.join(app.config['BASE_SPLIT_FOLDER'], name)
+                    os.makedirs(output_folder, exist_ok=True)
+                    session_store.add(session_id, 'splits', output_folder)
+                    update(stage="Downloading and splitting")
+                    
+                    def counted(chunks):
+                        received = 0
+                        for chunk in chunks:
+                            received += len(chunk)
+                            on_progress(received, total)
+                            yield chunk
+                    
+                    segment_time = get_segment_time(duration, total, get_part_size_mb(part_size_mb))
+                    with response:
+                        part_files = segment_stream_with_ffmpeg(
+                            counted(chunks), output_folder, name, ext, segment_time
+                        )
+                    update(
+                        stage="Completed", progress=100, done=True,
+                        folder_name=name, split_files=part_files,
+                        thumbnails=build_thumbnail_urls(output_folder, name, part_files)
+                    )
+                    return
+            
+            response.close()
+            logger.info(f"Not splitting {filename} from the stream, downloading it first")
+        
+        update(stage="Downloading")
+        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        session_store.add(session_id, 'uploads', upload_path)
+        size = fetch_url_to_file(url, upload_path, on_progress)
+        logger.info(f"Ingested {filename} ({size} bytes) from {url}")
+        update(stage="Completed", progress=100, done=True)
+    
+    except Exception as e:
+        update(stage="Error", done=False, error=str(e))
+        if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+            logger.error(f"ffmpeg failed: {e.stderr.decode('utf-8', 'replace')}")
+        logger.exception("URL ingest error")
+
+class ProgressCallback:
+    """Callback class for Telegram upload progress"""
+    def __init__(self, task_id, part_index, total_parts):
+        self.task_id = task_id
         self.part_index = part_index
         self.total_parts = total_parts
         self.start_time = time.time()
@@ -239,8 +2299,431 @@ class ProgressCallback:
                 "error": None
             }
 
+def get_upload_media_kwargs(file_path):
+    """send_file options that let MP4 parts play as streamable video"""
+    kwargs = {'force_document': True}
+    thumb_path = get_thumbnail_path(file_path)
+    if os.path.exists(thumb_path):
+        kwargs['thumb'] = thumb_path
+    
+    if os.path.splitext(file_path)[1].lower() not in STREAMABLE_UPLOAD_EXTENSIONS:
+        return kwargs
+    
+    info = part_metadata.get(file_path) or probe_video(file_path)
+    if not info:
+        return kwargs
+    
+    from telethon import types
+    return {
+        **kwargs,
+        'force_document': False,
+        'supports_streaming': True,
+        'attributes': [types.DocumentAttributeVideo(
+            duration=int(round(info['duration'])),
+            w=info['width'],
+            h=info['height'],
+            supports_streaming=True
+        )]
+    }
+
+async def connect_telegram(account):
+    """Start a Telethon client for an account and make sure it can upload"""
+    from telethon import TelegramClient, functions
+    from telethon.errors import RPCError
+    
+    # Create session directory if not exists
+    Path(account.session_path).parent.mkdir(exist_ok=True)
+    
+    client = TelegramClient(account.session_path, api_id, api_hash)
+    if account.bot_token:
+        await client.start(bot_token=account.bot_token)
+    else:
+        await client.start()
+    
+    # Fix time synchronization issue
+    try:
+        await client(functions.help.GetConfigRequest())
+    except RPCError as e:
+        logger.warning(f"Time sync issue: {e}")
+        # Attempt to fix time offset
+        await client(functions.help.GetNearestDcRequest())
+        await client(functions.help.GetConfigRequest())
+
+    if not await client.is_user_authorized():
+        raise Exception(f"Telegram account {account.name} is not authorized")
+    if account.premium is None:
+        await record_premium(client, account)
+    return client
+
+async def record_premium(client, account):
+    me = await client.get_me()
+    account.premium = bool(getattr(me, 'premium', False))
+    logger.info(f"Telegram account {account.name} is {'' if account.premium else 'not '}Premium; "
+                f"parts up to {account.max_file_size_mb} MB")
+
+async def check_premium(account):
+    """Premium status of an already authorized session, without the interactive login of start()"""
+    from telethon import TelegramClient
+    
+    client = TelegramClient(account.session_path, api_id, api_hash)
+    await client.connect()
+    try:
+        if await client.is_user_authorized():
+            await record_premium(client, account)
+    finally:
+        await client.disconnect()
+
+def get_part_size_mb(requested=None):
+    """Part size for a job: the requested size, or the largest the upload accounts accept"""
+    limit = account_pool.max_file_size_mb()
+    if not requested:
+        return limit
+    return max(MIN_PART_SIZE_MB, min(int(requested), limit))
+
+async def open_upload_senders(client, count):
+    """Extra connections on the same authorized session, so one part can use several at once"""
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+    
+    session_string = StringSession.save(client.session)
+    senders = [client]
+    for _ in range(max(0, count - 1)):
+        sender = TelegramClient(StringSession(session_string), api_id, api_hash)
+        try:
+            await sender.connect()
+        except Exception as e:
+            logger.warning(f"Could not open extra upload connection: {e}")
+            break
+        senders.append(sender)
+    return senders
+
+async def close_upload_senders(senders):
+    # The first sender is the main client, which the caller disconnects itself
+    await asyncio.gather(*(sender.disconnect() for sender in senders[1:]), return_exceptions=True)
+
+def read_chunk(f, offset, size):
+    """Read a chunk at an offset without moving a shared file position where pread exists"""
+    if hasattr(os, 'pread'):
+        return os.pread(f.fileno(), size, offset)
+    f.seek(offset)
+    return f.read(size)
+
+def write_chunk(f, offset, data):
+    """Counterpart of read_chunk for writing at an offset"""
+    if hasattr(os, 'pwrite'):
+        os.pwrite(f.fileno(), data, offset)
+    else:
+        f.seek(offset)
+        f.write(data)
+
+def preallocate(f, size):
+    """Reserve size bytes up front so ranged writes don't fragment the file"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass
+    f.truncate(size)
+
 # Async upload handler for Telegram
-def background_upload(task_id, folder_path, filename):
+def file_md5(file_path):
+    """MD5 hex digest Telegram expects for small (non-big) uploads"""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def get_part_key(file_path):
+    """Identity of one version of a part file in the upload ledger"""
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime}"
+
+def get_destination_key(account, destination):
+    """Ledger name for a destination; 'me' is a different chat for every account"""
+    if destination == 'me':
+        return f"me@{account.name}"
+    return str(destination)
+
+class ChunkedUploader:
+    """Uploads a file as SaveFilePart/SaveBigFilePart requests, resuming from the ledger
+
+    Up to `window` chunks are in flight at once, spread round-robin over
+    `senders`. Only needs `await sender(request)`, so anything that answers
+    those requests (such as a fake MTProto stand-in) can take a client's place.
+    """
+    def __init__(self, client, ledger, chunk_size=UPLOAD_PART_SIZE_KB * 1024, senders=None, window=1,
+                 throttle=None):
+        self.client = client
+        self.throttle = throttle
+        self.ledger = ledger
+        self.chunk_size = chunk_size
+        self.senders = senders or [client]
+        self.window = max(1, window)
+    
+    async def upload(self, file_path, upload_key, progress_callback=None):
+        from telethon.tl import functions, types
+        
+        file_size = os.path.getsize(file_path)
+        file_name = os.path.basename(file_path)
+        total_chunks = max(1, math.ceil(file_size / self.chunk_size))
+        is_big = file_size > BIG_FILE_THRESHOLD
+        
+        file_id, acked = self.ledger.begin(upload_key, total_chunks, self.chunk_size)
+        if acked:
+            logger.info(f"Resuming {file_name}: {len(acked)}/{total_chunks} chunks already on Telegram")
+        acked_bytes = sum(min(self.chunk_size, file_size - index * self.chunk_size) for index in acked)
+        pending = iter([index for index in range(total_chunks) if index not in acked])
+        
+        async def worker(f, sender):
+            nonlocal acked_bytes
+            # Workers share one iterator, so every chunk is taken exactly once
+            for index in pending:
+                data = read_chunk(f, index * self.chunk_size, self.chunk_size)
+                if self.throttle:
+                    await self.throttle(len(data))
+                if is_big:
+                    request = functions.upload.SaveBigFilePartRequest(file_id, index, total_chunks, data)
+                else:
+                    request = functions.upload.SaveFilePartRequest(file_id, index, data)
+                if not await sender(request):
+                    raise IOError(f"Telegram rejected chunk {index} of {file_name}")
+                
+                self.ledger.ack(upload_key, index)
+                acked_bytes += len(data)
+                if progress_callback:
+                    progress_callback(acked_bytes, file_size)
+        
+        slots = min(self.window, total_chunks)
+        # Without pread every worker needs its own file position
+        files = [open(file_path, 'rb') for _ in range(1 if hasattr(os, 'pread') else slots)]
+        try:
+            await run_workers(
+                worker(files[slot % len(files)], self.senders[slot % len(self.senders)]) for slot in range(slots)
+            )
+        finally:
+            for f in files:
+                f.close()
+        
+        if is_big:
+            return types.InputFileBig(file_id, total_chunks, file_name)
+        return types.InputFile(file_id, total_chunks, file_name, file_md5(file_path))
+    
+    async def upload_stream(self, read, file_size, file_name, progress_callback=None, retry=None):
+        """Upload chunks as read() produces them, with no file or ledger behind them
+
+        read() is awaited once per chunk and must return chunk_size bytes (fewer
+        for the last one). A stream can't be read twice, so retry wraps each chunk
+        request instead of the whole upload. Returns the InputFile and the
+        stream's size and hash.
+        """
+        from telethon.tl import functions, types
+        
+        total_chunks = max(1, math.ceil(file_size / self.chunk_size))
+        is_big = file_size > BIG_FILE_THRESHOLD
+        file_id = secrets.randbits(63)
+        digest = hashlib.new(HASH_ALGORITHM)
+        md5 = hashlib.md5()
+        next_index = 0
+        acked_bytes = 0
+        reading = asyncio.Lock()
+        
+        async def worker(sender):
+            nonlocal next_index, acked_bytes
+            while True:
+                # Chunks come off the stream in order, so indexes and hashes follow the bytes
+                async with reading:
+                    if next_index >= total_chunks:
+                        return
+                    index = next_index
+                    next_index += 1
+                    data = await read()
+                    expected = min(self.chunk_size, file_size - index * self.chunk_size)
+                    if len(data) != expected:
+                        raise IOError(f"{file_name} ended after {index * self.chunk_size + len(data)} "
+                                      f"of {file_size} bytes")
+                    digest.update(data)
+                    if not is_big:
+                        md5.update(data)
+                
+                if self.throttle:
+                    await self.throttle(len(data))
+                if is_big:
+                    request = functions.upload.SaveBigFilePartRequest(file_id, index, total_chunks, data)
+                else:
+                    request = functions.upload.SaveFilePartRequest(file_id, index, data)
+                sent = await (retry(lambda: sender(request)) if retry else sender(request))
+                if not sent:
+                    raise IOError(f"Telegram rejected chunk {index} of {file_name}")
+                
+                acked_bytes += len(data)
+                if progress_callback:
+                    progress_callback(acked_bytes, file_size)
+        
+        slots = min(self.window, total_chunks)
+        await run_workers(worker(self.senders[slot % len(self.senders)]) for slot in range(slots))
+        
+        source_digest = {'size': file_size, HASH_ALGORITHM: digest.hexdigest()}
+        if is_big:
+            return types.InputFileBig(file_id, total_chunks, file_name), source_digest
+        return types.InputFile(file_id, total_chunks, file_name, md5.hexdigest()), source_digest
+
+async def run_workers(coroutines):
+    """Run coroutines together; if one fails the rest are cancelled before the error propagates"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+class StreamBuffer:
+    """Bounded hand-off of request body chunks from a request thread to an uploader
+
+    put() blocks while the buffer is full, so a slow Telegram upload stops the
+    request thread reading and the browser's TCP window fills up behind it.
+    Either side can abort() to release the other.
+    """
+    def __init__(self, max_chunks):
+        self.chunks = queue.Queue(max(1, max_chunks))
+        self.aborted = threading.Event()
+    
+    def put(self, data):
+        """False once the consumer has given up"""
+        while not self.aborted.is_set():
+            try:
+                self.chunks.put(data, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def get(self):
+        while not self.aborted.is_set():
+            try:
+                return self.chunks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        raise IOError("Upload stream was aborted")
+    
+    def abort(self):
+        self.aborted.set()
+
+def read_exact(stream, size):
+    """Read size bytes, or fewer only if the stream ends; request.stream may return short reads"""
+    parts = []
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return b''.join(parts)
+
+async def send_part(client, account, file_path, caption, destinations, progress_cb, on_flood_wait, senders=None,
+                    throttle=None):
+    """Get one part into every destination, skipping chats it already reached and chunks already uploaded
+
+    Returns the number of bytes actually uploaded.
+    """
+    from telethon.errors import RPCError
+    
+    part_key = get_part_key(file_path)
+    sent = upload_ledger.sends(part_key)
+    pending = [d for d in destinations if get_destination_key(account, d) not in sent]
+    if not pending:
+        return 0
+    
+    media = None
+    reusable = [(d, sent[get_destination_key(account, d)]) for d in destinations
+                if get_destination_key(account, d) in sent]
+    if reusable:
+        # Already on Telegram from an earlier attempt: forward its media instead of uploading again
+        destination, message_id = reusable[0]
+        message = await client.get_messages(destination, ids=message_id)
+        media = message.media if message else None
+    
+    uploaded_bytes = 0
+    if media is None:
+        upload_key = f"{account.name}|{part_key}"
+        for attempt in range(2):
+            uploader = ChunkedUploader(client, upload_ledger, senders=senders,
+                                       window=app.config['UPLOAD_WINDOW'], throttle=throttle)
+            uploaded = await retry_flood_wait(account, lambda: uploader.upload(
+                file_path, upload_key, progress_cb
+            ), on_flood_wait)
+            try:
+                # The first send turns the upload into a document; the rest reuse that media
+                message = await retry_flood_wait(account, lambda: client.send_file(
+                    pending[0],
+                    uploaded,
+                    caption=caption,
+                    **get_upload_media_kwargs(file_path)
+                ), on_flood_wait)
+                break
+            except RPCError as e:
+                if 'FILE_PART' not in str(e) or attempt:
+                    raise
+                # Telegram no longer has the stored chunks; upload this part from scratch
+                logger.warning(f"Stored chunks of {file_path} expired, uploading again: {e}")
+                upload_ledger.forget(upload_key)
+        uploaded_bytes = os.path.getsize(file_path)
+        upload_ledger.forget(upload_key)
+        upload_ledger.mark_sent(part_key, get_destination_key(account, pending[0]), message.id, caption)
+        media = message.media
+        pending = pending[1:]
+    
+    messages = await asyncio.gather(*(
+        retry_flood_wait(account, lambda dest=dest: client.send_file(
+            dest, media, caption=caption
+        ), on_flood_wait)
+        for dest in pending
+    ))
+    for dest, message in zip(pending, messages):
+        upload_ledger.mark_sent(part_key, get_destination_key(account, dest), message.id, caption)
+    return uploaded_bytes
+
+async def recaption_parts(client, account, captions, destinations, on_flood_wait):
+    """Correct the captions of parts already sent, e.g. once a streaming split knows its real part count
+
+    captions maps each part file to the caption it should have.
+    """
+    from telethon.errors import MessageNotModifiedError
+    
+    for file_path, caption in captions.items():
+        part_key = get_part_key(file_path)
+        sent = upload_ledger.sends(part_key)
+        for destination in destinations:
+            key = get_destination_key(account, destination)
+            if key not in sent:
+                continue
+            try:
+                await retry_flood_wait(account, lambda: client.edit_message(
+                    destination, sent[key], caption
+                ), on_flood_wait)
+            except MessageNotModifiedError:
+                pass
+            upload_ledger.mark_sent(part_key, key, sent[key], caption)
+
+async def retry_flood_wait(account, action, on_wait=None):
+    """Run an upload/send coroutine, sitting out FLOOD_WAITs and marking the account's cooldown"""
+    from telethon.errors import FloodWaitError
+    
+    while True:
+        try:
+            return await action()
+        except FloodWaitError as e:
+            # New jobs go to other accounts while this one cools down
+            account_pool.record_flood_wait(account, e.seconds)
+            if on_wait:
+                on_wait(e.seconds)
+            await asyncio.sleep(e.seconds)
+
+def background_upload(task_id, folder_path, filename, destinations=None, session_id=None):
+    """Upload every part once and send it to each destination chat"""
     try:
         upload_status[task_id] = {
             "stage": "Preparing upload",
@@ -250,71 +2733,238 @@ def background_upload(task_id, folder_path, filename):
             "error": None
         }
 
+        # Parts of a split that is still streaming in are picked up as the segmenter finishes them
+        stream_split = active_stream_splits.get(folder_path)
+        
         # Get all files in the folder
-        files = sorted(glob.glob(os.path.join(folder_path, '*')))
-        if not files:
+        files = [] if stream_split else list_part_files(folder_path)
+        if not files and not stream_split:
             raise Exception("No files found in folder")
         
-        total_parts = len(files)
+        total_parts = stream_split['expected_parts'] if stream_split else len(files)
+        
+        async def iter_parts():
+            if not stream_split:
+                for file_path in files:
+                    yield file_path
+                return
+            seen = 0
+            while True:
+                # Check for completion before listing so the final parts are never missed
+                finished = stream_split['done']
+                for part_filename in read_segment_list(folder_path)[seen:]:
+                    seen += 1
+                    yield os.path.join(folder_path, part_filename)
+                if finished:
+                    break
+                await asyncio.sleep(1)
+            if stream_split.get('error'):
+                raise Exception(f"Streaming split failed: {stream_split['error']}")
+        
+        destinations = [parse_destination(d) for d in (destinations or [telegram_destination])]
+        
+        async def throttle(amount):
+            await upload_throttle.consume(session_id, amount)
         
         async def send():
-            # Create session directory if not exists
-            session_dir = Path("telegram_session")
-            session_dir.mkdir(exist_ok=True)
-            session_path = str(session_dir / "session")
-            
-            client = TelegramClient(session_path, api_id, api_hash)
-            await client.start()
+            nonlocal total_parts
+            with timed('connect'):
+                client = await connect_telegram(account)
+                senders = await open_upload_senders(client, app.config['UPLOAD_CONNECTIONS'])
             
-            # Fix time synchronization issue
             try:
-                await client(functions.help.GetConfigRequest())
-            except RPCError as e:
-                logger.warning(f"Time sync issue: {e}")
-                # Attempt to fix time offset
-                await client(functions.help.GetNearestDcRequest())
-                await client(functions.help.GetConfigRequest())
-
-            if not await client.is_user_authorized():
-                raise Exception("Telegram client is not authorized")
-
-            for i, file_path in enumerate(files, 1):
-                part_filename = os.path.basename(file_path)
-                caption = f"{filename} - Part {i}/{total_parts}"
-                part_size = os.path.getsize(file_path)
+                i = 0
+                # Captions sent while a streaming split only had an estimated part count
+                estimated = {}
+                async for file_path in iter_parts():
+                    i += 1
+                    if stream_split:
+                        # The segmenter cuts on keyframes, so the count is only exact once it is done
+                        total_parts = stream_split['expected_parts'] if stream_split['done'] else \
+                            max(stream_split['expected_parts'], i)
+                    part_filename = os.path.basename(file_path)
+                    caption = f"{filename} - Part {i}/{total_parts}"
+                    
+                    # Create progress callback
+                    progress_cb = ProgressCallback(task_id, i, total_parts)
+                    
+                    # Update status before starting upload
+                    upload_status[task_id] = {
+                        "stage": f"Starting upload of part {i}/{total_parts}",
+                        "progress": ((i-1) / total_parts) * 100,
+                        "speed": 0,
+                        "done": False,
+                        "error": None
+                    }
+                    
+                    def on_flood_wait(seconds):
+                        upload_status[task_id] = {
+                            **upload_status[task_id],
+                            "stage": f"Rate limited on {account.name}, retrying part {i}/{total_parts} in {seconds}s",
+                            "speed": 0
+                        }
+                    
+                    # Upload the bytes once with progress callback, then send to every destination
+                    with timed('upload'):
+                        uploaded_bytes = await send_part(
+                            client, account, file_path, caption, destinations, progress_cb, on_flood_wait, senders,
+                            throttle
+                        )
+                    account_pool.record_bytes(account, uploaded_bytes)
+                    if stream_split:
+                        estimated[file_path] = total_parts
+                    
+                    # Update status after part upload
+                    upload_status[task_id] = {
+                        "stage": f"Completed part {i}/{total_parts}",
+                        "progress": (i / total_parts) * 100,
+                        "speed": 0,
+                        "done": False,
+                        "error": None
+                    }
                 
-                # Create progress callback
-                progress_cb = ProgressCallback(task_id, i, total_parts)
+                wrong = {path: f"{filename} - Part {index}/{i}"
+                         for index, (path, total) in enumerate(estimated.items(), 1) if total != i}
+                if wrong:
+                    # Restores only accept parts whose captions agree on the total
+                    def on_recaption_flood_wait(seconds):
+                        upload_status[task_id] = {
+                            **upload_status[task_id],
+                            "stage": f"Rate limited on {account.name}, retrying captions in {seconds}s"
+                        }
+                    upload_status[task_id] = {**upload_status[task_id], "stage": "Correcting part captions"}
+                    logger.info(f"Stream split of {filename} ended with {i} parts, correcting {len(wrong)} captions")
+                    await recaption_parts(client, account, wrong, destinations, on_recaption_flood_wait)
+                
+                # The manifest goes last so restores can check every part against it
+                manifest_path = find_manifest(folder_path)
+                if manifest_path:
+                    def on_manifest_flood_wait(seconds):
+                        upload_status[task_id] = {
+                            **upload_status[task_id],
+                            "stage": f"Rate limited on {account.name}, retrying manifest in {seconds}s"
+                        }
+                    upload_status[task_id] = {**upload_status[task_id], "stage": "Sending manifest"}
+                    with timed('manifest'):
+                        await send_part(
+                            client, account, manifest_path, get_manifest_caption(filename), destinations,
+                            None, on_manifest_flood_wait, senders, throttle
+                        )
+            finally:
+                # Failed or cancelled uploads must not leave the extra connections open
+                await close_upload_senders(senders)
+                await client.disconnect()
+            
+            upload_status[task_id] = {
+                "stage": "Completed",
+                "progress": 100,
+                "speed": 0,
+                "done": True,
+                "error": None
+            }
+
+        account = account_pool.acquire()
+        logger.info(f"Upload {task_id} assigned to account {account.name}")
+        started = time.time()
+        try:
+            # The event loop runs in this thread, so cProfile sees every coroutine of the upload
+            with profiles.profile(task_id, os.path.basename(folder_path)), job_timer(task_id):
+                asyncio.run(send())
+        finally:
+            account_pool.release(account, time.time() - started)
+
+    except Exception as e:
+        upload_status[task_id] = {
+            "stage": "Error",
+            "progress": 0,
+            "speed": 0,
+            "done": False,
+            "error": str(e)
+        }
+        logger.error(f"Upload failed: {str(e)}")
+        # Log full exception
+        logger.exception("Telegram upload error")
+
+def passthrough_upload(task_id, filename, file_size, buffer, destinations=None, session_id=None):
+    """Upload a file as its chunks arrive in buffer and send it as a single part
+
+    Nothing is written to disk: the part is hashed as it streams past and the
+    manifest is sent from memory.
+    """
+    try:
+        upload_status[task_id] = {
+            "stage": "Preparing upload",
+            "progress": 0,
+            "speed": 0,
+            "done": False,
+            "error": None
+        }
+        destinations = [parse_destination(d) for d in (destinations or [telegram_destination])]
+        caption = f"{filename} - Part 1/1"
+        
+        async def throttle(amount):
+            await upload_throttle.consume(session_id, amount)
+        
+        def on_flood_wait(seconds):
+            upload_status[task_id] = {
+                **upload_status[task_id],
+                "stage": f"Rate limited on {account.name}, retrying in {seconds}s",
+                "speed": 0
+            }
+        
+        async def send_to_all(client, file, caption):
+            # The first send turns the upload into a document; the rest reuse that media
+            first = await retry_flood_wait(account, lambda: client.send_file(
+                destinations[0], file, caption=caption, force_document=True
+            ), on_flood_wait)
+            rest = await asyncio.gather(*(
+                retry_flood_wait(account, lambda dest=dest: client.send_file(
+                    dest, first.media, caption=caption
+                ), on_flood_wait)
+                for dest in destinations[1:]
+            ))
+            return [first, *rest]
+        
+        async def send():
+            with timed('connect'):
+                client = await connect_telegram(account)
+                senders = await open_upload_senders(client, app.config['UPLOAD_CONNECTIONS'])
+            try:
+                loop = asyncio.get_running_loop()
                 
-                # Update status before starting upload
-                upload_status[task_id] = {
-                    "stage": f"Starting upload of part {i}/{total_parts}",
-                    "progress": ((i-1) / total_parts) * 100,
-                    "speed": 0,
-                    "done": False,
-                    "error": None
-                }
+                async def read():
+                    # buffer.get() blocks until the request thread hands over the next chunk
+                    return await loop.run_in_executor(None, buffer.get)
                 
-                # Upload the file with progress callback
-                await client.send_file(
-                    "me", 
-                    file_path, 
-                    caption=caption,
-                    progress_callback=progress_cb,
-                    part_size_kb=1024,  # 1MB chunks for better progress updates
-                    force_document=True
-                )
+                upload_status[task_id] = {**upload_status[task_id], "stage": "Uploading part 1/1"}
+                uploader = ChunkedUploader(client, None, senders=senders, window=app.config['UPLOAD_WINDOW'],
+                                           throttle=throttle)
+                with timed('upload'):
+                    uploaded, digest = await uploader.upload_stream(
+                        read, file_size, filename, ProgressCallback(task_id, 1, 1),
+                        retry=lambda action: retry_flood_wait(account, action, on_flood_wait)
+                    )
+                    messages = await send_to_all(client, uploaded, caption)
+                account_pool.record_bytes(account, file_size)
+                # Recorded like a split part so restores can find it without searching
+                for dest, message in zip(destinations, messages):
+                    upload_ledger.mark_sent(f"passthrough|{task_id}", get_destination_key(account, dest),
+                                            message.id, caption)
                 
-                # Update status after part upload
-                upload_status[task_id] = {
-                    "stage": f"Completed part {i}/{total_parts}",
-                    "progress": (i / total_parts) * 100,
-                    "speed": 0,
-                    "done": False,
-                    "error": None
-                }
-
-            await client.disconnect()
+                upload_status[task_id] = {**upload_status[task_id], "stage": "Sending manifest"}
+                manifest = build_manifest(filename, 'raw', digest, [(filename, digest)])
+                manifest_file = io.BytesIO(json.dumps(manifest, indent=2).encode())
+                manifest_file.name = os.path.basename(get_manifest_path('', os.path.splitext(filename)[0]))
+                with timed('manifest'):
+                    await send_to_all(client, manifest_file, get_manifest_caption(filename))
+            except BaseException:
+                # Stop the request thread feeding a buffer nobody reads any more
+                buffer.abort()
+                raise
+            finally:
+                await close_upload_senders(senders)
+                await client.disconnect()
+            
             upload_status[task_id] = {
                 "stage": "Completed",
                 "progress": 100,
@@ -322,75 +2972,529 @@ def background_upload(task_id, folder_path, filename):
                 "done": True,
                 "error": None
             }
+        
+        account = account_pool.acquire()
+        logger.info(f"Passthrough upload {task_id} assigned to account {account.name}")
+        started = time.time()
+        try:
+            with profiles.profile(task_id), job_timer(task_id):
+                asyncio.run(send())
+        finally:
+            account_pool.release(account, time.time() - started)
+    
+    except Exception as e:
+        buffer.abort()
+        upload_status[task_id] = {
+            "stage": "Error",
+            "progress": 0,
+            "speed": 0,
+            "done": False,
+            "error": str(e)
+        }
+        logger.exception("Passthrough upload error")
+
+def get_manifest_caption(filename):
+    return f"{filename} - Manifest"
+
+async def fetch_manifest(client, destination, filename):
+    """Newest manifest uploaded for filename, or None for uploads made without one"""
+    caption = get_manifest_caption(filename)
+    async for message in client.iter_messages(destination, search=caption, limit=20):
+        if message.message == caption and message.file:
+            data = await client.download_media(message, file=bytes)
+            return json.loads(data)
+    return None
+
+def verify_parts(manifest, spans):
+    """Hash downloaded parts in parallel and check them against the manifest
+
+    spans holds a (path, offset, size) triple per part.
+    """
+    with ThreadPoolExecutor(max_workers=get_split_workers(len(spans))) as executor:
+        digests = list(executor.map(lambda span: hash_file(*span), spans))
+    bad = [
+        entry['index'] for entry, digest in zip(manifest['parts'], digests)
+        if digest != {'size': entry['size'], HASH_ALGORITHM: entry.get(HASH_ALGORITHM)}
+    ]
+    if bad:
+        raise Exception(f"Parts {', '.join(map(str, bad))} don't match the manifest")
+
+def parse_part_caption(caption):
+    """(filename, index, total) from a caption written by background_upload, or None"""
+    match = PART_CAPTION_RE.match(caption or '')
+    if not match:
+        return None
+    return match['filename'], int(match['index']), int(match['total'])
+
+async def find_uploaded_parts(client, destination, filename, message_ids=None):
+    """Messages with parts 1..N of filename, from known message ids or by searching captions"""
+    if message_ids:
+        messages = await client.get_messages(destination, ids=message_ids)
+    else:
+        messages = [m async for m in client.iter_messages(destination, search=f"{filename} - Part")]
+    
+    candidates = []
+    for message in messages:
+        parsed = parse_part_caption(getattr(message, 'message', None)) if message else None
+        if parsed and parsed[0] == filename and message.file:
+            candidates.append((message.id, parsed[1], parsed[2], message))
+    if not candidates:
+        raise Exception(f"No parts of {filename} found in {destination}")
+    
+    # The file may have been sent more than once; use the newest complete upload
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    total = candidates[0][2]
+    parts = {}
+    for _, index, part_total, message in candidates:
+        if part_total == total:
+            parts.setdefault(index, message)
+    missing = [i for i in range(1, total + 1) if i not in parts]
+    if missing:
+        raise Exception(f"Parts {', '.join(map(str, missing))} of {filename} are missing")
+    return [parts[i] for i in range(1, total + 1)]
+
+async def download_parts(senders, messages, targets, on_bytes):
+    """Download parts as ranged iter_download requests spread over several connections
+
+    targets holds a (file, base offset) pair per message; each range is
+    written at base offset + its position in the part.
+    """
+    request_size = UPLOAD_PART_SIZE_KB * 1024
+    range_size = max(1, app.config['RESTORE_RANGE_MB'] * 1024 * 1024 // request_size) * request_size
+    ranges = iter([
+        (message, f, base, offset, min(range_size, message.file.size - offset))
+        for message, (f, base) in zip(messages, targets)
+        for offset in range(0, message.file.size, range_size)
+    ])
+    
+    async def worker(sender):
+        # Workers share one iterator, so every range is fetched exactly once
+        for message, f, base, offset, length in ranges:
+            position = offset
+            async for chunk in sender.iter_download(
+                message.media, offset=offset, request_size=request_size,
+                limit=math.ceil(length / request_size)
+            ):
+                chunk = chunk[:offset + length - position]
+                write_chunk(f, base + position, chunk)
+                position += len(chunk)
+                on_bytes(len(chunk))
+    
+    # A failed range cancels the others before the caller closes or deletes the files they write to
+    await run_workers(
+        worker(senders[slot % len(senders)]) for slot in range(app.config['RESTORE_CONNECTIONS'])
+    )
+
+def concat_parts(part_paths, output_path):
+    """Join remuxed parts back into one file with ffmpeg's concat demuxer, without re-encoding"""
+    list_path = output_path + '.concat.txt'
+    with open(list_path, 'w') as f:
+        for part_path in part_paths:
+            escaped = part_path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path, '-map', '0', '-c', 'copy']
+        cmd.extend(get_movflags(output_path))
+        cmd.append(output_path)
+        run_ffmpeg(cmd)
+    finally:
+        os.remove(list_path)
+
+def restore_from_telegram(task_id, filename, destination=None, mode=None):
+    """Download every part of filename back from Telegram and join them into one file
+
+    'concat' remuxes ffmpeg-split parts with the concat demuxer; 'raw' writes
+    byte-split parts straight to their offsets in one preallocated file. Without
+    a mode, the uploaded manifest decides. Parts are checked against the manifest
+    when there is one.
+    """
+    def update(**fields):
+        restore_status[task_id] = {**restore_status[task_id], **fields}
+    
+    restore_dir = os.path.join(app.config['BASE_SPLIT_FOLDER'], RESTORE_DIR, task_id)
+    try:
+        os.makedirs(restore_dir, exist_ok=True)
+        output_path = os.path.join(restore_dir, filename)
+        destination = parse_destination(destination or telegram_destination)
+        
+        # Saved Messages belong to one account, so 'me' must be restored through the uploader
+        known = upload_ledger.find_messages(filename)
+        account_name = None
+        if destination == 'me':
+            account_name = next((key.split('@', 1)[1] for key in known if key.startswith('me@')), None)
+        
+        async def restore():
+            client = await connect_telegram(account)
+            senders = await open_upload_senders(client, app.config['RESTORE_CONNECTIONS'])
+            try:
+                update(stage="Finding parts")
+                messages = await find_uploaded_parts(
+                    client, destination, filename, known.get(get_destination_key(account, destination))
+                )
+                sizes = [message.file.size for message in messages]
+                total_bytes = sum(sizes)
+                received = 0
+                
+                manifest = await fetch_manifest(client, destination, filename)
+                if manifest and [part['size'] for part in manifest['parts']] != sizes:
+                    raise Exception("Parts on Telegram don't match the uploaded manifest")
+                join_mode = mode or (manifest or {}).get('mode') or 'concat'
+                
+                def on_bytes(amount):
+                    nonlocal received
+                    received += amount
+                    update(progress=round(received / total_bytes * 100, 1) if total_bytes else 0)
+                
+                update(stage=f"Downloading {len(messages)} parts")
+                if join_mode == 'raw':
+                    offsets = list(itertools.accumulate([0] + sizes[:-1]))
+                    with open(output_path, 'wb') as f:
+                        preallocate(f, total_bytes)
+                        await download_parts(senders, messages, [(f, offset) for offset in offsets], on_bytes)
+                    if manifest:
+                        update(stage="Verifying parts")
+                        verify_parts(manifest, [(output_path, offset, size) for offset, size in zip(offsets, sizes)])
+                    return
+                
+                part_paths = [
+                    os.path.join(restore_dir, secure_filename(message.file.name or '') or f"part{i:03d}")
+                    for i, message in enumerate(messages, 1)
+                ]
+                files = [open(part_path, 'wb') for part_path in part_paths]
+                try:
+                    for f, size in zip(files, sizes):
+                        preallocate(f, size)
+                    await download_parts(senders, messages, [(f, 0) for f in files], on_bytes)
+                finally:
+                    for f in files:
+                        f.close()
+                if manifest:
+                    update(stage="Verifying parts")
+                    verify_parts(manifest, [(path, 0, size) for path, size in zip(part_paths, sizes)])
+                update(stage="Joining parts")
+                concat_parts(part_paths, output_path)
+                for part_path in part_paths:
+                    os.remove(part_path)
+            finally:
+                await close_upload_senders(senders)
+                await client.disconnect()
+        
+        account = account_pool.acquire(account_name)
+        logger.info(f"Restore {task_id} of {filename} assigned to account {account.name}")
+        started = time.time()
+        try:
+            asyncio.run(restore())
+        finally:
+            account_pool.release(account, time.time() - started)
+        
+        # Nobody may come back for it, so the restored file expires like an offloaded download
+        schedule_cleanup(restore_dir)
+        update(stage="Completed", progress=100, done=True, size=os.path.getsize(output_path))
+    
+    except Exception as e:
+        update(stage="Error", done=False, error=str(e))
+        if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+            logger.error(f"ffmpeg failed: {e.stderr.decode('utf-8', 'replace')}")
+        logger.exception("Restore error")
+        schedule_cleanup(restore_dir, 0)
+
+@app.template_global()
+def static_url(filename):
+    """URL for a static asset with a version tag, so it can be cached for a long time"""
+    version = static_versions.get(filename)
+    if version is None:
+        version = int(os.path.getmtime(os.path.join(app.static_folder, filename)))
+        static_versions[filename] = version
+    return url_for('static', filename=filename, v=version)
+
+@app.after_request
+def cache_static_assets(response):
+    """Versioned static assets never change, so let browsers keep them"""
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+@app.before_request
+def ensure_cleanup_thread():
+    """Under gunicorn the __main__ block never runs, so each worker starts cleanup on its first request"""
+    if cleanup_thread_pid != os.getpid():
+        start_cleanup_thread()
+
+@app.before_request
+def start_request_profile():
+    """Admins can profile a single request by sending X-Profile along with X-Admin-Token"""
+    if 'X-Profile' in request.headers and is_admin_request():
+        g.profile_job = request.headers['X-Profile'] or request.path
+        g.profiler = profiles.start()
+
+@app.teardown_request
+def save_request_profile(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiles.save(g.profile_job, profiler)
+
+@app.before_request
+def before_request():
+    """Initialize session tracking"""
+    if request.path.startswith(SESSIONLESS_PATH_PREFIXES):
+        return
+    if 'session_id' not in session:
+        session_id = secrets.token_hex(16)
+        session['session_id'] = session_id
+        logger.info(f"New session started: {session_id}")
+
+@app.route('/')
+def index():
+    # Clean up previous session files
+    cleanup_session_files()
+    response = app.make_response(render_template('index.html'))
+    # Revalidate every time so session cleanup still runs, but answer with 304 when unchanged
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    try:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'error': 'No file part in request'})
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'success': False, 'error': 'No selected file'})
+        
+        if not allowed_file(file.filename):
+            return jsonify({'success': False, 'error': 'Invalid file type'})
+        
+        filename = secure_filename(file.filename)
+        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        
+        # Save file, hashing it as it is written
+        buffer_bytes = app.config['INGEST_BUFFER_KB'] * 1024
+        digest = save_stream(iter(lambda: file.stream.read(buffer_bytes), b''), upload_path)
+        save_source_digest(upload_path, digest)
+        
+        # Verify file was saved
+        if not os.path.exists(upload_path):
+            return jsonify({'success': False, 'error': 'File save failed'})
+        
+        # Track file in session
+        session_store.add(session['session_id'], 'uploads', upload_path)
+        
+        file_size = os.path.getsize(upload_path)
+        logger.info(f"Uploaded {filename} ({file_size} bytes) to {upload_path}")
+        
+        return jsonify({'success': True, 'filename': filename})
+    
+    except Exception as e:
+        logger.exception("Error during upload")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/ingest_url', methods=['POST'])
+def ingest_url_route():
+    try:
+        url = request.form.get('url', '').strip()
+        try:
+            # Checked again on every redirect while fetching
+            check_ingest_url(url)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        
+        task_id = str(uuid.uuid4())
+        ingest_status[task_id] = {
+            "stage": "Queued",
+            "progress": 0,
+            "done": False,
+            "error": None
+        }
+        stream_split = request.form.get('stream') == '1'
+        part_size_mb = parse_part_size(request.form.get('part_size_mb'))
+        Thread(target=ingest_url, args=(task_id, url, session['session_id'], stream_split, part_size_mb)).start()
+        
+        return jsonify({'success': True, 'task_id': task_id})
+    
+    except Exception as e:
+        logger.exception("Error during URL ingest initiation")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/ingest_status/<task_id>')
+def get_ingest_status(task_id):
+    return jsonify(ingest_status.get(task_id, {
+        "error": "Task ID not found",
+        "stage": "Unknown",
+        "progress": 0,
+        "done": False
+    }))
+
+@app.route('/upload_stream', methods=['POST'])
+def upload_stream():
+    """Receive a raw file body and split it while it is still arriving"""
+    try:
+        filename = secure_filename(unquote(request.headers.get('X-Filename', '')))
+        if not filename or not allowed_file(filename):
+            return jsonify({'success': False, 'error': 'Invalid file type'})
+        total = request.content_length
+        if not total:
+            return jsonify({'success': False, 'error': 'Content-Length is required'})
+        
+        progress_key = request.headers.get('X-Upload-Id') or filename
+        name, ext = os.path.splitext(filename)
+        session_id = session['session_id']
+        buffer_bytes = app.config['INGEST_BUFFER_KB'] * 1024
+        chunks = iter(lambda: request.stream.read(buffer_bytes), b'')
+        head, chunks = read_head(chunks, app.config['INGEST_PROBE_MB'] * 1024 * 1024)
+        duration = probe_head_duration(head) if is_streamable_head(head, ext) else None
+        
+        if duration and not admission.can_start_split():
+            logger.info(f"Server busy, saving {filename} to split it once /process admits it")
+            duration = None
+        # The browser is sending now, so the split can't wait in the queue; it runs only if a slot is free
+        with split_scheduler.slot(session_id, total, wait=False) if duration else nullcontext(False) as started:
+            if not started:
+                # Not streamable, or no split slot free right now: store the file as /upload does and let
+                # /process admit and queue the split
+                upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                session_store.add(session_id, 'uploads', upload_path)
+                save_source_digest(upload_path, save_stream(chunks, upload_path))
+                # /process reports under the filename; nothing will fill in the stream's key
+                progress_dict.pop(progress_key, None)
+                logger.info(f"Uploaded {filename} ({os.path.getsize(upload_path)} bytes) to {upload_path}")
+                return jsonify({'success': True, 'filename': filename, 'streamed': False})
+            
+            output_folder = os.path.join(app.config['BASE_SPLIT_FOLDER'], name)
+            os.makedirs(output_folder, exist_ok=True)
+            session_store.add(session_id, 'splits', output_folder)
+            
+            segment_time = get_segment_time(duration, total, get_part_size_mb(
+                parse_part_size(request.headers.get('X-Part-Size-MB'))
+            ))
+            stream_split = {'expected_parts': math.ceil(duration / segment_time), 'done': False}
+            active_stream_splits[output_folder] = stream_split
+            stream_uploads[progress_key] = name
+            
+            def counted(chunks):
+                received = 0
+                for chunk in chunks:
+                    received += len(chunk)
+                    # The last part is only finished once ffmpeg exits
+                    progress_dict[progress_key] = min(99, received / total * 100)
+                    yield chunk
+            
+            try:
+                part_files = segment_stream_with_ffmpeg(
+                    counted(chunks), output_folder, name, ext, segment_time
+                )
+                stream_split['expected_parts'] = len(part_files)
+            except Exception as e:
+                stream_split['error'] = str(e)
+                progress_dict.pop(progress_key, None)
+                raise
+            finally:
+                stream_split['done'] = True
+                active_stream_splits.pop(output_folder, None)
+                stream_uploads.pop(progress_key, None)
+            
+            progress_dict[progress_key] = 100
+            logger.info(f"Split {filename} into {len(part_files)} parts while uploading")
+            
+            return jsonify({
+                'success': True,
+                'streamed': True,
+                'filename': filename,
+                'split_files': part_files,
+                'thumbnails': build_thumbnail_urls(output_folder, name, part_files),
+                'output_folder': output_folder,
+                'folder_name': name
+            })
+    
+    except Exception as e:
+        if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+            logger.error(f"ffmpeg failed: {e.stderr.decode('utf-8', 'replace')}")
+        logger.exception("Error during streaming upload")
+        return jsonify({'success': False, 'error': str(e)})
 
-        asyncio.run(send())
+@app.route('/passthrough', methods=['POST'])
+def passthrough():
+    """Stream a raw file body straight into Telegram without staging it on disk
 
-    except Exception as e:
+    Only for files that fit in one part. The response is sent once Telegram has
+    the file; progress is in /upload_status under the X-Upload-Id header.
+    """
+    try:
+        filename = secure_filename(unquote(request.headers.get('X-Filename', '')))
+        if not filename or not allowed_file(filename):
+            return jsonify({'success': False, 'error': 'Invalid file type'})
+        total = request.content_length
+        if not total:
+            return jsonify({'success': False, 'error': 'Content-Length is required'})
+        if total > account_pool.max_file_size_mb() * 1024 * 1024:
+            return jsonify({'success': False, 'error': 'File is larger than one part; upload it normally to split it'})
+        
+        destinations = parse_destination_list(request.headers.get('X-Destinations'))
+        if len(destinations) > app.config['MAX_UPLOAD_DESTINATIONS']:
+            return jsonify({'success': False, 'error': 'Too many destinations'})
+        rejected = disallowed_destinations(destinations)
+        if rejected:
+            return jsonify({'success': False, 'error': f"Destination not allowed: {', '.join(rejected)}"})
+        
+        admitted, ticket, position = admission.admit('upload', request.headers.get('X-Ticket'))
+        if not admitted:
+            return busy_response(ticket, position)
+        
+        task_id = request.headers.get('X-Upload-Id') or str(uuid.uuid4())
         upload_status[task_id] = {
-            "stage": "Error",
+            "stage": "Queued",
             "progress": 0,
             "speed": 0,
             "done": False,
-            "error": str(e)
+            "error": None
         }
-        logger.error(f"Upload failed: {str(e)}")
-        # Log full exception
-        logger.exception("Telegram upload error")
-
-@app.before_request
-def before_request():
-    """Initialize session tracking"""
-    if 'session_id' not in session:
-        session_id = secrets.token_hex(16)
-        session['session_id'] = session_id
-        logger.info(f"New session started: {session_id}")
-    
-    # Ensure we have storage for this session
-    ensure_session_files(session['session_id'])
-
-@app.route('/')
-def index():
-    # Clean up previous session files
-    cleanup_session_files()
-    return render_template('index.html')
-
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'error': 'No file part in request'})
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'No selected file'})
-        
-        if not allowed_file(file.filename):
-            return jsonify({'success': False, 'error': 'Invalid file type'})
-        
-        filename = secure_filename(file.filename)
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Save file
-        file.save(upload_path)
-        
-        # Verify file was saved
-        if not os.path.exists(upload_path):
-            return jsonify({'success': False, 'error': 'File save failed'})
-        
-        # Track file in session
-        session_id = session['session_id']
-        session_data = ensure_session_files(session_id)
-        session_data['uploads'].append(upload_path)
+        if g.get('profiler'):
+            profiles.arm(task_id)
         
-        file_size = os.path.getsize(upload_path)
-        logger.info(f"Uploaded {filename} ({file_size} bytes) to {upload_path}")
+        buffer = StreamBuffer(app.config['PASSTHROUGH_BUFFER_CHUNKS'])
+        worker = Thread(
+            target=admission.run_upload,
+            args=(passthrough_upload, task_id, filename, total, buffer, destinations, session.get('session_id'))
+        )
+        worker.start()
         
-        return jsonify({'success': True, 'filename': filename})
+        # Chunks go out exactly as Telegram wants them; a full buffer blocks here, not in memory
+        chunk_size = UPLOAD_PART_SIZE_KB * 1024
+        received = 0
+        try:
+            while received < total:
+                data = read_exact(request.stream, min(chunk_size, total - received))
+                if not data or not buffer.put(data):
+                    break
+                received += len(data)
+        finally:
+            if received < total:
+                buffer.abort()
+        worker.join()
+        
+        status = upload_status.get(task_id, {})
+        if not status.get('done'):
+            return jsonify({'success': False, 'task_id': task_id,
+                            'error': status.get('error') or 'Upload was interrupted'})
+        logger.info(f"Passed {filename} ({total} bytes) straight through to Telegram")
+        return jsonify({'success': True, 'task_id': task_id, 'filename': filename})
     
     except Exception as e:
-        logger.exception("Error during upload")
+        logger.exception("Error during passthrough upload")
         return jsonify({'success': False, 'error': str(e)})
 
+def parse_part_size(value):
+    """Part size in MB from a form field or header; empty or 'auto' means the account limit"""
+    if not value or value == 'auto':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
 @app.route('/process', methods=['POST'])
 def process():
     try:
@@ -402,61 +3506,125 @@ def process():
             logger.error(f"File not found: {upload_path}")
             return jsonify({'success': False, 'error': 'Uploaded file not found'})
         
-        name, ext = os.path.splitext(filename)
-        output_folder = os.path.join(app.config['BASE_SPLIT_FOLDER'], name)
-        
-        # Create output folder
-        os.makedirs(output_folder, exist_ok=True)
-        logger.info(f"Created output folder: {output_folder}")
+        admitted, ticket, position = admission.admit('split', request.form.get('ticket'))
+        if not admitted:
+            return busy_response(ticket, position)
         
         # Track folder in session
         session_id = session['session_id']
-        session_data = ensure_session_files(session_id)
-        session_data['splits'].append(output_folder)
-        
-        # Split the video
-        part_files = split_video_with_ffmpeg(upload_path, output_folder)
-        
-        if part_files is None:
-            return jsonify({'success': False, 'error': 'Failed to split video'})
-        
-        # Remove original upload (but keep tracking split folder)
-        try:
-            if upload_path in session_data['uploads']:
-                session_data['uploads'].remove(upload_path)
-            os.remove(upload_path)
-            logger.info(f"Removed original file: {upload_path}")
-        except Exception as e:
-            logger.error(f"Error removing original file: {e}")
-        
-        progress_dict[filename] = 100
-        
-        return jsonify({
-            'success': True,
+        session_store.add(session_id, 'splits', os.path.join(app.config['BASE_SPLIT_FOLDER'],
+                                                             os.path.splitext(filename)[0]))
+        
+        # Optional re-encode to a size-targeted bitrate
+        transcode_preset = None
+        if request.form.get('mode') == 'transcode':
+            transcode_preset = request.form.get('preset') or app.config['TRANSCODE_PRESET']
+            if transcode_preset not in X264_PRESETS:
+                return jsonify({'success': False, 'error': 'Invalid encoder preset'})
+        
+        parallel = request.form.get('parallel')
+        params = {
             'filename': filename,
-            'split_files': part_files,
-            'output_folder': output_folder,
-            'folder_name': name
-        })
+            'session_id': session_id,
+            'part_size_mb': get_part_size_mb(parse_part_size(request.form.get('part_size_mb'))),
+            'transcode_preset': transcode_preset,
+            'parallel': None if parallel is None else parallel == '1'
+        }
+        if job_store:
+            # A worker node splits it; the page follows /progress and collects the result from /job_status
+            job_id = job_store.enqueue('split', filename, params)
+            return jsonify({'success': True, 'queued': True, 'job_id': job_id, 'filename': filename}), 202
+        
+        return jsonify({'success': True, **split_upload(**params)})
     
     except Exception as e:
         logger.exception("Error during processing")
         return jsonify({'success': False, 'error': str(e)})
 
+def split_upload(filename, session_id, part_size_mb, transcode_preset=None, parallel=None):
+    """Split a file from UPLOAD_FOLDER and delete it; run by /process, or by worker.py for a queued job"""
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    name, ext = os.path.splitext(filename)
+    output_folder = os.path.join(app.config['BASE_SPLIT_FOLDER'], name)
+    
+    # Create output folder
+    os.makedirs(output_folder, exist_ok=True)
+    logger.info(f"Created output folder: {output_folder}")
+    
+    # Split the video once the scheduler gives this session a slot
+    with profiles.profile(filename), job_timer(filename):
+        with split_scheduler.slot(session_id, os.path.getsize(upload_path)):
+            part_files = split_video_with_ffmpeg(
+                upload_path,
+                output_folder,
+                part_size_mb,
+                parallel=parallel,
+                transcode_preset=transcode_preset,
+                source_digest=load_source_digest(upload_path),
+                consume_source=True  # The upload is deleted right after
+            )
+        
+        if part_files is None:
+            raise Exception('Failed to split video')
+        thumbnails = build_thumbnail_urls(output_folder, name, part_files)
+    
+    # Remove original upload (but keep tracking split folder)
+    try:
+        session_store.remove(session_id, 'uploads', upload_path)
+        remove_path(upload_path)
+        remove_path(get_digest_path(upload_path))
+        logger.info(f"Removed original file: {upload_path}")
+    except Exception as e:
+        logger.error(f"Error removing original file: {e}")
+    
+    progress_dict[filename] = 100
+    
+    return {
+        'filename': filename,
+        'split_files': part_files,
+        'thumbnails': thumbnails,
+        'output_folder': output_folder,
+        'folder_name': name
+    }
+
 @app.route('/progress/<filename>')
 def progress(filename):
-    prog = progress_dict.get(filename, 0)
-    return jsonify({'progress': round(prog, 2)})
+    prog = progress_dict.get(filename)
+    if prog is None:
+        # Split on a worker node, if jobs are queued
+        status = job_store.status(filename) if job_store else None
+        prog = status.get('progress', 0) if status else 0
+    result = {'progress': round(prog, 2)}
+    
+    # Parts finished so far for an upload that is being split as it arrives
+    folder_name = stream_uploads.get(filename)
+    if folder_name:
+        result['folder_name'] = folder_name
+        result['parts'] = read_segment_list(os.path.join(app.config['BASE_SPLIT_FOLDER'], folder_name))
+    return jsonify(result)
+
+@app.route('/job_status/<job_id>')
+def get_job_status(job_id):
+    """State and, once done, the result of a job queued for worker nodes"""
+    job = job_store.get(job_id) if job_store else None
+    if job is None:
+        return jsonify({'success': False, 'state': 'unknown', 'error': 'Job not found'}), 404
+    if job['state'] == 'failed':
+        return jsonify({'success': False, 'state': 'failed', 'error': job['error']})
+    return jsonify({'success': True, 'state': job['state'], **(job['result'] or {})})
 
 @app.route('/upload_status/<task_id>')
 def get_upload_status(task_id):
-    return jsonify(upload_status.get(task_id, {
+    status = upload_status.get(task_id)
+    if status is None and job_store:
+        status = job_store.status(task_id)
+    return jsonify(status or {
         "error": "Task ID not found",
         "stage": "Unknown",
         "progress": 0,
         "speed": 0,
         "done": False
-    }))
+    })
 
 @app.route('/upload_to_telegram', methods=['POST'])
 def upload_to_telegram():
@@ -468,7 +3636,33 @@ def upload_to_telegram():
         if not os.path.exists(output_folder):
             return jsonify({'success': False, 'error': 'Folder not found'})
         
+        # Optional list of chats/channels; every one gets the same uploaded media
+        destinations = parse_destination_list(request.form.get('destinations'))
+        if len(destinations) > app.config['MAX_UPLOAD_DESTINATIONS']:
+            return jsonify({'success': False, 'error': 'Too many destinations'})
+        rejected = disallowed_destinations(destinations)
+        if rejected:
+            return jsonify({'success': False, 'error': f"Destination not allowed: {', '.join(rejected)}"})
+        
+        admitted, ticket, position = admission.admit('upload', request.form.get('ticket'))
+        if not admitted:
+            return busy_response(ticket, position)
+        
         task_id = str(uuid.uuid4())
+        if job_store and output_folder not in active_stream_splits:
+            # Parts still being segmented from a live upload stay here; everything else goes to a worker
+            try:
+                job_store.enqueue('upload', task_id, {
+                    'filename': filename,
+                    'folder_name': folder_name,
+                    'destinations': destinations,
+                    'session_id': session.get('session_id')
+                }, job_id=task_id)
+            finally:
+                # Workers pace their own uploads; the slot only covered handing the job over
+                admission.release_upload()
+            return jsonify({'success': True, 'task_id': task_id})
+        
         upload_status[task_id] = {
             "stage": "Queued",
             "progress": 0,
@@ -477,7 +3671,13 @@ def upload_to_telegram():
             "error": None
         }
         
-        Thread(target=background_upload, args=(task_id, output_folder, filename)).start()
+        if g.get('profiler'):
+            # A profiled request also profiles the upload it starts
+            profiles.arm(task_id)
+        Thread(
+            target=admission.run_upload,
+            args=(background_upload, task_id, output_folder, filename, destinations, session.get('session_id'))
+        ).start()
         
         return jsonify({'success': True, 'task_id': task_id})
     
@@ -485,10 +3685,153 @@ def upload_to_telegram():
         logger.exception("Error during Telegram upload initiation")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/restore', methods=['POST'])
+def restore():
+    """Start rebuilding a file from the parts background_upload sent to Telegram"""
+    try:
+        filename = secure_filename(request.form.get('filename', '').strip())
+        if not filename:
+            return jsonify({'success': False, 'error': 'No filename given'})
+        mode = request.form.get('mode') or None
+        if mode not in (None, 'concat', 'raw'):
+            return jsonify({'success': False, 'error': 'Invalid restore mode'})
+        
+        task_id = str(uuid.uuid4())
+        restore_status[task_id] = {
+            "stage": "Queued",
+            "progress": 0,
+            "done": False,
+            "error": None,
+            "filename": filename
+        }
+        destination = request.form.get('destination', '').strip() or None
+        if destination and disallowed_destinations([destination]):
+            return jsonify({'success': False, 'error': f"Destination not allowed: {destination}"})
+        Thread(target=restore_from_telegram, args=(task_id, filename, destination, mode)).start()
+        
+        return jsonify({'success': True, 'task_id': task_id})
+    
+    except Exception as e:
+        logger.exception("Error during restore initiation")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/restore_status/<task_id>')
+def get_restore_status(task_id):
+    return jsonify(restore_status.get(task_id, {
+        "error": "Task ID not found",
+        "stage": "Unknown",
+        "progress": 0,
+        "done": False
+    }))
+
+@app.route('/restore/<task_id>/download')
+def download_restored(task_id):
+    status = restore_status.get(task_id)
+    if not status or not status.get('done'):
+        return jsonify({'success': False, 'error': 'Restore not finished'})
+    file_path = os.path.join(app.config['BASE_SPLIT_FOLDER'], RESTORE_DIR, task_id, status['filename'])
+    if not os.path.exists(file_path):
+        return jsonify({'success': False, 'error': 'Restored file has expired'})
+    
+    if app.config['DOWNLOAD_OFFLOAD']:
+        return offload_response(file_path, status['filename'])
+    # send_file streams from disk and answers range requests, so large restores can resume
+    return send_file(file_path, as_attachment=True, conditional=True)
+
+@app.route('/thumbnail/<folder_name>/<filename>')
+def thumbnail(folder_name, filename):
+    thumbs_dir = os.path.join(app.config['BASE_SPLIT_FOLDER'], folder_name, THUMBNAIL_DIR)
+    return send_from_directory(thumbs_dir, filename, mimetype='image/jpeg', max_age=3600)
+
+@app.route('/accounts')
+def accounts():
+    """Per-account load, cooldown and throughput"""
+    return jsonify({
+        'destination': telegram_destination,
+        'max_part_size_mb': account_pool.max_file_size_mb(),
+        'accounts': account_pool.stats()
+    })
+
+def is_admin_request():
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and secrets.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+@app.route('/admin/limits', methods=['GET', 'POST'])
+def admin_limits():
+    """Show or change upload rate limits (server-wide, per session, for one session) and split concurrency"""
+    if not is_admin_request():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        try:
+            def read(key):
+                return None if data.get(key) in (None, '') else max(0, int(data[key]))
+            upload_throttle.set_limits(read('upload_rate_limit'), read('session_upload_rate_limit'))
+            if data.get('session_id'):
+                # An empty session_rate_limit puts the session back on the default rate
+                upload_throttle.set_session_limit(data['session_id'], read('session_rate_limit'))
+            if read('split_concurrency'):
+                split_scheduler.set_slots(read('split_concurrency'))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Limits must be integers'}), 400
+    
+    return jsonify({
+        'success': True, **upload_throttle.limits(), **split_scheduler.stats(), 'load': admission.stats(),
+        'deletions': deletion_queue.stats(), 'job_store': job_store.stats() if job_store else None
+    })
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_arm_profile():
+    """Profile the next run of a job: a filename for /process, a folder name or task id for uploads"""
+    if not is_admin_request():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    data = request.get_json(silent=True) or request.form
+    job_id = (data.get('job_id') or '').strip()
+    if not job_id:
+        return jsonify({'success': False, 'error': 'No job_id given'}), 400
+    profiles.arm(job_id)
+    return jsonify({'success': True, 'armed': job_id})
+
+@app.route('/admin/profile/<job_id>')
+def admin_job_profile(job_id):
+    """Per-stage wall/CPU times of a recent job and the profiles saved for it"""
+    if not is_admin_request():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    timer = job_timers.get(job_id)
+    return jsonify({
+        'success': True,
+        'timing': timer.report() if timer else None,
+        'profiles': [url_for('admin_profile_file', name=name) for name in profiles.files(job_id)],
+        'profile_scope': PROFILE_SCOPE_NOTE
+    })
+
+@app.route('/admin/profiles/<name>')
+def admin_profile_file(name):
+    if not is_admin_request():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    return send_from_directory(app.config['PROFILE_DIR'], name, as_attachment=True)
+
 @app.route('/download/zip/<folder_name>')
 def download_zip(folder_name):
     try:
         folder_path = os.path.join(app.config['BASE_SPLIT_FOLDER'], folder_name)
+        
+        if app.config['DOWNLOAD_OFFLOAD']:
+            zip_path = os.path.join(app.config['BASE_SPLIT_FOLDER'], f'{folder_name}.zip')
+            # The first request builds the ZIP and removes the parts; the rest wait and reuse it
+            with exclusive_build(zip_path):
+                if not os.path.exists(zip_path):
+                    if not os.path.exists(folder_path):
+                        return jsonify({'success': False, 'error': 'Folder not found'})
+                    create_zip_on_disk(folder_path, zip_path)
+                    # The proxy streams the ZIP, so only the parts can go right away
+                    cleanup_folder(folder_path)
+                    untrack_split_folder(folder_path)
+                # The lock file is left for cleanup_old_files; removing it here could split the lock
+                schedule_cleanup(zip_path)
+            return offload_response(zip_path, f'{folder_name}.zip', mimetype='application/zip')
+        
         if not os.path.exists(folder_path):
             return jsonify({'success': False, 'error': 'Folder not found'})
         
@@ -501,15 +3844,13 @@ def download_zip(folder_name):
         )
         
         # Clean up after download
+        session_id = session.get('session_id')
+        
         @response.call_on_close
         def cleanup():
             cleanup_folder(folder_path)
             # Remove from session tracking
-            session_id = session.get('session_id')
-            if session_id:
-                session_data = ensure_session_files(session_id)
-                if folder_path in session_data['splits']:
-                    session_data['splits'].remove(folder_path)
+            untrack_split_folder(folder_path, session_id)
         
         return response
     except Exception as e:
@@ -528,9 +3869,16 @@ def download_separate(folder_name, filename):
             return jsonify({'success': False, 'error': 'File not found'})
         
         # Check if this is the last file to be downloaded
-        files_in_folder = os.listdir(folder_path)
+        files_in_folder = [os.path.basename(path) for path in list_part_files(folder_path)]
         is_last_file = len(files_in_folder) == 1 and files_in_folder[0] == filename
         
+        if app.config['DOWNLOAD_OFFLOAD']:
+            # No close hook fires when the proxy sends the bytes, so expire the folder instead
+            if is_last_file:
+                schedule_cleanup(folder_path)
+                untrack_split_folder(folder_path)
+            return offload_response(file_path, filename)
+        
         response = send_file(
             file_path,
             as_attachment=True
@@ -538,15 +3886,13 @@ def download_separate(folder_name, filename):
         
         # Clean up if this is the last file
         if is_last_file:
+            session_id = session.get('session_id')
+            
             @response.call_on_close
             def cleanup():
                 cleanup_folder(folder_path)
                 # Remove from session tracking
-                session_id = session.get('session_id')
-                if session_id:
-                    session_data = ensure_session_files(session_id)
-                    if folder_path in session_data['splits']:
-                        session_data['splits'].remove(folder_path)
+                untrack_split_folder(folder_path, session_id)
         
         return response
     except Exception as e:
@@ -556,28 +3902,26 @@ def download_separate(folder_name, filename):
 def cleanup_session_files():
     """Clean up files associated with the current session"""
     session_id = session.get('session_id')
-    if not session_id or session_id not in session_files:
+    if not session_id:
         return
     
-    session_data = session_files[session_id]
-    
     # Clean up uploads
-    for file_path in session_data['uploads'][:]:
+    for file_path in session_store.paths(session_id, 'uploads'):
         try:
             if os.path.exists(file_path):
-                os.remove(file_path)
+                remove_path(file_path)
                 logger.info(f"Cleaned session upload: {file_path}")
-            session_data['uploads'].remove(file_path)
+            session_store.remove(session_id, 'uploads', file_path)
         except Exception as e:
             logger.error(f"Error cleaning session upload: {e}")
     
     # Clean up split folders
-    for folder_path in session_data['splits'][:]:
+    for folder_path in session_store.paths(session_id, 'splits'):
         try:
             if os.path.exists(folder_path):
                 cleanup_folder(folder_path)
                 logger.info(f"Cleaned session split folder: {folder_path}")
-            session_data['splits'].remove(folder_path)
+            session_store.remove(session_id, 'splits', folder_path)
         except Exception as e:
             logger.error(f"Error cleaning session split folder: {e}")
 
@@ -587,675 +3931,8 @@ def cleanup():
     cleanup_session_files()
     return jsonify({'success': True, 'message': 'Session files cleaned'})
 
-# Create templates directory if not exists
-templates_dir = Path("templates")
-templates_dir.mkdir(exist_ok=True)
-
-# Write HTML template to file
-with open(templates_dir / "index.html", "w") as f:
-    f.write("""<!doctype html>
-<html>
-<head>
-    <title>Video Splitter & Telegram Uploader</title>
-    <style>
-        :root {
-            --primary-color: #6c5ce7;
-            --secondary-color: #a29bfe;
-            --success-color: #00b894;
-            --error-color: #d63031;
-            --info-color: #0984e3;
-            --warning-color: #fdcb6e;
-            --text-color: #2d3436;
-            --light-bg: #f5f6fa;
-            --card-shadow: 0 10px 20px rgba(0,0,0,0.1);
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            margin: 0;
-            padding: 0;
-            background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-            color: var(--text-color);
-            min-height: 100vh;
-        }
-        
-        .container {
-            max-width: 900px;
-            margin: 0 auto;
-            padding: 30px;
-            animation: fadeIn 0.5s ease-in-out;
-        }
-        
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        
-        h2 {
-            text-align: center;
-            color: var(--primary-color);
-            margin-bottom: 30px;
-            font-size: 2.5rem;
-            position: relative;
-            display: inline-block;
-            width: 100%;
-        }
-        
-        h2::after {
-            content: '';
-            position: absolute;
-            bottom: -10px;
-            left: 50%;
-            transform: translateX(-50%);
-            width: 100px;
-            height: 4px;
-            background: var(--primary-color);
-            border-radius: 2px;
-        }
-        
-        .card {
-            background: white;
-            border-radius: 15px;
-            padding: 30px;
-            box-shadow: var(--card-shadow);
-            margin-bottom: 30px;
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-        }
-        
-        .card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 15px 30px rgba(0,0,0,0.15);
-        }
-        
-        .upload-area {
-            border: 3px dashed var(--secondary-color);
-            border-radius: 10px;
-            padding: 30px;
-            text-align: center;
-            margin-bottom: 20px;
-            transition: all 0.3s ease;
-            background: rgba(162, 155, 254, 0.05);
-        }
-        
-        .upload-area:hover {
-            border-color: var(--primary-color);
-            background: rgba(108, 92, 231, 0.05);
-        }
-        
-        .file-input-wrapper {
-            position: relative;
-            overflow: hidden;
-            display: inline-block;
-            margin-bottom: 20px;
-        }
-        
-        .btn {
-            padding: 12px 25px;
-            background: var(--primary-color);
-            color: white;
-            border: none;
-            border-radius: 50px;
-            cursor: pointer;
-            font-size: 16px;
-            font-weight: 600;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 6px rgba(108, 92, 231, 0.2);
-            text-transform: uppercase;
-            letter-spacing: 1px;
-            display: inline-block;
-        }
-        
-        .btn:hover {
-            background: #5649c4;
-            transform: translateY(-2px);
-            box-shadow: 0 6px 12px rgba(108, 92, 231, 0.3);
-        }
-        
-        .btn:active {
-            transform: translateY(0);
-        }
-        
-        .btn-telegram {
-            background: #0088cc;
-            box-shadow: 0 4px 6px rgba(0, 136, 204, 0.2);
-        }
-        
-        .btn-telegram:hover {
-            background: #0077b3;
-            box-shadow: 0 6px 12px rgba(0, 136, 204, 0.3);
-        }
-        
-        .btn-download {
-            background: var(--success-color);
-            box-shadow: 0 4px 6px rgba(0, 184, 148, 0.2);
-        }
-        
-        .btn-download:hover {
-            background: #00a383;
-            box-shadow: 0 6px 12px rgba(0, 184, 148, 0.3);
-        }
-        
-        .btn-delete {
-            background: var(--error-color);
-            box-shadow: 0 4px 6px rgba(214, 48, 49, 0.2);
-        }
-        
-        .btn-delete:hover {
-            background: #c0392b;
-            box-shadow: 0 6px 12px rgba(214, 48, 49, 0.3);
-        }
-        
-        .progress-container {
-            margin: 25px 0;
-            animation: fadeIn 0.5s ease-in-out;
-        }
-        
-        .progress-label {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 8px;
-            font-weight: 600;
-            color: var(--primary-color);
-        }
-        
-        .progress-bar {
-            height: 20px;
-            background: #e0e0e0;
-            border-radius: 10px;
-            margin-bottom: 15px;
-            overflow: hidden;
-            position: relative;
-        }
-        
-        .progress {
-            height: 100%;
-            background: linear-gradient(90deg, var(--primary-color), var(--secondary-color));
-            width: 0%;
-            color: white;
-            text-align: center;
-            line-height: 20px;
-            font-size: 12px;
-            font-weight: bold;
-            transition: width 0.5s ease, background-color 0.3s ease;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        .progress::after {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: linear-gradient(
-                90deg,
-                rgba(255, 255, 255, 0) 0%,
-                rgba(255, 255, 255, 0.3) 50%,
-                rgba(255, 255, 255, 0) 100%
-            );
-            animation: shimmer 2s infinite;
-        }
-        
-        @keyframes shimmer {
-            0% { transform: translateX(-100%); }
-            100% { transform: translateX(100%); }
-        }
-        
-        .speed-info {
-            font-size: 14px;
-            color: #666;
-            text-align: right;
-            margin-top: -10px;
-            margin-bottom: 15px;
-        }
-        
-        .stage-info {
-            font-size: 14px;
-            margin-bottom: 5px;
-            color: var(--info-color);
-            font-weight: 600;
-        }
-        
-        .action-buttons {
-            margin-top: 30px;
-            display: flex;
-            gap: 15px;
-            flex-wrap: wrap;
-            justify-content: center;
-        }
-        
-        .file-list {
-            max-height: 250px;
-            overflow-y: auto;
-            border: 2px solid #eee;
-            border-radius: 10px;
-            padding: 15px;
-            margin: 20px 0;
-            background: white;
-        }
-        
-        .file-list p {
-            font-weight: 600;
-            color: var(--primary-color);
-            margin-top: 0;
-        }
-        
-        .file-list ul {
-            list-style-type: none;
-            padding: 0;
-            margin: 0;
-        }
-        
-        .file-list li {
-            padding: 8px 15px;
-            margin: 5px 0;
-            background: rgba(162, 155, 254, 0.1);
-            border-left: 4px solid var(--secondary-color);
-            border-radius: 4px;
-            transition: all 0.3s ease;
-        }
-        
-        .file-list li:hover {
-            background: rgba(162, 155, 254, 0.2);
-            transform: translateX(5px);
-        }
-        
-        .status-message {
-            padding: 15px;
-            border-radius: 8px;
-            margin: 15px 0;
-            font-weight: 600;
-            text-align: center;
-            animation: fadeIn 0.5s ease-in-out;
-        }
-        
-        .status-success {
-            background: rgba(0, 184, 148, 0.1);
-            border: 1px solid var(--success-color);
-            color: var(--success-color);
-        }
-        
-        .status-error {
-            background: rgba(214, 48, 49, 0.1);
-            border: 1px solid var(--error-color);
-            color: var(--error-color);
-        }
-        
-        .status-info {
-            background: rgba(9, 132, 227, 0.1);
-            border: 1px solid var(--info-color);
-            color: var(--info-color);
-        }
-        
-        .pulse {
-            animation: pulse 1.5s infinite;
-        }
-        
-        @keyframes pulse {
-            0% { opacity: 1; }
-            50% { opacity: 0.6; }
-            100% { opacity: 1; }
-        }
-        
-        /* Responsive adjustments */
-        @media (max-width: 768px) {
-            .container {
-                padding: 20px;
-            }
-            
-            .action-buttons {
-                flex-direction: column;
-                gap: 10px;
-            }
-            
-            .btn {
-                width: 100%;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="card">
-            <h2>Video Splitter & Telegram Uploader</h2>
-
-            <div class="upload-area">
-                <form id="uploadForm" enctype="multipart/form-data">
-                    <div class="file-input-wrapper">
-                        <input type="file" name="file" id="fileInput" accept="video/*" required style="display: none;">
-                        <label for="fileInput" class="btn">Choose Video File</label>
-                    </div>
-                    <p id="fileName" style="margin-top: 10px; color: #666; font-style: italic;">No file selected</p>
-                    <input type="submit" value="Upload & Process" class="btn" id="uploadBtn">
-                </form>
-            </div>
-
-            <p style="text-align: center; color: #666;">Max file size: 100GB | Allowed formats: mp4, avi, mov, mkv, webm</p>
-        </div>
-
-        <div id="progressSection" style="display:none;">
-            <div class="card">
-                <h3 style="color: var(--primary-color); margin-top: 0;">Processing Progress</h3>
-                
-                <div class="progress-container">
-                    <div class="progress-label">
-                        <span>Upload Progress</span>
-                        <span id="uploadPercent">0%</span>
-                    </div>
-                    <div class="progress-bar">
-                        <div id="localProgress" class="progress">0%</div>
-                    </div>
-                </div>
-
-                <div class="progress-container">
-                    <div class="progress-label">
-                        <span>Splitting Progress</span>
-                        <span id="splitPercent">0%</span>
-                    </div>
-                    <div class="progress-bar">
-                        <div id="splitProgress" class="progress">0%</div>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <div id="resultSection" style="display:none;">
-            <div class="card">
-                <div class="status-message status-success pulse">
-                    <h3 style="margin: 0;">Video Split Successfully!</h3>
-                </div>
-                
-                <div class="file-list">
-                    <p>Split Files:</p>
-                    <div id="splitFilesList"></div>
-                </div>
-                
-                <div class="action-buttons">
-                    <button id="downloadZipBtn" class="btn btn-download">Download as ZIP</button>
-                    <button id="uploadTelegramBtn" class="btn btn-telegram">Upload to Telegram</button>
-                    <button id="deleteFilesBtn" class="btn btn-delete">Delete Files</button>
-                </div>
-            </div>
-
-            <div id="telegramProgressSection" style="display:none;">
-                <div class="card">
-                    <h3 style="color: var(--primary-color); margin-top: 0;">Telegram Upload Progress</h3>
-                    
-                    <div class="stage-info" id="telegramStageInfo">Stage: Queued</div>
-                    
-                    <div class="progress-container">
-                        <div class="progress-label">
-                            <span>Upload Progress</span>
-                            <span id="telegramPercent">0%</span>
-                        </div>
-                        <div class="progress-bar">
-                            <div id="telegramProgress" class="progress">0%</div>
-                        </div>
-                        <div class="speed-info" id="telegramSpeed">Speed: 0 KB/s</div>
-                    </div>
-                    
-                    <div class="status-message status-info" id="telegramStatus">Upload in progress...</div>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        const form = document.getElementById('uploadForm');
-        const fileInput = document.getElementById('fileInput');
-        const fileNameDisplay = document.getElementById('fileName');
-        const uploadBtn = document.getElementById('uploadBtn');
-        const localProgress = document.getElementById('localProgress');
-        const uploadPercent = document.getElementById('uploadPercent');
-        const splitProgress = document.getElementById('splitProgress');
-        const splitPercent = document.getElementById('splitPercent');
-        const progressSection = document.getElementById('progressSection');
-        const resultSection = document.getElementById('resultSection');
-        const splitFilesList = document.getElementById('splitFilesList');
-        const downloadZipBtn = document.getElementById('downloadZipBtn');
-        const uploadTelegramBtn = document.getElementById('uploadTelegramBtn');
-        const deleteFilesBtn = document.getElementById('deleteFilesBtn');
-        const telegramProgressSection = document.getElementById('telegramProgressSection');
-        const telegramProgress = document.getElementById('telegramProgress');
-        const telegramPercent = document.getElementById('telegramPercent');
-        const telegramSpeed = document.getElementById('telegramSpeed');
-        const telegramStageInfo = document.getElementById('telegramStageInfo');
-        const telegramStatus = document.getElementById('telegramStatus');
-
-        let currentFilename = '';
-        let currentFolder = '';
-        let splitFiles = [];
-
-        // Update file name display when file is selected
-        fileInput.addEventListener('change', function() {
-            if (this.files.length > 0) {
-                fileNameDisplay.textContent = this.files[0].name;
-                fileNameDisplay.style.color = 'var(--primary-color)';
-                fileNameDisplay.style.fontStyle = 'normal';
-            } else {
-                fileNameDisplay.textContent = 'No file selected';
-                fileNameDisplay.style.color = '#666';
-                fileNameDisplay.style.fontStyle = 'italic';
-            }
-        });
-
-        form.addEventListener('submit', function (e) {
-            e.preventDefault();
-            
-            const file = fileInput.files[0];
-            if (!file) {
-                alert('Please select a file first');
-                return;
-            }
-            
-            currentFilename = file.name;
-            progressSection.style.display = 'block';
-            uploadBtn.disabled = true;
-            uploadBtn.textContent = 'Uploading...';
-            
-            const formData = new FormData();
-            formData.append('file', file);
-
-            const xhr = new XMLHttpRequest();
-
-            xhr.upload.onprogress = function (e) {
-                if (e.lengthComputable) {
-                    const percent = Math.round((e.loaded / e.total) * 100);
-                    localProgress.style.width = percent + '%';
-                    localProgress.textContent = percent + '%';
-                    uploadPercent.textContent = percent + '%';
-                }
-            };
-
-            xhr.onreadystatechange = function() {
-                if (xhr.readyState === XMLHttpRequest.DONE) {
-                    uploadBtn.disabled = false;
-                    uploadBtn.textContent = 'Upload & Process';
-                    
-                    if (xhr.status === 200) {
-                        const response = JSON.parse(xhr.responseText);
-                        if (response.success) {
-                            currentFilename = response.filename;
-                            startProcessing(response.filename);
-                        } else {
-                            alert('Upload failed: ' + response.error);
-                            progressSection.style.display = 'none';
-                        }
-                    } else {
-                        alert('Upload failed: ' + xhr.statusText);
-                        progressSection.style.display = 'none';
-                    }
-                }
-            };
-
-            xhr.open('POST', '/upload', true);
-            xhr.send(formData);
-        });
-
-        function startProcessing(filename) {
-            const xhr = new XMLHttpRequest();
-            xhr.open('POST', '/process');
-            xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
-            
-            xhr.onload = function() {
-                if (xhr.status === 200) {
-                    const response = JSON.parse(xhr.responseText);
-                    if (response.success) {
-                        currentFolder = response.folder_name;
-                        splitFiles = response.split_files;
-                        showResults(response.split_files);
-                    } else {
-                        alert('Processing failed: ' + response.error);
-                    }
-                } else {
-                    alert('Processing failed: ' + xhr.statusText);
-                }
-            };
-            
-            xhr.send(`filename=${encodeURIComponent(filename)}`);
-            
-            // Start polling progress
-            const progressInterval = setInterval(() => {
-                fetch(`/progress/${filename}`)
-                    .then(res => res.json())
-                    .then(data => {
-                        const progress = Math.round(data.progress);
-                        splitProgress.style.width = progress + '%';
-                        splitProgress.textContent = progress + '%';
-                        splitPercent.textContent = progress + '%';
-                        
-                        if (progress >= 100) {
-                            clearInterval(progressInterval);
-                        }
-                    })
-                    .catch(error => {
-                        console.error('Progress polling error:', error);
-                        clearInterval(progressInterval);
-                    });
-            }, 1000);
-        }
-
-        function showResults(files) {
-            resultSection.style.display = 'block';
-            splitFilesList.innerHTML = '<ul>' + 
-                files.map(file => `<li>${file}</li>`).join('') + '</ul>';
-        }
-
-        downloadZipBtn.addEventListener('click', function() {
-            window.location.href = `/download/zip/${currentFolder}`;
-        });
-
-        uploadTelegramBtn.addEventListener('click', function() {
-            if (!confirm('This will upload ALL split parts to your Telegram Saved Messages. Continue?')) {
-                return;
-            }
-            
-            const xhr = new XMLHttpRequest();
-            xhr.open('POST', '/upload_to_telegram');
-            xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
-            
-            xhr.onload = function() {
-                if (xhr.status === 200) {
-                    const response = JSON.parse(xhr.responseText);
-                    if (response.success) {
-                        telegramProgressSection.style.display = 'block';
-                        telegramStatus.textContent = 'Upload started...';
-                        telegramStatus.className = 'status-message status-info pulse';
-                        pollTelegramProgress(response.task_id);
-                    } else {
-                        alert('Telegram upload failed to start: ' + response.error);
-                    }
-                } else {
-                    alert('Telegram upload failed to start: ' + xhr.statusText);
-                }
-            };
-            
-            xhr.send(`filename=${encodeURIComponent(currentFilename)}&folder_name=${encodeURIComponent(currentFolder)}`);
-        });
-
-        deleteFilesBtn.addEventListener('click', function() {
-            if (!confirm('Are you sure you want to delete all split files? This cannot be undone.')) {
-                return;
-            }
-            
-            fetch('/cleanup', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                }
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    resultSection.style.display = 'none';
-                    progressSection.style.display = 'none';
-                    alert('Files deleted successfully!');
-                } else {
-                    alert('Error deleting files');
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Error deleting files');
-            });
-        });
-
-        function pollTelegramProgress(taskId) {
-            const interval = setInterval(() => {
-                fetch(`/upload_status/${taskId}`)
-                    .then(res => res.json())
-                    .then(data => {
-                        if (data.error && data.error !== "Task ID not found") {
-                            clearInterval(interval);
-                            telegramStageInfo.textContent = `Stage: Error`;
-                            telegramStatus.textContent = `Error: ${data.error}`;
-                            telegramStatus.className = 'status-message status-error';
-                            return;
-                        }
-                        
-                        const progress = Math.round(data.progress || 0);
-                        
-                        telegramStageInfo.textContent = `Stage: ${data.stage || 'Processing'}`;
-                        telegramProgress.style.width = progress + '%';
-                        telegramProgress.textContent = progress + '%';
-                        telegramPercent.textContent = progress + '%';
-                        telegramSpeed.textContent = `Speed: ${data.speed || 0} KB/s`;
-                        
-                        if (data.done) {
-                            clearInterval(interval);
-                            telegramStatus.textContent = 'Upload completed successfully!';
-                            telegramStatus.className = 'status-message status-success';
-                            telegramSpeed.textContent = 'Upload complete!';
-                        } else if (data.error) {
-                            clearInterval(interval);
-                            telegramStatus.textContent = `Error: ${data.error}`;
-                            telegramStatus.className = 'status-message status-error';
-                        }
-                    })
-                    .catch(error => {
-                        console.error('Telegram polling error:', error);
-                        clearInterval(interval);
-                        telegramStageInfo.textContent = 'Stage: Connection error';
-                        telegramStatus.textContent = 'Error: Connection to server failed';
-                        telegramStatus.className = 'status-message status-error';
-                    });
-            }, 1000);
-        }
-
-        // Clean up files when page is refreshed or closed
-        window.addEventListener('beforeunload', function() {
-            fetch('/cleanup', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                keepalive: true
-            });
-        });
-    </script>
-</body>
-</html>""")
+IMPORT_TIME_MS = (time.perf_counter() - _import_started) * 1000
+logger.info(f"App module loaded in {IMPORT_TIME_MS:.1f} ms")
 
 if __name__ == '__main__':
     # Ensure directories are writable
@@ -0,0 +1,147 @@
+"""Split and upload whole directories without the web interface.
+
+Usage: python batch.py <dir or glob> [...] [--jobs 4] [--split-workers 2] [--upload-workers 1]
+
+Files already listed in the manifest (same size and mtime) are skipped, so the
+same command can be re-run nightly over a growing backlog.
+"""
+import os
+import sys
+import glob
+import time
+import hashlib
+import uuid
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import (
+    app, allowed_file, split_video_with_ffmpeg, generate_thumbnails,
+    background_upload, upload_status, ProcessedIndex, cleanup_folder, deletion_queue
+)
+
+logger = logging.getLogger('batch')
+
+
+def get_output_folder(output_root, input_path):
+    """Split folder for one source; the directory hash keeps same-named files from sharing one"""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    directory_hash = hashlib.sha1(os.fsencode(os.path.dirname(os.path.abspath(input_path)))).hexdigest()[:8]
+    return os.path.join(output_root, f"{name}-{directory_hash}")
+
+
+def collect_inputs(patterns):
+    """Expand directories and globs into a sorted list of video files"""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        for path in candidates:
+            if os.path.isfile(path) and allowed_file(os.path.basename(path)):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+class BatchRunner:
+    """Runs files through split and upload with separate concurrency limits"""
+    def __init__(self, args):
+        self.args = args
+        self.split_slots = threading.Semaphore(args.split_workers)
+        self.upload_slots = threading.Semaphore(args.upload_workers)
+        self.index = ProcessedIndex(args.manifest)
+        self.lock = threading.Lock()
+        self.stats = {'processed': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'parts': 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def process(self, input_path):
+        filename = os.path.basename(input_path)
+        if self.index.is_processed(input_path):
+            logger.info(f"Skipping {filename}: already processed")
+            self.count('skipped')
+            return
+
+        output_folder = get_output_folder(self.args.output, input_path)
+        os.makedirs(output_folder, exist_ok=True)
+
+        with self.split_slots:
+            logger.info(f"Splitting {filename}")
+            part_files = split_video_with_ffmpeg(input_path, output_folder, self.args.part_size_mb)
+            if part_files is None:
+                logger.error(f"Failed to split {filename}")
+                self.count('failed')
+                return
+            if app.config['GENERATE_THUMBNAILS']:
+                generate_thumbnails(output_folder, part_files)
+
+        if not self.args.no_upload:
+            with self.upload_slots:
+                logger.info(f"Uploading {len(part_files)} parts of {filename}")
+                task_id = str(uuid.uuid4())
+                background_upload(task_id, output_folder, filename)
+                status = upload_status.pop(task_id, {})
+                if not status.get('done'):
+                    logger.error(f"Failed to upload {filename}: {status.get('error')}")
+                    self.count('failed')
+                    return
+
+        self.index.mark(input_path, parts=part_files, uploaded=not self.args.no_upload)
+        if not self.args.no_upload and not self.args.keep_parts:
+            # The parts are on Telegram now; keeping every split would fill the disk on long runs
+            cleanup_folder(output_folder)
+        self.count('processed')
+        self.count('parts', len(part_files))
+        self.count('bytes', os.path.getsize(input_path))
+
+    def run(self, inputs):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.jobs) as executor:
+            for future in [executor.submit(self.process, path) for path in inputs]:
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("Batch item failed")
+                    self.count('failed')
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='Directories or glob patterns')
+    parser.add_argument('--output', default=app.config['BASE_SPLIT_FOLDER'])
+    parser.add_argument('--manifest', default='batch_manifest.json', help='Processed-file manifest')
+    parser.add_argument('--part-size-mb', type=int, help="Default: the upload accounts' limit (4000 with Premium)")
+    parser.add_argument('--jobs', type=int, default=4, help='Files in flight at once')
+    parser.add_argument('--split-workers', type=int, default=2, help='Concurrent ffmpeg splits')
+    parser.add_argument('--upload-workers', type=int, default=1, help='Concurrent Telegram uploads')
+    parser.add_argument('--no-upload', action='store_true', help='Only split')
+    parser.add_argument('--keep-parts', action='store_true', help='Keep split parts after uploading them')
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        sys.exit("No video files matched")
+
+    runner = BatchRunner(args)
+    elapsed = runner.run(inputs)
+    # Deletions run on a daemon thread; parts of the last files would outlive the process otherwise
+    deletion_queue.drain()
+
+    stats = runner.stats
+    mb = stats['bytes'] / (1024 * 1024)
+    print(f"processed {stats['processed']}, skipped {stats['skipped']}, failed {stats['failed']} "
+          f"of {len(inputs)} files")
+    print(f"{mb:.1f} MB in {stats['parts']} parts, {elapsed:.1f} s, "
+          f"{mb / elapsed if elapsed else 0:.1f} MB/s")
+    if stats['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
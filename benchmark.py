@@ -0,0 +1,87 @@
+"""Measure worker startup and compare split modes on a sample video.
+
+Usage: python benchmark.py [video] [--part-size-mb 2000] [--preset medium]
+
+Always reports how long a fresh worker takes to import the app. With a video,
+also reports, for copy and transcode mode, how many parts are produced and how
+many bytes would be uploaded to Telegram per minute of video.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+STARTUP_RUNS = 5
+
+
+def measure_startup():
+    """Import the app in fresh interpreters, returning median process and import times"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    process_times = []
+    import_times = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', 'import app; print(app.IMPORT_TIME_MS)'],
+            cwd=app_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+        )
+        process_times.append((time.perf_counter() - start) * 1000)
+        import_times.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(process_times), statistics.median(import_times)
+
+
+def run_mode(input_path, part_size_mb, preset):
+    """Split input_path once and return part count, bytes and wall time"""
+    from app import split_video_with_ffmpeg
+    output_folder = tempfile.mkdtemp(prefix='split_bench_')
+    try:
+        start = time.perf_counter()
+        part_files = split_video_with_ffmpeg(input_path, output_folder, part_size_mb,
+                                             transcode_preset=preset)
+        elapsed = time.perf_counter() - start
+        if part_files is None:
+            return None
+        total_bytes = sum(os.path.getsize(os.path.join(output_folder, f)) for f in part_files)
+        largest = max(os.path.getsize(os.path.join(output_folder, f)) for f in part_files)
+        return len(part_files), total_bytes, largest, elapsed
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('video', nargs='?')
+    parser.add_argument('--part-size-mb', type=int, default=2000)
+    parser.add_argument('--preset', default='medium')
+    args = parser.parse_args()
+
+    process_ms, import_ms = measure_startup()
+    print(f"startup: {process_ms:.0f} ms per worker process, {import_ms:.0f} ms importing app "
+          f"(median of {STARTUP_RUNS})")
+    if not args.video:
+        return
+
+    from app import get_video_duration
+    duration = get_video_duration(args.video)
+    if not duration:
+        sys.exit(f"Could not read duration of {args.video}")
+    minutes = duration / 60
+
+    print(f"{'mode':<10} {'parts':>5} {'MB total':>10} {'largest MB':>10} {'MB/min':>8} {'seconds':>8}")
+    for mode, preset in (('copy', None), ('transcode', args.preset)):
+        result = run_mode(args.video, args.part_size_mb, preset)
+        if result is None:
+            print(f"{mode:<10} failed")
+            continue
+        parts, total_bytes, largest, elapsed = result
+        mb = 1024 * 1024
+        print(f"{mode:<10} {parts:>5} {total_bytes / mb:>10.1f} {largest / mb:>10.1f} "
+              f"{total_bytes / mb / minutes:>8.2f} {elapsed:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,563 @@
+const form = document.getElementById('uploadForm');
+const fileInput = document.getElementById('fileInput');
+const fileNameDisplay = document.getElementById('fileName');
+const uploadBtn = document.getElementById('uploadBtn');
+const urlForm = document.getElementById('urlForm');
+const urlInput = document.getElementById('urlInput');
+const streamSplit = document.getElementById('streamSplit');
+const urlBtn = document.getElementById('urlBtn');
+const splitMode = document.getElementById('splitMode');
+const encoderPreset = document.getElementById('encoderPreset');
+const overlapSplit = document.getElementById('overlapSplit');
+const partSize = document.getElementById('partSize');
+const passthroughUpload = document.getElementById('passthroughUpload');
+const localProgress = document.getElementById('localProgress');
+const uploadPercent = document.getElementById('uploadPercent');
+const splitProgress = document.getElementById('splitProgress');
+const splitPercent = document.getElementById('splitPercent');
+const queueInfo = document.getElementById('queueInfo');
+const progressSection = document.getElementById('progressSection');
+const resultSection = document.getElementById('resultSection');
+const splitFilesList = document.getElementById('splitFilesList');
+const downloadZipBtn = document.getElementById('downloadZipBtn');
+const uploadTelegramBtn = document.getElementById('uploadTelegramBtn');
+const deleteFilesBtn = document.getElementById('deleteFilesBtn');
+const telegramDestinations = document.getElementById('telegramDestinations');
+const telegramProgressSection = document.getElementById('telegramProgressSection');
+const telegramProgress = document.getElementById('telegramProgress');
+const telegramPercent = document.getElementById('telegramPercent');
+const telegramSpeed = document.getElementById('telegramSpeed');
+const telegramStageInfo = document.getElementById('telegramStageInfo');
+const telegramStatus = document.getElementById('telegramStatus');
+const restoreForm = document.getElementById('restoreForm');
+const restoreFilename = document.getElementById('restoreFilename');
+const restoreDestination = document.getElementById('restoreDestination');
+const restoreBtn = document.getElementById('restoreBtn');
+
+let currentFilename = '';
+let currentFolder = '';
+let splitFiles = [];
+let splitPoll = null;
+
+// Update file name display when file is selected
+fileInput.addEventListener('change', function() {
+    if (this.files.length > 0) {
+        fileNameDisplay.textContent = this.files[0].name;
+        fileNameDisplay.style.color = 'var(--primary-color)';
+        fileNameDisplay.style.fontStyle = 'normal';
+    } else {
+        fileNameDisplay.textContent = 'No file selected';
+        fileNameDisplay.style.color = '#666';
+        fileNameDisplay.style.fontStyle = 'italic';
+    }
+});
+
+splitMode.addEventListener('change', function() {
+    encoderPreset.disabled = this.value !== 'transcode';
+});
+
+form.addEventListener('submit', function (e) {
+    e.preventDefault();
+    
+    const file = fileInput.files[0];
+    if (!file) {
+        alert('Please select a file first');
+        return;
+    }
+    
+    currentFilename = file.name;
+    progressSection.style.display = 'block';
+    uploadBtn.disabled = true;
+    uploadBtn.textContent = 'Uploading...';
+    
+    if (passthroughUpload.checked) {
+        startPassthrough(file, Date.now().toString(36) + Math.random().toString(36).slice(2));
+        return;
+    }
+    
+    // MKV/WebM and fast-start MP4 can be split while the upload is still arriving
+    const streaming = overlapSplit.checked && splitMode.value === 'copy';
+    const uploadId = Date.now().toString(36) + Math.random().toString(36).slice(2);
+    let streamPoll = null;
+
+    const xhr = new XMLHttpRequest();
+
+    xhr.upload.onprogress = function (e) {
+        if (e.lengthComputable) {
+            const percent = Math.round((e.loaded / e.total) * 100);
+            localProgress.style.width = percent + '%';
+            localProgress.textContent = percent + '%';
+            uploadPercent.textContent = percent + '%';
+        }
+    };
+
+    xhr.onreadystatechange = function() {
+        if (xhr.readyState === XMLHttpRequest.DONE) {
+            uploadBtn.disabled = false;
+            uploadBtn.textContent = 'Upload & Process';
+            // The stream split is over either way; a fallback save gets its own poller in startProcessing
+            clearInterval(streamPoll);
+            
+            if (xhr.status === 200) {
+                const response = JSON.parse(xhr.responseText);
+                if (response.success && response.streamed) {
+                    splitProgress.style.width = '100%';
+                    splitProgress.textContent = '100%';
+                    splitPercent.textContent = '100%';
+                    currentFilename = response.filename;
+                    currentFolder = response.folder_name;
+                    splitFiles = response.split_files;
+                    showResults(response.split_files, response.thumbnails || {});
+                } else if (response.success) {
+                    currentFilename = response.filename;
+                    startProcessing(response.filename);
+                } else {
+                    alert('Upload failed: ' + response.error);
+                    progressSection.style.display = 'none';
+                }
+            } else {
+                alert('Upload failed: ' + xhr.statusText);
+                progressSection.style.display = 'none';
+            }
+        }
+    };
+
+    if (streaming) {
+        xhr.open('POST', '/upload_stream', true);
+        xhr.setRequestHeader('X-Filename', encodeURIComponent(file.name));
+        xhr.setRequestHeader('X-Upload-Id', uploadId);
+        xhr.setRequestHeader('X-Part-Size-MB', partSize.value);
+        xhr.send(file);
+        streamPoll = pollSplitProgress(uploadId);
+    } else {
+        const formData = new FormData();
+        formData.append('file', file);
+        xhr.open('POST', '/upload', true);
+        xhr.send(formData);
+    }
+});
+
+// The file goes to Telegram as it is sent; the browser bar tracks what the server took, the Telegram bar what Telegram acked
+function startPassthrough(file, uploadId, ticket) {
+    const xhr = new XMLHttpRequest();
+
+    xhr.upload.onprogress = function (e) {
+        if (e.lengthComputable) {
+            const percent = Math.round((e.loaded / e.total) * 100);
+            localProgress.style.width = percent + '%';
+            localProgress.textContent = percent + '%';
+            uploadPercent.textContent = percent + '%';
+        }
+    };
+
+    xhr.onload = function() {
+        const queued = queuePosition(xhr);
+        if (queued) {
+            queueInfo.style.display = 'block';
+            queueInfo.textContent = `Server busy: you are number ${queued.position} in the queue, retrying in ${queued.retryAfter}s`;
+            setTimeout(() => startPassthrough(file, uploadId, queued.ticket), queued.retryAfter * 1000);
+            return;
+        }
+        queueInfo.style.display = 'none';
+        uploadBtn.disabled = false;
+        uploadBtn.textContent = 'Upload & Process';
+        if (xhr.status === 200) {
+            const response = JSON.parse(xhr.responseText);
+            if (!response.success) {
+                alert('Upload failed: ' + response.error);
+            }
+        } else {
+            alert('Upload failed: ' + xhr.statusText);
+        }
+    };
+
+    xhr.onerror = function() {
+        uploadBtn.disabled = false;
+        uploadBtn.textContent = 'Upload & Process';
+        alert('Upload failed: connection lost');
+    };
+
+    xhr.open('POST', '/passthrough', true);
+    xhr.setRequestHeader('X-Filename', encodeURIComponent(file.name));
+    xhr.setRequestHeader('X-Upload-Id', uploadId);
+    xhr.setRequestHeader('X-Ticket', ticket || '');
+    xhr.setRequestHeader('X-Destinations', telegramDestinations.value.trim());
+    xhr.send(file);
+
+    if (!ticket) {
+        telegramProgressSection.style.display = 'block';
+        telegramStatus.textContent = 'Upload in progress...';
+        telegramStatus.className = 'status-message status-info pulse';
+        pollTelegramProgress(uploadId);
+    }
+}
+
+urlForm.addEventListener('submit', function (e) {
+    e.preventDefault();
+
+    progressSection.style.display = 'block';
+    urlBtn.disabled = true;
+    urlBtn.value = 'Fetching...';
+
+    fetch('/ingest_url', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        },
+        body: `url=${encodeURIComponent(urlInput.value)}&stream=${streamSplit.checked ? 1 : 0}&part_size_mb=${partSize.value}`
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            pollIngestProgress(data.task_id);
+        } else {
+            alert('Fetch failed: ' + data.error);
+            resetUrlForm();
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Fetch failed');
+        resetUrlForm();
+    });
+});
+
+function resetUrlForm() {
+    urlBtn.disabled = false;
+    urlBtn.value = 'Fetch & Process';
+}
+
+function pollIngestProgress(taskId) {
+    const interval = setInterval(() => {
+        fetch(`/ingest_status/${taskId}`)
+            .then(res => res.json())
+            .then(data => {
+                const progress = Math.round(data.progress || 0);
+                localProgress.style.width = progress + '%';
+                localProgress.textContent = progress + '%';
+                uploadPercent.textContent = progress + '%';
+
+                if (data.error) {
+                    clearInterval(interval);
+                    resetUrlForm();
+                    alert('Fetch failed: ' + data.error);
+                    progressSection.style.display = 'none';
+                } else if (data.done) {
+                    clearInterval(interval);
+                    resetUrlForm();
+                    currentFilename = data.filename;
+                    if (data.split_files) {
+                        // Already split while downloading
+                        splitProgress.style.width = '100%';
+                        splitProgress.textContent = '100%';
+                        splitPercent.textContent = '100%';
+                        currentFolder = data.folder_name;
+                        splitFiles = data.split_files;
+                        showResults(data.split_files, data.thumbnails || {});
+                    } else {
+                        startProcessing(data.filename);
+                    }
+                }
+            })
+            .catch(error => {
+                console.error('Ingest polling error:', error);
+                clearInterval(interval);
+                resetUrlForm();
+            });
+    }, 1000);
+}
+
+restoreForm.addEventListener('submit', function (e) {
+    e.preventDefault();
+
+    restoreBtn.disabled = true;
+    restoreBtn.value = 'Finding parts...';
+
+    fetch('/restore', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        },
+        body: `filename=${encodeURIComponent(restoreFilename.value)}&destination=${encodeURIComponent(restoreDestination.value)}`
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            pollRestoreProgress(data.task_id);
+        } else {
+            alert('Restore failed: ' + data.error);
+            resetRestoreForm();
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Restore failed');
+        resetRestoreForm();
+    });
+});
+
+function resetRestoreForm() {
+    restoreBtn.disabled = false;
+    restoreBtn.value = 'Restore & Download';
+}
+
+function pollRestoreProgress(taskId) {
+    const interval = setInterval(() => {
+        fetch(`/restore_status/${taskId}`)
+            .then(res => res.json())
+            .then(data => {
+                if (data.error) {
+                    clearInterval(interval);
+                    resetRestoreForm();
+                    alert('Restore failed: ' + data.error);
+                } else if (data.done) {
+                    clearInterval(interval);
+                    resetRestoreForm();
+                    window.location.href = `/restore/${taskId}/download`;
+                } else {
+                    restoreBtn.value = `${data.stage} (${Math.round(data.progress || 0)}%)`;
+                }
+            })
+            .catch(error => {
+                console.error('Restore polling error:', error);
+                clearInterval(interval);
+                resetRestoreForm();
+            });
+    }, 1000);
+}
+
+// The server answers 503 with a ticket while it is overloaded; retry with it to keep our place
+function queuePosition(xhr) {
+    if (xhr.status !== 503) {
+        return null;
+    }
+    const response = JSON.parse(xhr.responseText);
+    const retryAfter = parseInt(xhr.getResponseHeader('Retry-After'), 10) || response.retry_after || 10;
+    return {ticket: response.ticket, position: response.position, retryAfter: retryAfter};
+}
+
+function startProcessing(filename, ticket) {
+    const xhr = new XMLHttpRequest();
+    xhr.open('POST', '/process');
+    xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+    
+    xhr.onload = function() {
+        const queued = queuePosition(xhr);
+        if (queued) {
+            queueInfo.style.display = 'block';
+            queueInfo.textContent = `Server busy: you are number ${queued.position} in the queue, retrying in ${queued.retryAfter}s`;
+            setTimeout(() => startProcessing(filename, queued.ticket), queued.retryAfter * 1000);
+            return;
+        }
+        queueInfo.style.display = 'none';
+        if (xhr.status === 200 || xhr.status === 202) {
+            const response = JSON.parse(xhr.responseText);
+            if (response.success && response.queued) {
+                // Split on a worker node; progress keeps coming from /progress
+                pollJobStatus(response.job_id);
+            } else if (response.success) {
+                currentFolder = response.folder_name;
+                splitFiles = response.split_files;
+                showResults(response.split_files, response.thumbnails || {});
+            } else {
+                alert('Processing failed: ' + response.error);
+            }
+        } else {
+            alert('Processing failed: ' + xhr.statusText);
+        }
+    };
+    
+    xhr.send(`filename=${encodeURIComponent(filename)}&mode=${splitMode.value}&preset=${encoderPreset.value}&part_size_mb=${partSize.value}&ticket=${ticket || ''}`);
+    
+    // Start polling progress
+    if (!ticket) {
+        splitPoll = pollSplitProgress(filename);
+    }
+}
+
+function pollJobStatus(jobId) {
+    const interval = setInterval(() => {
+        fetch(`/job_status/${jobId}`)
+            .then(res => res.json())
+            .then(data => {
+                if (data.state === 'done') {
+                    clearInterval(interval);
+                    currentFolder = data.folder_name;
+                    splitFiles = data.split_files;
+                    showResults(data.split_files, data.thumbnails || {});
+                } else if (!data.success) {
+                    clearInterval(interval);
+                    clearInterval(splitPoll);
+                    alert('Processing failed: ' + data.error);
+                }
+            })
+            .catch(error => {
+                console.error('Job polling error:', error);
+                clearInterval(interval);
+            });
+    }, 2000);
+}
+
+function pollSplitProgress(key) {
+    const progressInterval = setInterval(() => {
+        fetch(`/progress/${encodeURIComponent(key)}`)
+            .then(res => res.json())
+            .then(data => {
+                const progress = Math.round(data.progress);
+                splitProgress.style.width = progress + '%';
+                splitProgress.textContent = progress + '%';
+                splitPercent.textContent = progress + '%';
+                
+                // Parts finished while the upload is still arriving can be used right away
+                if (data.parts && data.parts.length > 0) {
+                    currentFolder = data.folder_name;
+                    splitFiles = data.parts;
+                    showResults(data.parts, {});
+                }
+                
+                if (progress >= 100) {
+                    clearInterval(progressInterval);
+                }
+            })
+            .catch(error => {
+                console.error('Progress polling error:', error);
+                clearInterval(progressInterval);
+            });
+    }, 1000);
+    return progressInterval;
+}
+
+function showResults(files, thumbnails) {
+    resultSection.style.display = 'block';
+    splitFilesList.innerHTML = '<ul>' + 
+        files.map(file => {
+            const thumb = thumbnails[file] ? `<img src="${thumbnails[file]}" alt="">` : '';
+            return `<li>${thumb}${file}</li>`;
+        }).join('') + '</ul>';
+}
+
+downloadZipBtn.addEventListener('click', function() {
+    window.location.href = `/download/zip/${currentFolder}`;
+});
+
+uploadTelegramBtn.addEventListener('click', function() {
+    const destinations = telegramDestinations.value.trim();
+    const target = destinations ? destinations : 'the default Telegram chat';
+    if (!confirm(`This will upload ALL split parts to ${target}. Continue?`)) {
+        return;
+    }
+    startTelegramUpload(destinations);
+});
+
+function startTelegramUpload(destinations, ticket) {
+    const xhr = new XMLHttpRequest();
+    xhr.open('POST', '/upload_to_telegram');
+    xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+    
+    xhr.onload = function() {
+        const queued = queuePosition(xhr);
+        if (queued) {
+            telegramProgressSection.style.display = 'block';
+            telegramStageInfo.textContent = `Stage: Queued (position ${queued.position})`;
+            telegramStatus.textContent = `Server busy, retrying in ${queued.retryAfter}s...`;
+            telegramStatus.className = 'status-message status-info';
+            setTimeout(() => startTelegramUpload(destinations, queued.ticket), queued.retryAfter * 1000);
+            return;
+        }
+        if (xhr.status === 200) {
+            const response = JSON.parse(xhr.responseText);
+            if (response.success) {
+                telegramProgressSection.style.display = 'block';
+                telegramStatus.textContent = 'Upload started...';
+                telegramStatus.className = 'status-message status-info pulse';
+                pollTelegramProgress(response.task_id);
+            } else {
+                alert('Telegram upload failed to start: ' + response.error);
+            }
+        } else {
+            alert('Telegram upload failed to start: ' + xhr.statusText);
+        }
+    };
+    
+    xhr.send(`filename=${encodeURIComponent(currentFilename)}&folder_name=${encodeURIComponent(currentFolder)}&destinations=${encodeURIComponent(destinations)}&ticket=${ticket || ''}`);
+}
+
+deleteFilesBtn.addEventListener('click', function() {
+    if (!confirm('Are you sure you want to delete all split files? This cannot be undone.')) {
+        return;
+    }
+    
+    fetch('/cleanup', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            resultSection.style.display = 'none';
+            progressSection.style.display = 'none';
+            alert('Files deleted successfully!');
+        } else {
+            alert('Error deleting files');
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Error deleting files');
+    });
+});
+
+function pollTelegramProgress(taskId) {
+    const interval = setInterval(() => {
+        fetch(`/upload_status/${taskId}`)
+            .then(res => res.json())
+            .then(data => {
+                if (data.error && data.error !== "Task ID not found") {
+                    clearInterval(interval);
+                    telegramStageInfo.textContent = `Stage: Error`;
+                    telegramStatus.textContent = `Error: ${data.error}`;
+                    telegramStatus.className = 'status-message status-error';
+                    return;
+                }
+                
+                const progress = Math.round(data.progress || 0);
+                
+                telegramStageInfo.textContent = `Stage: ${data.stage || 'Processing'}`;
+                telegramProgress.style.width = progress + '%';
+                telegramProgress.textContent = progress + '%';
+                telegramPercent.textContent = progress + '%';
+                telegramSpeed.textContent = `Speed: ${data.speed || 0} KB/s`;
+                
+                if (data.done) {
+                    clearInterval(interval);
+                    telegramStatus.textContent = 'Upload completed successfully!';
+                    telegramStatus.className = 'status-message status-success';
+                    telegramSpeed.textContent = 'Upload complete!';
+                } else if (data.error) {
+                    clearInterval(interval);
+                    telegramStatus.textContent = `Error: ${data.error}`;
+                    telegramStatus.className = 'status-message status-error';
+                }
+            })
+            .catch(error => {
+                console.error('Telegram polling error:', error);
+                clearInterval(interval);
+                telegramStageInfo.textContent = 'Stage: Connection error';
+                telegramStatus.textContent = 'Error: Connection to server failed';
+                telegramStatus.className = 'status-message status-error';
+            });
+    }, 1000);
+}
+
+// Clean up files when page is refreshed or closed
+window.addEventListener('beforeunload', function() {
+    fetch('/cleanup', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        keepalive: true
+    });
+});
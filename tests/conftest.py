@@ -0,0 +1,52 @@
+"""Import the app against throwaway folders and databases instead of the working directory"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = tempfile.mkdtemp(prefix='telegram_uploader_tests_')
+
+os.environ.update({
+    'UPLOAD_FOLDER': os.path.join(STATE_DIR, 'uploads'),
+    'BASE_SPLIT_FOLDER': os.path.join(STATE_DIR, 'splits'),
+    'SESSION_STORE_PATH': os.path.join(STATE_DIR, 'session_files.db'),
+    'UPLOAD_LEDGER_PATH': os.path.join(STATE_DIR, 'upload_ledger.db'),
+    'PROFILE_DIR': os.path.join(STATE_DIR, 'profiles'),
+})
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    from app import UploadLedger
+    return UploadLedger(str(tmp_path / 'ledger.db'), ttl=3600)
+
+
+class FakeSender:
+    """Answers SaveFilePart/SaveBigFilePart requests like Telegram, recording what arrived
+
+    fail_on maps a chunk index to an exception raised the first time that chunk is sent.
+    """
+    def __init__(self, fail_on=None, accept=True):
+        self.requests = []
+        self.fail_on = dict(fail_on or {})
+        self.accept = accept
+
+    async def __call__(self, request):
+        await asyncio.sleep(0)  # Let other workers run, as a real network round trip would
+        error = self.fail_on.pop(request.file_part, None)
+        if error:
+            raise error
+        self.requests.append(request)
+        return self.accept
+
+    def parts(self):
+        return sorted(request.file_part for request in self.requests)
+
+
+@pytest.fixture
+def fake_sender():
+    return FakeSender
@@ -0,0 +1,79 @@
+"""ChunkedUploader against a fake sender: ledger resume, changed uploads and FLOOD_WAIT retries"""
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from app import ChunkedUploader, TelegramAccount, retry_flood_wait
+
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def part_file(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(bytes(range(256)) * 20)  # 5 chunks, the last one short
+    return str(path)
+
+
+def test_upload_sends_every_chunk_once(ledger, fake_sender, part_file):
+    senders = [fake_sender(), fake_sender()]
+    uploader = ChunkedUploader(None, ledger, chunk_size=CHUNK_SIZE, senders=senders, window=3)
+
+    uploaded = asyncio.run(uploader.upload(part_file, 'key'))
+
+    assert sorted(senders[0].parts() + senders[1].parts()) == [0, 1, 2, 3, 4]
+    assert senders[0].requests and senders[1].requests
+    assert uploaded.parts == 5
+    data = b''.join(r.bytes for r in sorted(senders[0].requests + senders[1].requests, key=lambda r: r.file_part))
+    with open(part_file, 'rb') as f:
+        assert data == f.read()
+
+
+def test_upload_resumes_from_ledger(ledger, fake_sender, part_file):
+    file_id, acked = ledger.begin('key', 5, CHUNK_SIZE)
+    assert acked == set()
+    ledger.ack('key', 0)
+    ledger.ack('key', 3)
+    sender = fake_sender()
+    progress = []
+
+    uploaded = asyncio.run(ChunkedUploader(None, ledger, chunk_size=CHUNK_SIZE, senders=[sender]).upload(
+        part_file, 'key', lambda sent, total: progress.append((sent, total))
+    ))
+
+    assert sender.parts() == [1, 2, 4]
+    assert {request.file_id for request in sender.requests} == {file_id}
+    assert uploaded.id == file_id
+    assert progress[-1] == (5120, 5120)
+
+
+def test_changed_chunk_count_starts_over(ledger, fake_sender, part_file):
+    old_file_id, _ = ledger.begin('key', 7, CHUNK_SIZE)
+    ledger.ack('key', 0)
+    sender = fake_sender()
+
+    asyncio.run(ChunkedUploader(None, ledger, chunk_size=CHUNK_SIZE, senders=[sender]).upload(part_file, 'key'))
+
+    assert sender.parts() == [0, 1, 2, 3, 4]
+    assert {request.file_id for request in sender.requests} != {old_file_id}
+
+
+def test_rejected_chunk_raises(ledger, fake_sender, part_file):
+    uploader = ChunkedUploader(None, ledger, chunk_size=CHUNK_SIZE, senders=[fake_sender(accept=False)])
+
+    with pytest.raises(IOError, match='rejected chunk'):
+        asyncio.run(uploader.upload(part_file, 'key'))
+
+
+def test_flood_wait_retry_only_resends_unacknowledged_chunks(ledger, fake_sender, part_file):
+    sender = fake_sender(fail_on={2: FloodWaitError(request=None, capture=0)})
+    uploader = ChunkedUploader(None, ledger, chunk_size=CHUNK_SIZE, senders=[sender])
+    account = TelegramAccount('test', None)
+    waits = []
+
+    asyncio.run(retry_flood_wait(account, lambda: uploader.upload(part_file, 'key'), waits.append))
+
+    assert waits == [0]
+    assert account.flood_waits == 1
+    assert sender.parts() == [0, 1, 2, 3, 4]
@@ -0,0 +1,58 @@
+"""DeletionQueue: trash renames, drain() before exit and a fresh worker after fork"""
+import os
+
+import pytest
+
+import app
+from app import DeletionQueue
+
+
+def make_folder(path):
+    os.makedirs(os.path.join(path, 'sub'))
+    for name in ('a.mp4', os.path.join('sub', 'b.jpg')):
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(b'x' * 1000)
+
+
+def test_drain_deletes_folders_outside_the_managed_roots(tmp_path):
+    deletions = DeletionQueue(0)
+    folder = str(tmp_path / 'custom-output' / 'video-1234abcd')
+    make_folder(folder)
+
+    assert deletions.discard(folder)
+    deletions.drain()
+
+    assert not os.path.exists(folder)
+    assert deletions.stats() == {'deleted_bytes': 2000, 'deleted_files': 2, 'pending': 0}
+
+
+def test_discard_moves_managed_paths_to_trash_first():
+    deletions = DeletionQueue(0)
+    folder = os.path.join(app.app.config['BASE_SPLIT_FOLDER'], 'video-trash-test')
+    make_folder(folder)
+
+    deletions.discard(folder)
+    assert not os.path.exists(folder)
+    deletions.drain()
+
+    trash_dir = os.path.join(app.app.config['BASE_SPLIT_FOLDER'], app.TRASH_DIR)
+    assert not [name for name in os.listdir(trash_dir) if name.endswith('-video-trash-test')]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_child_starts_its_own_worker(tmp_path):
+    deletions = DeletionQueue(0)
+    deletions.ensure_worker()
+    folder = str(tmp_path / 'from-child')
+    make_folder(folder)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            deletions.discard(folder)
+            deletions.drain()
+        finally:
+            os._exit(0 if not os.path.exists(folder) else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.WEXITSTATUS(status) == 0
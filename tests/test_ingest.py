@@ -0,0 +1,272 @@
+"""URL ingest against a local http.server, with and without range support, and its address checks"""
+import hashlib
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+from app import check_ingest_url, fetch_url_to_file, ingest_status, ingest_url
+
+PAYLOAD = os.urandom(2 * 1024 * 1024 + 512 * 1024)  # Three 1 MB ranges, the last one short
+
+
+class VideoServer:
+    """Serves PAYLOAD at /video.mp4 and a redirect to it; records the Range of every GET"""
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.redirect_to = None
+        self.gets = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        # A client closing a stream it only probed is expected, not an error worth a traceback
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handler(self):
+        video = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_headers(self, status, length, extra=()):
+                self.send_response(status)
+                self.send_header('Content-Length', str(length))
+                if video.ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', '"v1"')
+                for name, value in extra:
+                    self.send_header(name, value)
+                self.end_headers()
+
+            def do_HEAD(self):
+                if self.path == '/redirect':
+                    self.send_headers(302, 0, [('Location', video.redirect_to or '/video.mp4')])
+                else:
+                    self.send_headers(200, len(PAYLOAD))
+
+            def do_GET(self):
+                if self.path == '/redirect':
+                    return self.do_HEAD()
+                requested = self.headers.get('Range')
+                with video.lock:
+                    video.gets.append(requested)
+                if video.ranges and requested:
+                    start, end = (int(n) for n in requested.split('=', 1)[1].split('-'))
+                    body = PAYLOAD[start:end + 1]
+                    self.send_headers(206, len(body), [('Content-Range', f'bytes {start}-{end}/{len(PAYLOAD)}')])
+                else:
+                    body = PAYLOAD
+                    self.send_headers(200, len(body))
+                self.wfile.write(body)
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def local_ingest(monkeypatch):
+    """Let ingests reach 127.0.0.1 and fetch in 1 MB ranges"""
+    monkeypatch.setitem(app.app.config, 'INGEST_ALLOW_LOCAL', True)
+    monkeypatch.setitem(app.app.config, 'INGEST_RANGE_MB', 1)
+
+
+@pytest.fixture
+def range_server():
+    server = VideoServer(ranges=True)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def plain_server():
+    server = VideoServer(ranges=False)
+    yield server
+    server.close()
+
+
+def run_ingest(url, stream_split=False):
+    task_id = str(uuid.uuid4())
+    ingest_status[task_id] = {'stage': 'Queued', 'progress': 0, 'done': False, 'error': None}
+    ingest_url(task_id, url, 'test-session', stream_split)
+    return ingest_status[task_id]
+
+
+def uploaded_file(filename='video.mp4'):
+    return os.path.join(app.app.config['UPLOAD_FOLDER'], filename)
+
+
+FAKE_FFPROBE = """
+import os, sys
+sys.stdin.buffer.read()
+print(os.environ.get('FAKE_DURATION', ''))
+"""
+
+# Stands in for the segment muxer: cuts stdin into 1 MB parts and lists each one as it is finished
+FAKE_FFMPEG = """
+import sys
+args = sys.argv[1:]
+list_path = args[args.index('-segment_list') + 1]
+pattern = args[-1]
+data = sys.stdin.buffer.read()
+for index, start in enumerate(range(0, len(data), 1024 * 1024), 1):
+    part_path = pattern.replace('%d', str(index))
+    with open(part_path, 'wb') as f:
+        f.write(data[start:start + 1024 * 1024])
+    with open(list_path, 'a') as f:
+        f.write(part_path.rsplit('/', 1)[1] + ',0,0\\n')
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """ffprobe and ffmpeg on PATH that need no real video; FAKE_DURATION sets what ffprobe reports"""
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, source in (('ffprobe', FAKE_FFPROBE), ('ffmpeg', FAKE_FFMPEG)):
+        path = bin_dir / name
+        path.write_text(f"#!{sys.executable}\n{source}")
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_DURATION', '90.0')
+    monkeypatch.setitem(app.app.config, 'GENERATE_THUMBNAILS', False)
+
+
+def test_ingest_with_ranges(local_ingest, range_server):
+    status = run_ingest(range_server.url + '/video.mp4')
+
+    assert status['done'] and status['progress'] == 100, status
+    assert sorted(range_server.gets) == ['bytes=0-1048575', 'bytes=1048576-2097151', 'bytes=2097152-2621439']
+    with open(uploaded_file(), 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert not os.path.exists(uploaded_file() + '.ranges.json')
+
+
+def test_ingest_without_ranges(local_ingest, plain_server):
+    status = run_ingest(plain_server.url + '/video.mp4')
+
+    assert status['done'], status
+    assert plain_server.gets == [None]
+    with open(uploaded_file(), 'rb') as f:
+        assert f.read() == PAYLOAD
+
+
+def test_interrupted_ingest_resumes_missing_ranges(local_ingest, range_server, tmp_path):
+    url = range_server.url + '/video.mp4'
+    dest = str(tmp_path / 'video.mp4')
+    with open(dest, 'wb') as f:
+        f.write(PAYLOAD[:1024 * 1024])
+        f.truncate(len(PAYLOAD))
+    with open(dest + '.ranges.json', 'w') as f:
+        json.dump({'url': url, 'size': len(PAYLOAD), 'validator': '"v1"', 'done': [0]}, f)
+
+    assert fetch_url_to_file(url, dest) == len(PAYLOAD)
+
+    assert sorted(range_server.gets) == ['bytes=1048576-2097151', 'bytes=2097152-2621439']
+    with open(dest, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+
+def test_ingest_refuses_local_address(monkeypatch, range_server):
+    monkeypatch.setitem(app.app.config, 'INGEST_ALLOW_LOCAL', False)
+
+    status = run_ingest(range_server.url + '/video.mp4')
+
+    assert not status['done']
+    assert 'non-public address 127.0.0.1' in status['error']
+    assert range_server.gets == []
+
+
+def test_every_redirect_hop_is_checked(local_ingest, monkeypatch, range_server, tmp_path):
+    checked = []
+
+    def check(url):
+        checked.append(url)
+        if 'internal.example' in url:
+            raise ValueError("Refusing to fetch from non-public address 10.0.0.5")
+    monkeypatch.setattr(app, 'check_ingest_url', check)
+    range_server.redirect_to = 'http://internal.example/video.mp4'
+
+    with pytest.raises(ValueError, match='non-public'):
+        fetch_url_to_file(range_server.url + '/redirect', str(tmp_path / 'video.mp4'))
+    assert checked == [range_server.url + '/redirect', 'http://internal.example/video.mp4']
+
+
+@pytest.mark.parametrize('address', ['127.0.0.1', '10.1.2.3', '169.254.169.254', '::1', '::ffff:192.168.0.1'])
+def test_check_refuses_non_public_addresses(monkeypatch, address):
+    monkeypatch.setitem(app.app.config, 'INGEST_ALLOW_LOCAL', False)
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    monkeypatch.setattr(app.socket, 'getaddrinfo', lambda *args, **kwargs: [(family, 0, 0, '', (address, 80))])
+
+    with pytest.raises(ValueError, match='non-public'):
+        check_ingest_url('http://videos.example/video.mp4')
+
+
+def test_check_allows_public_addresses_and_rejects_other_schemes(monkeypatch):
+    monkeypatch.setitem(app.app.config, 'INGEST_ALLOW_LOCAL', False)
+    public = [(socket.AF_INET, 0, 0, '', ('93.184.216.34', 80))]
+    monkeypatch.setattr(app.socket, 'getaddrinfo', lambda *args, **kwargs: public)
+
+    check_ingest_url('https://videos.example/video.mp4')
+    with pytest.raises(ValueError, match='http'):
+        check_ingest_url('file:///etc/passwd')
+
+
+def test_stream_ingest_splits_while_downloading(local_ingest, fake_ffmpeg, plain_server):
+    status = run_ingest(plain_server.url + '/video.mkv', stream_split=True)
+
+    assert status['done'], status
+    assert status['split_files'] == ['video_part1.mkv', 'video_part2.mkv', 'video_part3.mkv']
+    assert plain_server.gets == [None]
+    output_folder = os.path.join(app.app.config['BASE_SPLIT_FOLDER'], 'video')
+    parts = b''
+    for part_filename in status['split_files']:
+        with open(os.path.join(output_folder, part_filename), 'rb') as f:
+            parts += f.read()
+    assert parts == PAYLOAD
+    with open(app.find_manifest(output_folder)) as f:
+        manifest = json.load(f)
+    source_hash = hashlib.new(app.HASH_ALGORITHM, PAYLOAD).hexdigest()
+    assert manifest['source'] == {'size': len(PAYLOAD), app.HASH_ALGORITHM: source_hash}
+    assert [part['size'] for part in manifest['parts']] == [1024 * 1024, 1024 * 1024, 512 * 1024]
+
+
+def test_stream_ingest_downloads_when_the_head_has_no_duration(local_ingest, fake_ffmpeg, monkeypatch,
+                                                               range_server):
+    monkeypatch.setenv('FAKE_DURATION', '')
+
+    status = run_ingest(range_server.url + '/video.mkv', stream_split=True)
+
+    assert status['done'] and 'split_files' not in status, status
+    # The probed stream, then the ranged download
+    assert range_server.gets[0] is None and len(range_server.gets) == 4
+    with open(uploaded_file('video.mkv'), 'rb') as f:
+        assert f.read() == PAYLOAD
+
+
+def test_stream_ingest_downloads_mp4_without_fast_start(local_ingest, fake_ffmpeg, plain_server):
+    status = run_ingest(plain_server.url + '/video.mp4', stream_split=True)
+
+    assert status['done'] and 'split_files' not in status, status
+    with open(uploaded_file(), 'rb') as f:
+        assert f.read() == PAYLOAD
+
+
+def test_stream_ingest_downloads_when_the_server_is_busy(local_ingest, fake_ffmpeg, monkeypatch, plain_server):
+    monkeypatch.setattr(app.admission, 'can_start_split', lambda: False)
+
+    status = run_ingest(plain_server.url + '/video.mkv', stream_split=True)
+
+    assert status['done'] and 'split_files' not in status, status
+    with open(uploaded_file('video.mkv'), 'rb') as f:
+        assert f.read() == PAYLOAD
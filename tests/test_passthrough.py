@@ -0,0 +1,110 @@
+"""StreamBuffer hand-off and ChunkedUploader.upload_stream as used by /passthrough"""
+import asyncio
+import hashlib
+import threading
+import time
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from app import HASH_ALGORITHM, ChunkedUploader, StreamBuffer, TelegramAccount, retry_flood_wait
+
+CHUNK_SIZE = 1024
+
+
+def start_put(buffer, data):
+    """put() in a thread, as the request thread does; returns the thread and a list that gets its result"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(buffer.put(data)), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_full_buffer_blocks_put_until_a_chunk_is_taken():
+    buffer = StreamBuffer(2)
+    assert buffer.put(b'a') and buffer.put(b'b')
+
+    thread, result = start_put(buffer, b'c')
+    time.sleep(0.2)
+    assert thread.is_alive() and not result
+
+    assert buffer.get() == b'a'
+    thread.join(2)
+    assert result == [True]
+    assert [buffer.get(), buffer.get()] == [b'b', b'c']
+
+
+def test_abort_releases_blocked_producer():
+    buffer = StreamBuffer(1)
+    buffer.put(b'a')
+    thread, result = start_put(buffer, b'b')
+
+    buffer.abort()
+    thread.join(2)
+
+    assert result == [False]
+    assert buffer.put(b'c') is False
+
+
+def test_abort_releases_waiting_consumer():
+    buffer = StreamBuffer(1)
+    errors = []
+
+    def consume():
+        try:
+            buffer.get()
+        except IOError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    buffer.abort()
+    thread.join(2)
+
+    assert len(errors) == 1
+
+
+def stream_reader(data):
+    """read() for upload_stream over data, one chunk per call"""
+    chunks = iter(data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+
+    async def read():
+        return next(chunks, b'')
+    return read
+
+
+def test_upload_stream_sends_chunks_in_order_with_hash(fake_sender):
+    data = bytes(range(256)) * 18  # 4.5 chunks
+    senders = [fake_sender(), fake_sender()]
+    uploader = ChunkedUploader(None, None, chunk_size=CHUNK_SIZE, senders=senders, window=4)
+
+    uploaded, digest = asyncio.run(uploader.upload_stream(stream_reader(data), len(data), 'video.mp4'))
+
+    requests = sorted(senders[0].requests + senders[1].requests, key=lambda r: r.file_part)
+    assert [r.file_part for r in requests] == [0, 1, 2, 3, 4]
+    assert b''.join(r.bytes for r in requests) == data
+    assert uploaded.md5_checksum == hashlib.md5(data).hexdigest()
+    assert digest == {'size': len(data), HASH_ALGORITHM: hashlib.new(HASH_ALGORITHM, data).hexdigest()}
+
+
+def test_upload_stream_fails_when_stream_ends_early(fake_sender):
+    data = b'x' * (3 * CHUNK_SIZE)
+    uploader = ChunkedUploader(None, None, chunk_size=CHUNK_SIZE, senders=[fake_sender()])
+
+    with pytest.raises(IOError, match='ended after 3072 of 4096 bytes'):
+        asyncio.run(uploader.upload_stream(stream_reader(data), 4 * CHUNK_SIZE, 'video.mp4'))
+
+
+def test_upload_stream_retries_flood_waited_chunk(fake_sender):
+    data = b'y' * (3 * CHUNK_SIZE)
+    sender = fake_sender(fail_on={1: FloodWaitError(request=None, capture=0)})
+    uploader = ChunkedUploader(None, None, chunk_size=CHUNK_SIZE, senders=[sender])
+    account = TelegramAccount('test', None)
+
+    asyncio.run(uploader.upload_stream(
+        stream_reader(data), len(data), 'video.mp4',
+        retry=lambda action: retry_flood_wait(account, action)
+    ))
+
+    assert sender.parts() == [0, 1, 2]
+    assert account.flood_waits == 1
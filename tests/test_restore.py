@@ -0,0 +1,68 @@
+"""download_parts against fake download connections"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import download_parts
+
+
+class FakeDownloader:
+    """iter_download over one payload; fail makes it raise, stall makes it hang until cancelled"""
+    def __init__(self, payload, fail=False, stall=False):
+        self.payload = payload
+        self.fail = fail
+        self.stall = stall
+        self.cancelled = False
+
+    async def iter_download(self, media, offset, request_size, limit):
+        if self.fail:
+            raise ConnectionError('range failed')
+        if self.stall:
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+        for start in range(offset, offset + limit * request_size, request_size):
+            await asyncio.sleep(0)
+            yield self.payload[start:start + request_size]
+
+
+def fake_message(payload):
+    return SimpleNamespace(media=None, file=SimpleNamespace(size=len(payload)))
+
+
+def test_download_parts_writes_every_range(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.app.config, 'RESTORE_CONNECTIONS', 2)
+    monkeypatch.setitem(app.app.config, 'RESTORE_RANGE_MB', 1)
+    payload = bytes(range(256)) * (9 * 1024)  # 2.25 MB, three ranges
+    received = []
+
+    with open(tmp_path / 'restored.mp4', 'w+b') as out:
+        asyncio.run(download_parts(
+            [FakeDownloader(payload), FakeDownloader(payload)], [fake_message(payload)], [(out, 10)],
+            received.append
+        ))
+        out.seek(10)
+        assert out.read() == payload
+    assert sum(received) == len(payload)
+
+
+def test_failed_range_cancels_the_other_connections(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.app.config, 'RESTORE_CONNECTIONS', 2)
+    monkeypatch.setitem(app.app.config, 'RESTORE_RANGE_MB', 1)
+    payload = b'x' * (2 * 1024 * 1024)
+    stalled = FakeDownloader(payload, stall=True)
+
+    async def run(out):
+        with pytest.raises(ConnectionError):
+            await download_parts(
+                [stalled, FakeDownloader(payload, fail=True)], [fake_message(payload)], [(out, 0)], len
+            )
+        # Checked before asyncio.run tears the loop down, which would cancel leftovers anyway
+        return stalled.cancelled
+
+    with open(tmp_path / 'restored.mp4', 'w+b') as out:
+        assert asyncio.run(run(out))
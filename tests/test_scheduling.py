@@ -0,0 +1,41 @@
+"""Split slots and admission for splits that can't wait in the queue"""
+import app
+from app import AdmissionController, SplitScheduler
+
+
+def test_slot_without_wait_only_takes_a_free_slot():
+    scheduler = SplitScheduler(1)
+
+    with scheduler.slot('a', 100) as first:
+        with scheduler.slot('b', 100, wait=False) as second:
+            assert first and not second
+            assert scheduler.stats()['splits_running'] == 1
+    assert scheduler.stats() == {'split_concurrency': 1, 'splits_running': 0, 'splits_waiting': 0}
+
+    with scheduler.slot('b', 100, wait=False) as third:
+        assert third
+
+
+def test_slot_without_wait_does_not_jump_the_queue():
+    scheduler = SplitScheduler(1)
+    # A split that is queued but has not been woken up yet
+    scheduler.waiting.append((1.0, 0))
+
+    with scheduler.slot('b', 100, wait=False) as started:
+        assert not started
+    assert scheduler.running == 0
+
+
+def test_can_start_split_respects_the_ticket_queue(monkeypatch):
+    admission = AdmissionController()
+    monkeypatch.setattr(admission, 'load', lambda: {})
+    assert admission.can_start_split()
+
+    admission.queues['split']['ticket'] = 0
+    assert not admission.can_start_split()
+
+
+def test_can_start_split_refuses_when_overloaded(monkeypatch):
+    admission = AdmissionController()
+    monkeypatch.setattr(admission, 'load', lambda: {'cpu_percent': app.app.config['ADMISSION_MAX_CPU'] + 1})
+    assert not admission.can_start_split()
@@ -0,0 +1,50 @@
+"""Captions of parts sent during a streaming split are corrected to the final part count"""
+import asyncio
+
+from telethon.errors import MessageNotModifiedError
+
+from app import TelegramAccount, get_destination_key, get_part_key, recaption_parts, upload_ledger
+
+
+class FakeClient:
+    """Records edit_message calls; raises MessageNotModifiedError for captions that are already right"""
+    def __init__(self, current):
+        self.current = current
+        self.edits = []
+
+    async def edit_message(self, destination, message_id, caption):
+        if self.current.get((destination, message_id)) == caption:
+            raise MessageNotModifiedError(request=None)
+        self.current[(destination, message_id)] = caption
+        self.edits.append((destination, message_id, caption))
+
+
+def test_recaption_parts_edits_every_destination_and_updates_ledger(tmp_path):
+    account = TelegramAccount('test', None)
+    parts = []
+    for index in (1, 2):
+        path = tmp_path / f'video_part{index}.mp4'
+        path.write_bytes(b'x' * index)
+        parts.append(str(path))
+        for destination, message_id in (('me', 10 + index), (-100123, 20 + index)):
+            upload_ledger.mark_sent(get_part_key(str(path)), get_destination_key(account, destination),
+                                    message_id, f'video.mp4 - Part {index}/4')
+    client = FakeClient({('me', 12): 'video.mp4 - Part 2/3'})
+
+    asyncio.run(recaption_parts(client, account, {
+        parts[0]: 'video.mp4 - Part 1/3',
+        parts[1]: 'video.mp4 - Part 2/3',
+    }, ['me', -100123], None))
+
+    assert client.edits == [
+        ('me', 11, 'video.mp4 - Part 1/3'),
+        (-100123, 21, 'video.mp4 - Part 1/3'),
+        (-100123, 22, 'video.mp4 - Part 2/3'),
+    ]
+    rows = upload_ledger._connect().execute(
+        'SELECT destination, message_id, caption FROM part_sends WHERE message_id IN (11, 12, 21, 22)'
+    )
+    assert sorted(rows) == [
+        ('-100123', 21, 'video.mp4 - Part 1/3'), ('-100123', 22, 'video.mp4 - Part 2/3'),
+        ('me@test', 11, 'video.mp4 - Part 1/3'), ('me@test', 12, 'video.mp4 - Part 2/3'),
+    ]
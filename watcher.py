@@ -0,0 +1,201 @@
+"""Split and upload videos as they land in watched directories.
+
+Usage: python watcher.py <dir> [...] [--jobs 2] [--settle 30] [--interval 10]
+
+Files copied in over rsync/NFS are processed where they are, without a copy in
+UPLOAD_FOLDER. inotify reports files as soon as the writer closes them or they
+are renamed into place; directories it can't see into (NFS written from another
+host) are caught by a periodic scan once a file's size and mtime stop changing.
+Handled files are recorded in the index, so a restart doesn't redo them.
+"""
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, allowed_file, deletion_queue
+from batch import BatchRunner, collect_inputs
+
+logger = logging.getLogger('watcher')
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+
+class Inotify:
+    """Close-write and moved-to events for a set of directories, through libc"""
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.watches = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                err = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(err, os.strerror(err), directory)
+            self.watches[wd] = directory
+        self.overflowed = False
+
+    def read(self, timeout):
+        """Paths finished since the last call, waiting up to timeout seconds for the first"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; the caller rescans
+                self.overflowed = True
+            elif wd in self.watches and name:
+                paths.append(os.path.join(self.watches[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_inotify(directories):
+    """An Inotify for directories, or None where the platform or limits don't allow one"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return Inotify(directories)
+    except (OSError, AttributeError) as e:
+        # ENOSPC means fs.inotify.max_user_watches is used up
+        hint = ' (raise fs.inotify.max_user_watches)' if getattr(e, 'errno', None) == errno.ENOSPC else ''
+        logger.warning(f"inotify unavailable, polling only: {e}{hint}")
+        return None
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+class FolderWatcher:
+    """Finds finished files and hands each version of one to the runner exactly once"""
+    def __init__(self, args, runner):
+        self.args = args
+        self.runner = runner
+        self.executor = ThreadPoolExecutor(max_workers=args.jobs)
+        self.settling = {}  # path -> (signature, time it was first seen with it)
+        self.submitted = {}  # path -> signature last handed to the runner
+
+    def submit(self, path, signature):
+        self.settling.pop(path, None)
+        if self.submitted.get(path) == signature or self.runner.index.is_processed(path):
+            return
+        # A failed version isn't retried until the file changes
+        self.submitted[path] = signature
+        logger.info(f"Queued {path}")
+        self.executor.submit(self.runner.process, path).add_done_callback(self.finished)
+
+    def finished(self, future):
+        if future.exception():
+            logger.error("Watched file failed", exc_info=future.exception())
+            self.runner.count('failed')
+
+    def closed(self, path):
+        """The writer closed the file or renamed it into place: it's complete"""
+        if allowed_file(os.path.basename(path)) and os.path.isfile(path):
+            signature = file_signature(path)
+            if signature:
+                self.submit(path, signature)
+
+    def scan(self):
+        """Submit files whose size and mtime have held still for --settle seconds"""
+        now = time.time()
+        found = set(collect_inputs(self.args.directories))
+        for path in found:
+            signature = file_signature(path)
+            if not signature or self.submitted.get(path) == signature:
+                continue
+            seen = self.settling.get(path)
+            if not seen or seen[0] != signature:
+                self.settling[path] = (signature, now)
+            elif now - seen[1] >= self.args.settle:
+                self.submit(path, signature)
+        for path in list(self.settling):
+            if path not in found:
+                del self.settling[path]
+
+    def run(self):
+        inotify = open_inotify(self.args.directories)
+        logger.info(f"Watching {', '.join(self.args.directories)} "
+                    f"({'inotify' if inotify else 'polling'}, {self.args.jobs} jobs)")
+        next_scan = 0
+        try:
+            while True:
+                if time.time() >= next_scan:
+                    # Also catches files that arrived while the watcher was down
+                    self.scan()
+                    next_scan = time.time() + self.args.interval
+                timeout = max(0, next_scan - time.time())
+                if not inotify:
+                    time.sleep(timeout)
+                    continue
+                for path in inotify.read(timeout):
+                    self.closed(path)
+                if inotify.overflowed:
+                    inotify.overflowed = False
+                    next_scan = 0
+        finally:
+            if inotify:
+                inotify.close()
+            self.executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directories', nargs='+', help='Directories to watch (not recursive)')
+    parser.add_argument('--output', default=app.config['BASE_SPLIT_FOLDER'])
+    parser.add_argument('--manifest', default='watch_index.json', help='Processed-file index')
+    parser.add_argument('--part-size-mb', type=int, help="Default: the upload accounts' limit (4000 with Premium)")
+    parser.add_argument('--jobs', type=int, default=2, help='Files in flight at once')
+    parser.add_argument('--split-workers', type=int, default=2, help='Concurrent ffmpeg splits')
+    parser.add_argument('--upload-workers', type=int, default=1, help='Concurrent Telegram uploads')
+    parser.add_argument('--settle', type=float, default=30, help='Seconds a polled file must stay unchanged')
+    parser.add_argument('--interval', type=float, default=10, help='Seconds between directory scans')
+    parser.add_argument('--no-upload', action='store_true', help='Only split')
+    parser.add_argument('--keep-parts', action='store_true', help='Keep split parts after uploading them')
+    args = parser.parse_args()
+    args.directories = [os.path.abspath(d) for d in args.directories]
+    missing = [d for d in args.directories if not os.path.isdir(d)]
+    if missing:
+        sys.exit(f"Not a directory: {', '.join(missing)}")
+    os.makedirs(args.output, exist_ok=True)
+
+    watcher = FolderWatcher(args, BatchRunner(args))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        deletion_queue.drain()
+        stats = watcher.runner.stats
+        print(f"processed {stats['processed']}, skipped {stats['skipped']}, failed {stats['failed']}")
+
+
+if __name__ == '__main__':
+    main()
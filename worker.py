@@ -0,0 +1,182 @@
+"""Run split and upload jobs that the web tier queued in a shared job store.
+
+Usage: JOB_STORE=/shared/jobs.db python worker.py [--kinds split,upload] [--slots 2]
+
+Give every web and worker node the same JOB_STORE, UPLOAD_FOLDER and
+BASE_SPLIT_FOLDER on shared storage. Each worker claims jobs under a lease and
+renews it while they run, writing progress to the store for the web tier to
+report. If a node dies, its jobs go back to the queue once their leases run out.
+A job whose lease is lost anyway is killed, so it never runs on two nodes.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import multiprocessing
+
+from app import app, job_store, split_upload, background_upload, progress_dict, upload_status
+
+logger = logging.getLogger('worker')
+
+
+def run_split(job_id, params):
+    return split_upload(**params)
+
+
+def run_upload(job_id, params):
+    # Folders are resolved on this node, whose BASE_SPLIT_FOLDER may be mounted elsewhere
+    output_folder = os.path.join(app.config['BASE_SPLIT_FOLDER'], params['folder_name'])
+    background_upload(job_id, output_folder, params['filename'], params['destinations'], params['session_id'])
+    status = upload_status.get(job_id, {})
+    if not status.get('done'):
+        raise Exception(status.get('error') or 'Upload failed')
+
+
+def split_progress(key):
+    return {'progress': round(progress_dict.get(key, 0), 2)}
+
+
+def upload_progress(key):
+    return upload_status.get(key)
+
+
+# kind -> (function running the job, progress snapshot for its key)
+JOB_KINDS = {
+    'split': (run_split, split_progress),
+    'upload': (run_upload, upload_progress),
+}
+
+
+def with_store_retry(action, attempts=5):
+    """Run a job store call, retrying while SQLite reports the database locked or busy"""
+    for attempt in range(attempts):
+        try:
+            return action()
+        except sqlite3.OperationalError as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f"Job store busy, retrying: {e}")
+            time.sleep(1 + attempt)
+
+
+def abandon_job():
+    """Kill this job process and the ffmpeg processes it started"""
+    if hasattr(os, 'killpg'):
+        os.killpg(os.getpgrp(), signal.SIGKILL)
+    os._exit(1)
+
+
+def heartbeat(worker_id, job_id, key, snapshot, finished):
+    last_renewed = time.time()
+    while not finished.wait(app.config['JOB_HEARTBEAT_SECONDS']):
+        try:
+            owned = job_store.heartbeat(job_id, worker_id, snapshot(key))
+            if owned:
+                last_renewed = time.time()
+        except sqlite3.OperationalError as e:
+            # The lease outlasts several heartbeats, so a missed one is harmless
+            logger.warning(f"Could not renew the lease on job {job_id}: {e}")
+            owned = time.time() - last_renewed < app.config['JOB_LEASE_SECONDS']
+        if not owned:
+            # Another worker may already be running it; carrying on would split or post it twice
+            logger.error(f"Lost the lease on job {job_id}; stopping it")
+            abandon_job()
+
+
+def run_job_process(worker_id, job_id, kind, key, params):
+    """Run one claimed job in its own process group, so a lost lease can stop it with its children"""
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    run, snapshot = JOB_KINDS[kind]
+    finished = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(worker_id, job_id, key, snapshot, finished), daemon=True)
+    beat.start()
+    result = error = None
+    try:
+        result = run(job_id, params)
+        logger.info(f"Finished {kind} job {job_id}")
+    except Exception as e:
+        logger.exception(f"{kind} job {job_id} failed")
+        error = str(e)
+    finally:
+        finished.set()
+        beat.join()
+    with_store_retry(lambda: job_store.finish(job_id, worker_id, result, error, snapshot(key)))
+
+
+class Worker:
+    """Claims jobs from the store and runs each in a child process"""
+    def __init__(self, worker_id, kinds, slots, poll_interval):
+        self.worker_id = worker_id
+        self.kinds = kinds
+        self.slots = threading.Semaphore(slots)
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        # spawn: the child gets fresh SQLite connections and no threads from this process
+        self.context = multiprocessing.get_context('spawn')
+
+    def claim(self):
+        try:
+            return with_store_retry(lambda: job_store.claim(self.worker_id, self.kinds))
+        except sqlite3.OperationalError as e:
+            logger.error(f"Could not claim a job: {e}")
+            return None
+
+    def reap(self, process, job_id):
+        process.join()
+        if process.exitcode:
+            # Its lease runs out and another worker retries it, up to JOB_MAX_ATTEMPTS
+            logger.warning(f"Process of job {job_id} exited with {process.exitcode}")
+        self.slots.release()
+
+    def run(self):
+        logger.info(f"Worker {self.worker_id} taking {', '.join(self.kinds)} jobs")
+        while not self.stopping.is_set():
+            self.slots.acquire()
+            job = self.claim()
+            if job is None:
+                self.slots.release()
+                self.stopping.wait(self.poll_interval)
+                continue
+            job_id, kind, key, params = job
+            logger.info(f"Claimed {kind} job {job_id} ({key})")
+            process = self.context.Process(target=run_job_process, args=(self.worker_id, *job))
+            process.start()
+            threading.Thread(target=self.reap, args=(process, job_id)).start()
+
+    def stop(self):
+        """Stop claiming; jobs already running are left to finish"""
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--kinds', default=','.join(JOB_KINDS), help='Job kinds to take, comma-separated')
+    parser.add_argument('--slots', type=int, default=2, help='Jobs run at once on this node')
+    parser.add_argument('--poll', type=float, default=2, help='Seconds between claims while the queue is empty')
+    parser.add_argument('--id', default=f"{socket.gethostname()}-{os.getpid()}", help='Worker name in the store')
+    args = parser.parse_args()
+    if job_store is None:
+        sys.exit("JOB_STORE is not set")
+    kinds = [k.strip() for k in args.kinds.split(',') if k.strip()]
+    unknown = [k for k in kinds if k not in JOB_KINDS]
+    if unknown or not kinds:
+        sys.exit(f"Unknown job kinds: {', '.join(unknown)}" if unknown else "No job kinds given")
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['BASE_SPLIT_FOLDER'], exist_ok=True)
+
+    worker = Worker(args.id, kinds, args.slots, args.poll)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+        logger.info("Stopping; waiting for running jobs to finish")
+
+
+if __name__ == '__main__':
+    main()